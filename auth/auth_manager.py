@@ -1,4 +1,5 @@
 from fastapi import HTTPException, Depends, status
+from core.request_timing import request_phase
 from utils.config_loader import config_loader
 from utils.setting import settings
 from fastapi.security import OAuth2PasswordBearer
@@ -8,11 +9,12 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def user_token_auth(api_token: str = Depends(oauth2_scheme)):
     try:
-        _, user_configs = config_loader.load_configs()
-        
-        # Check if the api_token is valid
-        if api_token not in user_configs:
-            raise ValueError("Invalid user key")
+        with request_phase("auth"):
+            _, user_configs = config_loader.load_configs()
+
+            # Check if the api_token is valid
+            if api_token not in user_configs:
+                raise ValueError("Invalid user key")
         
     except ValueError as ve:
         raise HTTPException(
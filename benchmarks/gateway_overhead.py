@@ -0,0 +1,671 @@
+"""
+Latency, throughput and memory the gateway adds on top of its upstream.
+
+Starts a mock OpenAI compatible backend (/v1/chat/completions and
+/v1/completions, streaming or not, with a configurable latency and
+tokens per second) and the gateway from main.py routed to it, each in its
+own process. The same load is then sent to the mock directly and through
+the gateway:
+
+    latency      closed loop at every --concurrency level, per endpoint and
+                 stream mode: p50 / p99 latency (and time to first chunk)
+                 of both, and their difference as the gateway-added latency
+    fixed_rps    open loop at every --rps rate, latencies measured from the
+                 scheduled send time so that a slow gateway is not hidden by
+                 fewer requests being sent
+    max_rps      closed loop at --max-rps-concurrency: requests per second
+                 per CPU second of the gateway processes
+    streaming    streams of --stream-tokens chunks: chunks per second and
+                 gateway CPU time per chunk
+    open_streams gateway RSS added per open (slowly generated) stream
+
+The results are written as JSON (--output) and can be compared with the
+results of an earlier run (--compare). CPU and memory are read from /proc
+(Linux only). The load generator runs on the same machine: its CPU usage
+is reported as well, rates it can not sustain are not gateway limits.
+
+    python -m benchmarks.gateway_overhead [--concurrency 1,16,64] [--rps 50,200]
+        [--latency 0.02] [--tokens-per-second 1000] [--output results.json]
+        [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import (Dict, List, Optional, Tuple)
+import httpx
+import yaml
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# model names of the mock: "bench" generates at --tokens-per-second, "bench-slow" at --slow-tokens-per-second
+MOCK_MODEL = "bench"
+SLOW_MODEL = "bench-slow"
+GATEWAY_TOKEN = "sk-ezllm-bench"
+# key: endpoint --> value: path of the OpenAI API
+ENDPOINTS = {
+    "chat": "/v1/chat/completions",
+    "completion": "/v1/completions",
+}
+
+
+##### mock backend #####
+
+def make_mock_app(latency: float, tokens_per_second: float, slow_tokens_per_second: float, output_tokens: int):
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import (JSONResponse,
+                                     StreamingResponse)
+    from starlette.routing import Route
+
+    def make_chunk(is_chat: bool, request_id: str, model: str, text: Optional[str],
+                   finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> bytes:
+        if is_chat:
+            choices = [] if usage else [{"index": 0, "delta": {"content": text} if text else {},
+                                         "finish_reason": finish_reason}]
+            chunk = {"id": request_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices}
+        else:
+            choices = [] if usage else [{"index": 0, "text": text or "", "logprobs": None,
+                                         "finish_reason": finish_reason}]
+            chunk = {"id": request_id, "object": "text_completion", "created": int(time.time()),
+                     "model": model, "choices": choices}
+        if usage:
+            chunk["usage"] = usage
+        return b"data: " + json.dumps(chunk).encode() + b"\n\n"
+
+    async def generate(request: Request):
+        body = await request.json()
+        is_chat = request.url.path.endswith("/chat/completions")
+        model = body.get("model", MOCK_MODEL)
+        rate = slow_tokens_per_second if model.endswith(SLOW_MODEL) else tokens_per_second
+        completion_tokens = int(body.get("max_tokens") or output_tokens)
+        usage = {"prompt_tokens": 16, "completion_tokens": completion_tokens, "total_tokens": 16 + completion_tokens}
+        request_id = f"{'chatcmpl' if is_chat else 'cmpl'}-{uuid.uuid4().hex}"
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            if rate > 0:
+                await asyncio.sleep(completion_tokens / rate)
+            text = "".join(f" tok{i}" for i in range(completion_tokens))
+            if is_chat:
+                choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "length"}
+                response = {"id": request_id, "object": "chat.completion", "created": int(time.time()),
+                            "model": model, "choices": [choice], "usage": usage}
+            else:
+                choice = {"index": 0, "text": text, "logprobs": None, "finish_reason": "length"}
+                response = {"id": request_id, "object": "text_completion", "created": int(time.time()),
+                            "model": model, "choices": [choice], "usage": usage}
+            return JSONResponse(response)
+
+        async def stream():
+            for i in range(completion_tokens):
+                if i and rate > 0:
+                    await asyncio.sleep(1 / rate)
+                # distinct chunks, litellm rejects streams repeating the same chunk
+                yield make_chunk(is_chat, request_id, model, f" tok{i}")
+            yield make_chunk(is_chat, request_id, model, None, finish_reason="length")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield make_chunk(is_chat, request_id, model, None, usage=usage)
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route(path, generate, methods=["POST"]) for path in ENDPOINTS.values()])
+
+
+def serve_mock(args) -> None:
+    import uvicorn
+    app = make_mock_app(args.latency, args.tokens_per_second, args.slow_tokens_per_second, args.output_tokens)
+    uvicorn.run(app, host="127.0.0.1", port=args.mock_port, log_level="warning", access_log=False)
+
+
+##### processes #####
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_process_tree(pid: int) -> List[int]:
+    """The process and its descendants (the uvicorn workers)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, index = [pid], 0
+    while index < len(pids):
+        pids.extend(children.get(pids[index], ()))
+        index += 1
+    return pids
+
+
+def get_cpu_seconds(pid: int) -> float:
+    """User + system CPU seconds of the process tree."""
+    total = 0
+    for tree_pid in get_process_tree(pid):
+        try:
+            with open(f"/proc/{tree_pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime, fields 14 and 15 of proc(5)
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def get_rss_bytes(pid: int) -> int:
+    """Resident memory of the process tree."""
+    total = 0
+    for tree_pid in get_process_tree(pid):
+        try:
+            with open(f"/proc/{tree_pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def write_gateway_configs(config_dir: str, mock_base: str, args) -> None:
+    os.makedirs(config_dir, exist_ok=True)
+    pool = {"max_connections": max(args.open_streams, args.max_rps_concurrency, *args.concurrency) * 2}
+
+    def model(model_name: str, upstream_model: str, **gateway_params) -> dict:
+        return {"model_name": model_name,
+                "litellm_params": {"model": upstream_model, "api_base": mock_base, "api_key": "sk-mock"},
+                **gateway_params}
+
+    routing_configs = {
+        "router_settings": {"routing_strategy": "round_robin", "connection_pool": pool},
+        "model_list": [
+            model(MOCK_MODEL, f"openai/{MOCK_MODEL}"),
+            model(SLOW_MODEL, f"openai/{SLOW_MODEL}"),
+            model(f"{MOCK_MODEL}-passthrough", f"hosted_vllm/{MOCK_MODEL}", passthrough=True),
+        ],
+    }
+    user_configs = {"user_list": [{"user_token": GATEWAY_TOKEN,
+                                   "user_profile": {"id": "bench", "name": "bench", "project": "bench",
+                                                    "org": "bench"}}]}
+    with open(os.path.join(config_dir, "routing_configs.yaml"), "w") as f:
+        yaml.safe_dump(routing_configs, f)
+    with open(os.path.join(config_dir, "user_configs.yaml"), "w") as f:
+        yaml.safe_dump(user_configs, f)
+
+
+def start_process(command: List[str], cwd: str, env: dict, log_path: str) -> subprocess.Popen:
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_ready(process: subprocess.Popen, url: str, log_path: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                with open(log_path, errors="replace") as f:
+                    raise RuntimeError(f"{url} exited with {process.returncode}:\n{f.read()[-4000:]}")
+            try:
+                await client.post(url, json={})
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout} seconds")
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+##### load #####
+
+class Target:
+    """Where the load is sent: the mock directly or the gateway."""
+    __slots__ = ("name", "base_url", "model", "headers", "pid")
+
+    def __init__(self, name: str, base_url: str, model: str, headers: Optional[dict] = None,
+                 pid: Optional[int] = None):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.headers = headers or {}
+        # gateway process whose CPU usage is measured
+        self.pid = pid
+
+
+class Sample:
+    __slots__ = ("latency", "first_chunk", "chunks", "ok")
+
+    def __init__(self, latency: float, first_chunk: Optional[float], chunks: int, ok: bool):
+        self.latency = latency
+        self.first_chunk = first_chunk
+        self.chunks = chunks
+        self.ok = ok
+
+
+async def send_request(client: httpx.AsyncClient, target: Target, endpoint: str, stream: bool,
+                       max_tokens: int, start: Optional[float] = None, on_first_chunk=None) -> Sample:
+    """One request; `start` (perf_counter) defaults to now, the scheduled send time of open loop load."""
+    start = time.perf_counter() if start is None else start
+    body = {"model": target.model, "max_tokens": max_tokens, "stream": stream}
+    if endpoint == "chat":
+        body["messages"] = [{"role": "user", "content": "Benchmark the gateway overhead."}]
+    else:
+        body["prompt"] = "Benchmark the gateway overhead."
+    first_chunk, chunks = None, 0
+    try:
+        if not stream:
+            response = await client.post(target.base_url + ENDPOINTS[endpoint], json=body, headers=target.headers)
+            await response.aread()
+            return Sample(time.perf_counter() - start, None, 0, response.status_code == 200)
+
+        async with client.stream("POST", target.base_url + ENDPOINTS[endpoint], json=body,
+                                 headers=target.headers) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                    if on_first_chunk is not None:
+                        on_first_chunk()
+                chunks += 1
+            return Sample(time.perf_counter() - start, first_chunk, chunks, response.status_code == 200)
+    except httpx.HTTPError:
+        return Sample(time.perf_counter() - start, first_chunk, chunks, False)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest rank percentile, None without values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def to_ms(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000, 3)
+
+
+def summarize(samples: List[Sample], elapsed: float, cpu_seconds: Optional[float] = None) -> dict:
+    ok_samples = [sample for sample in samples if sample.ok]
+    latencies = [sample.latency for sample in ok_samples]
+    first_chunks = [sample.first_chunk for sample in ok_samples if sample.first_chunk is not None]
+    summary = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok_samples),
+        "rps": round(len(ok_samples) / elapsed, 2),
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+    }
+    if first_chunks:
+        summary["first_chunk_p50_ms"] = to_ms(percentile(first_chunks, 50))
+        summary["first_chunk_p99_ms"] = to_ms(percentile(first_chunks, 99))
+    if cpu_seconds is not None:
+        summary["gateway_cpu_seconds"] = round(cpu_seconds, 3)
+    return summary
+
+
+def get_overhead(direct: dict, gateway: dict) -> dict:
+    """Gateway-added latency: difference of the percentiles through the gateway and direct."""
+    overhead = {}
+    for key in ("p50_ms", "p99_ms", "first_chunk_p50_ms", "first_chunk_p99_ms"):
+        if direct.get(key) is not None and gateway.get(key) is not None:
+            overhead[key] = round(gateway[key] - direct[key], 3)
+    return overhead
+
+
+async def run_closed_loop(client: httpx.AsyncClient, target: Target, endpoint: str, stream: bool,
+                          max_tokens: int, concurrency: int, requests: Optional[int] = None,
+                          duration: Optional[float] = None) -> Tuple[List[Sample], float, Optional[float]]:
+    """`concurrency` clients sending requests back to back, until `requests` were sent or `duration` elapsed."""
+    samples: List[Sample] = []
+    sent = 0
+    cpu_start = get_cpu_seconds(target.pid) if target.pid else None
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    async def worker():
+        nonlocal sent
+        while (requests is None or sent < requests) and (deadline is None or time.perf_counter() < deadline):
+            sent += 1
+            samples.append(await send_request(client, target, endpoint, stream, max_tokens))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    cpu_seconds = get_cpu_seconds(target.pid) - cpu_start if target.pid else None
+    return samples, elapsed, cpu_seconds
+
+
+async def run_open_loop(client: httpx.AsyncClient, target: Target, endpoint: str, stream: bool,
+                        max_tokens: int, rps: float, duration: float) -> Tuple[List[Sample], float, Optional[float]]:
+    """Requests sent at a fixed rate whatever the latency, measured from the time they were due."""
+    cpu_start = get_cpu_seconds(target.pid) if target.pid else None
+    start = time.perf_counter()
+    tasks = []
+    for i in range(int(rps * duration)):
+        due = start + i / rps
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_request(client, target, endpoint, stream, max_tokens, start=due)))
+    samples = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    cpu_seconds = get_cpu_seconds(target.pid) - cpu_start if target.pid else None
+    return list(samples), elapsed, cpu_seconds
+
+
+async def bench_latency(client: httpx.AsyncClient, targets: List[Target], args) -> List[dict]:
+    results = []
+    for concurrency in args.concurrency:
+        for endpoint in ENDPOINTS:
+            for stream in (False, True):
+                result = {"concurrency": concurrency, "endpoint": endpoint, "stream": stream}
+                for target in targets:
+                    samples, elapsed, cpu_seconds = await run_closed_loop(
+                        client, target, endpoint, stream, args.output_tokens, concurrency, requests=args.requests)
+                    result[target.name] = summarize(samples, elapsed, cpu_seconds)
+                    if target.name != "direct":
+                        result[target.name]["overhead"] = get_overhead(result["direct"], result[target.name])
+                results.append(result)
+                print_result(f"latency c={concurrency} {endpoint}{' stream' if stream else ''}", result)
+    return results
+
+
+async def bench_fixed_rps(client: httpx.AsyncClient, targets: List[Target], args) -> List[dict]:
+    results = []
+    for rps in args.rps:
+        result = {"rps": rps, "endpoint": "chat", "stream": False}
+        for target in targets:
+            samples, elapsed, cpu_seconds = await run_open_loop(
+                client, target, "chat", False, args.output_tokens, rps, args.duration)
+            result[target.name] = summarize(samples, elapsed, cpu_seconds)
+            if target.name != "direct":
+                result[target.name]["overhead"] = get_overhead(result["direct"], result[target.name])
+        results.append(result)
+        print_result(f"fixed rps={rps}", result)
+    return results
+
+
+async def bench_max_rps(client: httpx.AsyncClient, targets: List[Target], args) -> dict:
+    result = {"concurrency": args.max_rps_concurrency, "endpoint": "chat", "stream": False}
+    for target in targets:
+        if target.pid is None:
+            continue
+        client_cpu_start = time.process_time()
+        samples, elapsed, cpu_seconds = await run_closed_loop(
+            client, target, "chat", False, args.output_tokens, args.max_rps_concurrency, duration=args.duration)
+        summary = summarize(samples, elapsed, cpu_seconds)
+        summary["gateway_cores"] = round(cpu_seconds / elapsed, 2)
+        summary["client_cores"] = round((time.process_time() - client_cpu_start) / elapsed, 2)
+        ok_requests = summary["requests"] - summary["errors"]
+        summary["rps_per_core"] = round(ok_requests / cpu_seconds, 1) if cpu_seconds else None
+        result[target.name] = summary
+    print_result(f"max rps c={args.max_rps_concurrency}", result)
+    return result
+
+
+async def bench_streaming(client: httpx.AsyncClient, targets: List[Target], args) -> dict:
+    result = {"concurrency": args.stream_concurrency, "endpoint": "chat", "stream": True,
+              "tokens_per_stream": args.stream_tokens}
+    for target in targets:
+        samples, elapsed, cpu_seconds = await run_closed_loop(
+            client, target, "chat", True, args.stream_tokens, args.stream_concurrency, duration=args.duration)
+        summary = summarize(samples, elapsed, cpu_seconds)
+        chunks = sum(sample.chunks for sample in samples if sample.ok)
+        summary["chunks_per_second"] = round(chunks / elapsed, 1)
+        if cpu_seconds is not None and chunks:
+            summary["gateway_cpu_us_per_chunk"] = round(cpu_seconds / chunks * 1e6, 2)
+        result[target.name] = summary
+    print_result(f"streaming c={args.stream_concurrency}", result)
+    return result
+
+
+async def bench_open_streams(client: httpx.AsyncClient, gateway: Target, args) -> dict:
+    """RSS of the gateway with --open-streams slowly generated streams open, relative to idle."""
+    slow_target = Target(gateway.name, gateway.base_url, SLOW_MODEL, gateway.headers, gateway.pid)
+    ready = asyncio.Event()
+    started = 0
+
+    def on_first_chunk():
+        nonlocal started
+        started += 1
+        if started == args.open_streams:
+            ready.set()
+
+    idle_rss = get_rss_bytes(gateway.pid)
+    # the slow model generates for far longer than the measurement takes
+    tasks = [asyncio.create_task(send_request(client, slow_target, "chat", True, 1_000_000,
+                                              on_first_chunk=on_first_chunk))
+             for _ in range(args.open_streams)]
+    try:
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            # measured with the streams that did start, the others failed or are stuck
+            pass
+        # let the first chunks of all streams go through the gateway
+        await asyncio.sleep(1)
+        open_rss = get_rss_bytes(gateway.pid)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    result = {
+        "open_streams": started,
+        "errors": args.open_streams - started,
+        "idle_rss_mb": round(idle_rss / 2 ** 20, 2),
+        "open_rss_mb": round(open_rss / 2 ** 20, 2),
+        "kb_per_stream": round((open_rss - idle_rss) / started / 1024, 2) if started else None,
+    }
+    print(f"open streams            {started} of {args.open_streams} streams   "
+          f"rss {result['idle_rss_mb']} -> {result['open_rss_mb']} MB   {result['kb_per_stream']} KB/stream")
+    return result
+
+
+##### report #####
+
+def print_result(name: str, result: dict) -> None:
+    for key, summary in result.items():
+        if not isinstance(summary, dict):
+            continue
+        line = f"{name:<32} {key:<20} rps {summary['rps']:>9.1f}   p50 {summary['p50_ms']} ms   p99 {summary['p99_ms']} ms"
+        if "first_chunk_p50_ms" in summary:
+            line += f"   first chunk p50 {summary['first_chunk_p50_ms']} ms"
+        for extra in ("rps_per_core", "chunks_per_second", "gateway_cpu_us_per_chunk"):
+            if summary.get(extra) is not None:
+                line += f"   {extra} {summary[extra]}"
+        if summary["errors"]:
+            line += f"   errors {summary['errors']}"
+        if summary.get("overhead"):
+            line += f"   overhead p50 {summary['overhead'].get('p50_ms')} ms p99 {summary['overhead'].get('p99_ms')} ms"
+        print(line)
+
+
+def get_headline_metrics(results: dict) -> Dict[str, float]:
+    """Flat metrics of a run, lower is better unless the name ends with `/s` or `per_core`."""
+    metrics = {}
+    for result in results.get("latency", []):
+        name = f"latency c={result['concurrency']} {result['endpoint']}{' stream' if result['stream'] else ''}"
+        for target in ("gateway", "passthrough"):
+            for key, value in ((result.get(target) or {}).get("overhead") or {}).items():
+                metrics[f"{name} {target} overhead {key}"] = value
+    for result in results.get("fixed_rps", []):
+        for target in ("gateway", "passthrough"):
+            for key, value in ((result.get(target) or {}).get("overhead") or {}).items():
+                metrics[f"fixed rps={result['rps']} {target} overhead {key}"] = value
+    for target, summary in (results.get("max_rps") or {}).items():
+        if isinstance(summary, dict) and summary.get("rps_per_core") is not None:
+            metrics[f"max rps {target} rps_per_core"] = summary["rps_per_core"]
+    for target, summary in (results.get("streaming") or {}).items():
+        if isinstance(summary, dict):
+            metrics[f"streaming {target} chunks/s"] = summary["chunks_per_second"]
+            if summary.get("gateway_cpu_us_per_chunk") is not None:
+                metrics[f"streaming {target} gateway_cpu_us_per_chunk"] = summary["gateway_cpu_us_per_chunk"]
+    if (results.get("open_streams") or {}).get("kb_per_stream") is not None:
+        metrics["open streams kb_per_stream"] = results["open_streams"]["kb_per_stream"]
+    return metrics
+
+
+def print_comparison(baseline: dict, results: dict) -> None:
+    baseline_metrics = get_headline_metrics(baseline)
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta'].get('timestamp')})")
+    for name, value in get_headline_metrics(results).items():
+        baseline_value = baseline_metrics.get(name)
+        if baseline_value is None:
+            continue
+        change = f"{(value - baseline_value) / abs(baseline_value) * 100:+7.1f}%" if baseline_value else ""
+        print(f"{name:<64} {baseline_value:>10} -> {value:<10} {change}")
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+##### main #####
+
+async def run(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="ezllm-bench-")
+    mock_port, gateway_port = args.mock_port or get_free_port(), get_free_port()
+    mock_base = f"http://127.0.0.1:{mock_port}/v1"
+    mock_command = [sys.executable, "-m", "benchmarks.gateway_overhead", "--serve-mock",
+                    "--mock-port", str(mock_port), "--latency", str(args.latency),
+                    "--tokens-per-second", str(args.tokens_per_second),
+                    "--slow-tokens-per-second", str(args.slow_tokens_per_second),
+                    "--output-tokens", str(args.output_tokens)]
+    mock_log = os.path.join(work_dir, "mock.log")
+    mock = start_process(mock_command, REPO_DIR, dict(os.environ, PYTHONPATH=REPO_DIR), mock_log)
+
+    # the gateway runs in its own directory, with the configs and data (usage ledger, ...) of the benchmark
+    write_gateway_configs(os.path.join(work_dir, "config"), mock_base, args)
+    gateway_env = dict(os.environ, PYTHONPATH=REPO_DIR, PORT=str(gateway_port), EZLLM_WORKERS=str(args.workers),
+                       PROMETHEUS_MULTIPROC_DIR=os.path.join(work_dir, "prometheus"))
+    if args.workers <= 1:
+        gateway_env.pop("PROMETHEUS_MULTIPROC_DIR")
+    gateway_log = os.path.join(work_dir, "gateway.log")
+    gateway = start_process([sys.executable, os.path.join(REPO_DIR, "main.py")], work_dir, gateway_env, gateway_log)
+
+    gateway_base = f"http://127.0.0.1:{gateway_port}"
+    headers = {"Authorization": f"Bearer {GATEWAY_TOKEN}"}
+    targets = [Target("direct", mock_base[:-len("/v1")], MOCK_MODEL),
+               Target("gateway", gateway_base, MOCK_MODEL, headers, pid=gateway.pid)]
+    if args.passthrough:
+        targets.append(Target("passthrough", gateway_base, f"{MOCK_MODEL}-passthrough", headers, pid=gateway.pid))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        },
+    }
+    try:
+        await wait_until_ready(mock, mock_base + "/chat/completions", mock_log)
+        await wait_until_ready(gateway, gateway_base + "/v1/chat/completions", gateway_log)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+            # connection pools, litellm clients and lazily built state of the gateway
+            for target in targets:
+                for endpoint in ENDPOINTS:
+                    for stream in (False, True):
+                        await run_closed_loop(client, target, endpoint, stream, args.output_tokens, 4, requests=20)
+
+            if "latency" in args.scenarios:
+                results["latency"] = await bench_latency(client, targets, args)
+            if "fixed_rps" in args.scenarios:
+                results["fixed_rps"] = await bench_fixed_rps(client, targets, args)
+            if "max_rps" in args.scenarios:
+                results["max_rps"] = await bench_max_rps(client, targets, args)
+            if "streaming" in args.scenarios:
+                results["streaming"] = await bench_streaming(client, targets, args)
+            if "open_streams" in args.scenarios:
+                results["open_streams"] = await bench_open_streams(client, targets[1], args)
+    finally:
+        stop_process(gateway)
+        stop_process(mock)
+        if args.keep_logs:
+            print(f"logs kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def parse_list(value: str, cast=float) -> list:
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=lambda value: parse_list(value, str),
+                        default=["latency", "fixed_rps", "max_rps", "streaming", "open_streams"])
+    parser.add_argument("--concurrency", type=lambda value: parse_list(value, int), default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="requests per latency run")
+    parser.add_argument("--rps", type=parse_list, default=[50, 200])
+    parser.add_argument("--duration", type=float, default=10, help="seconds of the fixed rps, max rps and streaming runs")
+    parser.add_argument("--max-rps-concurrency", type=int, default=64)
+    parser.add_argument("--stream-concurrency", type=int, default=16)
+    parser.add_argument("--stream-tokens", type=int, default=512)
+    parser.add_argument("--open-streams", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1, help="gateway worker processes")
+    parser.add_argument("--passthrough", action="store_true", help="also measure a passthrough model")
+    # mock backend
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds before the first token of the mock")
+    parser.add_argument("--tokens-per-second", type=float, default=1000, help="0 generates without pacing")
+    parser.add_argument("--slow-tokens-per-second", type=float, default=1)
+    parser.add_argument("--output-tokens", type=int, default=16)
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--serve-mock", action="store_true", help="only run the mock backend")
+    # results
+    parser.add_argument("--output", default=os.path.join("data", "benchmarks",
+                                                         time.strftime("gateway_overhead-%Y%m%d-%H%M%S.json")))
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--keep-logs", action="store_true", help="keep the mock and gateway logs")
+    args = parser.parse_args()
+
+    if args.serve_mock:
+        serve_mock(args)
+        return
+
+    results = asyncio.run(run(args))
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Per-request CPU cost of recording the success metrics of a request.
+
+Compares the previous PrometheusLogger callbacks (stdout writes, label
+resolution on every observation) with the cached children and batched
+recorder of integrations.prometheus. stdout is redirected to /dev/null,
+so the legacy numbers are a lower bound of the cost of writing to a pipe
+or a terminal.
+
+    python -m benchmarks.prometheus_logging [--requests 20000] [--users 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+from datetime import datetime, timedelta
+from integrations.prometheus import PrometheusLogger
+
+
+def make_kwargs(i: int, users: int) -> dict:
+    start_time = datetime.now()
+    api_call_start_time = start_time + timedelta(milliseconds=2)
+    return {
+        "model": f"llama3.1-8b-instruct-{i % 4}",
+        "user": f"user-{i % users}",
+        "stream": True,
+        "standard_logging_object": {"prompt_tokens": 120, "completion_tokens": 80, "total_tokens": 200},
+        "start_time": start_time,
+        "api_call_start_time": api_call_start_time,
+        "completion_start_time": api_call_start_time + timedelta(milliseconds=150),
+        "end_time": api_call_start_time + timedelta(seconds=2),
+    }
+
+
+async def legacy_log_success(logger: PrometheusLogger, kwargs: dict) -> None:
+    """Callbacks of the previous PrometheusLogger for one streamed request."""
+    print("Pre-API Call")
+    print("Post-API Call")
+    print("On Async Success")
+    payload = kwargs["standard_logging_object"]
+    model = kwargs.get("model", "")
+    user_id = kwargs.get("user", "")
+    user_profile = logger.user_profiles[user_id]
+    labels = lambda: {"model": model, "project": user_profile.get("project", "default"),
+                      "org": user_profile.get("org", "default"), "user": user_id}
+
+    logger.counter_tokens.labels(**labels()).inc(payload["total_tokens"])
+    logger.counter_input_tokens.labels(**labels()).inc(payload["prompt_tokens"])
+    logger.counter_output_tokens.labels(**labels()).inc(payload["completion_tokens"])
+    logger.counter_proxy_requests_success.labels(**labels()).inc()
+
+    end_time = kwargs.get("end_time") or datetime.now()
+    start_time = kwargs.get("start_time")
+    api_call_start_time = kwargs.get("api_call_start_time")
+    completion_start_time = kwargs.get("completion_start_time")
+    logger.histogram_time_to_first_token.labels(**labels()).observe(
+        (completion_start_time - api_call_start_time).total_seconds())
+    logger.histogram_llm_e2e_time_request.labels(**labels()).observe(
+        (end_time - api_call_start_time).total_seconds())
+    logger.histogram_overhead_latency.labels(**labels()).observe((api_call_start_time - start_time).total_seconds())
+    logger.histogram_overhead_latency.labels(**labels()).observe(
+        (end_time - kwargs.get("api_call_end_time", end_time)).total_seconds())
+    logger.histogram_total_e2e_time_request.labels(**labels()).observe((end_time - start_time).total_seconds())
+
+
+async def measure(log_success, requests) -> float:
+    """Return the CPU time (microseconds) spent per request."""
+    start = time.process_time()
+    for kwargs in requests:
+        await log_success(kwargs, None, kwargs["start_time"], kwargs["end_time"])
+    return (time.process_time() - start) / len(requests) * 1e6
+
+
+async def run(args) -> None:
+    user_configs = {f"sk-{i}": {"id": f"user-{i}", "project": f"project-{i % 5}", "org": "org"}
+                    for i in range(args.users)}
+    # flush only when the queue is full, so that the request path and the flushes are measured apart
+    logger = PrometheusLogger({}, user_configs, flush_interval=3600, max_pending=args.requests + 1)
+    requests = [make_kwargs(i, args.users) for i in range(args.requests)]
+
+    async def legacy(kwargs, response_obj, start_time, end_time):
+        await legacy_log_success(logger, kwargs)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        legacy_cost = await measure(legacy, requests)
+        fast_cost = await measure(logger.async_log_success_event, requests)
+        start = time.process_time()
+        logger.flush()
+        flush_cost = (time.process_time() - start) / len(requests) * 1e6
+
+    print(f"legacy                   {legacy_cost:7.2f} us/request")
+    print(f"request path             {fast_cost:7.2f} us/request   speedup {legacy_cost / fast_cost:5.1f}x")
+    print(f"request path + flush     {fast_cost + flush_cost:7.2f} us/request   "
+          f"speedup {legacy_cost / (fast_cost + flush_cost):5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
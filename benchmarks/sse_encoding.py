@@ -0,0 +1,86 @@
+"""
+Per-chunk CPU cost of framing litellm stream chunks as SSE events.
+
+Compares the previous generators of routes/chat.py with utils.sse.
+
+    python -m benchmarks.sse_encoding [--chunks 20000]
+"""
+import argparse
+import json
+import time
+import warnings
+from litellm.types.utils import (Delta,
+                                 ModelResponseStream,
+                                 StreamingChoices,
+                                 TextChoices,
+                                 TextCompletionResponse)
+from utils.openai import Completion
+from utils.sse import (CHAT_CHUNK_EXCLUDE,
+                       COMPLETION_CHUNK_INCLUDE,
+                       encode_sse_chunk)
+
+
+def make_chat_chunk(i: int) -> ModelResponseStream:
+    return ModelResponseStream(id="chatcmpl-bench", model="llama3.1-8b-instruct",
+                               choices=[StreamingChoices(index=0, delta=Delta(content=f" token{i}"))])
+
+
+def make_completion_chunk(i: int) -> TextCompletionResponse:
+    chunk = TextCompletionResponse(id="cmpl-bench", model="llama3.1-8b-instruct")
+    chunk.choices = [TextChoices(index=0, text=f" token{i}", finish_reason=None, logprobs=None)]
+    return chunk
+
+
+def legacy_chat(chunk) -> str:
+    return f"data: {json.dumps(chunk.json())}\n\n"
+
+
+def legacy_completion(chunk) -> str:
+    completion_instance = Completion(**json.loads(chunk.json()))
+    return f"data: {completion_instance.json()}\n\n"
+
+
+def fast_chat(chunk) -> bytes:
+    return encode_sse_chunk(chunk, exclude=CHAT_CHUNK_EXCLUDE)
+
+
+def fast_completion(chunk) -> bytes:
+    return encode_sse_chunk(chunk, include=COMPLETION_CHUNK_INCLUDE)
+
+
+def measure(encode, chunks) -> float:
+    """Return the CPU time (microseconds) spent per chunk."""
+    start = time.process_time()
+    for chunk in chunks:
+        encode(chunk)
+    return (time.process_time() - start) / len(chunks) * 1e6
+
+
+def check_output(legacy, fast, chunk) -> None:
+    legacy_data = json.loads(legacy(chunk)[len("data: "):])
+    fast_data = json.loads(fast(chunk)[len(b"data: "):])
+    for key, value in fast_data.items():
+        assert legacy_data[key] == value, f"{key}: {legacy_data[key]!r} != {value!r}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    args = parser.parse_args()
+
+    # the legacy path triggers pydantic serialization warnings on every chunk
+    warnings.simplefilter("ignore")
+    for name, make_chunk, legacy, fast in (
+        ("chat.completion.chunk", make_chat_chunk, legacy_chat, fast_chat),
+        ("text_completion", make_completion_chunk, legacy_completion, fast_completion),
+    ):
+        chunks = [make_chunk(i) for i in range(args.chunks)]
+        check_output(legacy, fast, chunks[0])
+        legacy_cost = measure(legacy, chunks)
+        fast_cost = measure(fast, chunks)
+        print(f"{name:<24} legacy {legacy_cost:7.2f} us/chunk   fast {fast_cost:7.2f} us/chunk   "
+              f"speedup {legacy_cost / fast_cost:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
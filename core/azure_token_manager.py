@@ -0,0 +1,117 @@
+from typing import (Any, Callable, Dict, Optional)
+import asyncio
+import time
+from azure.identity import (ClientSecretCredential,
+                            DefaultAzureCredential)
+
+
+class AzureToken:
+    __slots__ = ("token", "expires_on", "refresh_task", "refresh_handle", "used")
+
+    def __init__(self):
+        self.token: Optional[str] = None
+        self.expires_on = 0
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.refresh_handle: Optional[asyncio.TimerHandle] = None
+        # whether the token was handed out since its last refresh
+        self.used = False
+
+
+class AzureTokenManager:
+    """
+    Azure AD tokens for the request path without blocking the event loop.
+    credential.get_token() runs in a worker thread, only one refresh runs per
+    credential at a time, and tokens that are in use are refreshed in the
+    background `refresh_margin` seconds before they expire.
+    """
+    def __init__(self, scopes: str, refresh_margin: float = 300, min_validity: float = 60,
+                 credential_factory: Optional[Callable[..., Any]] = None):
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin
+        # a token with less validity left is not handed out anymore
+        self.min_validity = min_validity
+        self.credential_factory = credential_factory or self._create_credential
+        # key: credential key --> value: credential / AzureToken
+        self._credentials: Dict[str, Any] = {}
+        self._tokens: Dict[str, AzureToken] = {}
+
+
+    def _create_credential(self, client_id: Optional[str], tenant_id: Optional[str], client_secret: Optional[str]):
+        if client_id and tenant_id and client_secret:
+            return ClientSecretCredential(client_id=client_id, tenant_id=tenant_id, client_secret=client_secret)
+
+        print("Client ID, Tenant ID or Client Secret not provided. Using DefaultAzureCredential instead.")
+        return DefaultAzureCredential()
+
+
+    def _get_credential(self, cache_key: str, client_id: Optional[str], tenant_id: Optional[str],
+                        client_secret: Optional[str]):
+        credential = self._credentials.get(cache_key)
+        if credential is None:
+            credential = self._credentials[cache_key] = self.credential_factory(client_id, tenant_id, client_secret)
+        return credential
+
+
+    async def get_token(self, client_id: Optional[str] = None, tenant_id: Optional[str] = None,
+                        client_secret: Optional[str] = None) -> str:
+        """
+        Return a valid token of the credential. Only waits when there is no
+        usable cached token; concurrent callers then share a single refresh.
+        """
+        cache_key = f"{client_id}_{tenant_id}" if client_id and tenant_id and client_secret else "default"
+        entry = self._tokens.get(cache_key)
+        if entry is None:
+            entry = self._tokens[cache_key] = AzureToken()
+        entry.used = True
+
+        remaining = entry.expires_on - time.time()
+        if entry.token is not None and remaining > self.min_validity:
+            if remaining < self.refresh_margin:
+                self._start_refresh(cache_key, client_id, tenant_id, client_secret)
+            return entry.token
+
+        # shield the shared refresh from the cancellation of a single caller
+        await asyncio.shield(self._start_refresh(cache_key, client_id, tenant_id, client_secret))
+        return entry.token
+
+
+    def _start_refresh(self, cache_key: str, client_id: Optional[str], tenant_id: Optional[str],
+                       client_secret: Optional[str]) -> asyncio.Task:
+        entry = self._tokens[cache_key]
+        if entry.refresh_task is None or entry.refresh_task.done():
+            entry.refresh_task = asyncio.create_task(self._refresh(cache_key, client_id, tenant_id, client_secret))
+            entry.refresh_task.add_done_callback(self._on_refresh_done)
+        return entry.refresh_task
+
+
+    async def _refresh(self, cache_key: str, client_id: Optional[str], tenant_id: Optional[str],
+                       client_secret: Optional[str]) -> None:
+        credential = self._get_credential(cache_key, client_id, tenant_id, client_secret)
+        # get_token does blocking network I/O
+        access_token = await asyncio.to_thread(credential.get_token, self.scopes)
+
+        entry = self._tokens[cache_key]
+        entry.token = access_token.token
+        entry.expires_on = access_token.expires_on
+        entry.used = False
+
+        # refresh proactively shortly before expiry if the token is still in use by then
+        if entry.refresh_handle is not None:
+            entry.refresh_handle.cancel()
+        delay = max(entry.expires_on - time.time() - self.refresh_margin, 1)
+        entry.refresh_handle = asyncio.get_running_loop().call_later(
+            delay, self._refresh_if_used, cache_key, client_id, tenant_id, client_secret
+        )
+
+
+    def _refresh_if_used(self, cache_key: str, client_id: Optional[str], tenant_id: Optional[str],
+                         client_secret: Optional[str]) -> None:
+        entry = self._tokens.get(cache_key)
+        if entry is not None and entry.used:
+            self._start_refresh(cache_key, client_id, tenant_id, client_secret)
+
+
+    def _on_refresh_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            # callers waiting for the token get the exception, background refreshes are retried on next use
+            print(f"Azure AD token refresh failed: {task.exception()}")
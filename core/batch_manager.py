@@ -0,0 +1,440 @@
+from typing import (Any, Dict, List, Optional, Set)
+import asyncio
+import json
+import os
+import time
+import uuid
+from fastapi import HTTPException
+from starlette.responses import Response
+from core.rate_limiter import RateLimitExceededError
+from core.route_table import RouteNotFoundError
+from core.token_counter import ContextWindowExceededError
+from utils.config_loader import config_loader
+from utils.setting import settings
+
+# key: batch endpoint --> value: RouteHandler method serving it
+BATCH_ENDPOINTS = {
+    "/v1/chat/completions": "chat_completion",
+    "/v1/completions": "completion",
+}
+
+# batches in these states are resumed after a restart
+ACTIVE_BATCH_STATES = ("validating", "in_progress", "finalizing", "cancelling")
+
+# status codes of failed requests that are retried
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class BatchNotFoundError(KeyError):
+    """
+    Raised when a file or batch does not exist or belongs to another user.
+    """
+
+
+class FileStore:
+    """
+    Uploaded input files and generated result files of the batch API, stored
+    as <id>.jsonl next to a <id>.json metadata file in `storage_dir`.
+    """
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+
+
+    def _path(self, object_id: str, extension: str) -> str:
+        return os.path.join(self.storage_dir, f"{object_id}.{extension}")
+
+
+    def create(self, content: bytes, filename: str, purpose: str, user: str) -> dict:
+        os.makedirs(self.storage_dir, exist_ok=True)
+        file_object = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        with open(self._path(file_object["id"], "jsonl"), "wb") as f:
+            f.write(content)
+        self.save_metadata(file_object, user)
+        return file_object
+
+
+    def save_metadata(self, file_object: dict, user: str) -> None:
+        with open(self._path(file_object["id"], "json"), "w") as f:
+            json.dump({**file_object, "user": user}, f)
+
+
+    def get(self, file_id: str, user: Optional[str] = None) -> dict:
+        """Return the file object, only if it belongs to `user` unless user is None."""
+        path = self._path(os.path.basename(file_id), "json")
+        if not os.path.exists(path):
+            raise BatchNotFoundError(f"No such file: {file_id}")
+        with open(path) as f:
+            file_object = json.load(f)
+        owner = file_object.pop("user", None)
+        if user is not None and owner != user:
+            raise BatchNotFoundError(f"No such file: {file_id}")
+        return file_object
+
+
+    def get_content_path(self, file_id: str) -> str:
+        return self._path(os.path.basename(file_id), "jsonl")
+
+
+    def delete(self, file_id: str, user: Optional[str] = None) -> None:
+        self.get(file_id, user)
+        for extension in ("jsonl", "json"):
+            os.remove(self._path(os.path.basename(file_id), extension))
+
+
+class BatchManager:
+    """
+    OpenAI compatible batch API. The requests of an uploaded JSONL file are
+    run in the background through the RouteHandler, at most
+    `max_concurrency` at a time per model across all batches, and failed
+    requests are retried with exponential backoff. Batch requests are
+    scheduled as a separate tenant with a fraction (EZLLM_BATCH_SCHEDULING_WEIGHT)
+    of the weight of the interactive requests of the same tenant, so queued
+    interactive requests are served first.
+    """
+    def __init__(self, route_handler, rate_limiter=None, storage_dir: str = "data/batches",
+                 max_concurrency: int = 8, max_retries: int = 3, retry_backoff: float = 1.0, token_counter=None):
+        self.route_handler = route_handler
+        self.rate_limiter = rate_limiter
+        self.token_counter = token_counter
+        self.files = FileStore(os.path.join(storage_dir, "files"))
+        self.batch_dir = os.path.join(storage_dir, "batches")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # key: model_name --> value: semaphore bounding the batch requests of the model
+        self._model_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # key: batch_id --> value: task running the batch
+        self._batch_tasks: Dict[str, asyncio.Task] = {}
+        # key: batch_id --> value: batch object of a running batch
+        self._batches: Dict[str, dict] = {}
+
+
+    def _batch_path(self, batch_id: str) -> str:
+        return os.path.join(self.batch_dir, f"{os.path.basename(batch_id)}.json")
+
+
+    def _save_batch(self, batch: dict, user: str) -> None:
+        os.makedirs(self.batch_dir, exist_ok=True)
+        path = self._batch_path(batch["id"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({**batch, "user": user}, f)
+        os.replace(f"{path}.tmp", path)
+
+
+    def _load_batch(self, batch_id: str) -> dict:
+        path = self._batch_path(batch_id)
+        if not os.path.exists(path):
+            raise BatchNotFoundError(f"No such batch: {batch_id}")
+        with open(path) as f:
+            return json.load(f)
+
+
+    def get_batch(self, batch_id: str, user: Optional[str] = None) -> dict:
+        batch = self._batches.get(batch_id) or self._load_batch(batch_id)
+        if user is not None and batch.get("user") != user:
+            raise BatchNotFoundError(f"No such batch: {batch_id}")
+        return {key: value for key, value in batch.items() if key != "user"}
+
+
+    def list_batches(self, user: Optional[str] = None, limit: int = 20, after: Optional[str] = None) -> List[dict]:
+        """
+        Batches of the user, newest first. `after` is the id of the last batch
+        of the previous page, the page starts with the batch listed after it.
+        """
+        if not os.path.isdir(self.batch_dir):
+            if after is not None:
+                raise BatchNotFoundError(f"No such batch: {after}")
+            return []
+        batches = []
+        for filename in os.listdir(self.batch_dir):
+            if filename.endswith(".json"):
+                try:
+                    batches.append(self.get_batch(filename[:-len(".json")], user))
+                except (BatchNotFoundError, ValueError):
+                    continue
+        # the id breaks ties between batches created within the same second, so that pages do not overlap
+        batches.sort(key=lambda batch: (batch["created_at"], batch["id"]), reverse=True)
+        if after is not None:
+            start = next((i + 1 for i, batch in enumerate(batches) if batch["id"] == after), None)
+            if start is None:
+                raise BatchNotFoundError(f"No such batch: {after}")
+            batches = batches[start:]
+        return batches[:limit]
+
+
+    async def create_batch(self, input_file_id: str, endpoint: str, completion_window: str,
+                           metadata: Optional[dict], user: str) -> dict:
+        if endpoint not in BATCH_ENDPOINTS:
+            raise ValueError(f"Unsupported endpoint {endpoint}, supported: {', '.join(BATCH_ENDPOINTS)}")
+        await asyncio.to_thread(self.files.get, input_file_id, user)
+
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + 24 * 3600,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+            "user": user,
+        }
+        await asyncio.to_thread(self._save_batch, batch, user)
+        self._start(batch)
+        return self.get_batch(batch["id"])
+
+
+    async def cancel_batch(self, batch_id: str, user: Optional[str] = None) -> dict:
+        batch = self.get_batch(batch_id, user)
+        if batch["status"] not in ACTIVE_BATCH_STATES:
+            raise ValueError(f"Batch {batch_id} is already {batch['status']}")
+        running_batch = self._batches.get(batch_id)
+        if running_batch is not None:
+            # the executor stops dispatching and finishes the batch as cancelled
+            running_batch["status"] = "cancelling"
+            running_batch["cancelling_at"] = int(time.time())
+            await asyncio.to_thread(self._save_batch, running_batch, running_batch["user"])
+        return self.get_batch(batch_id)
+
+
+    async def resume(self) -> None:
+        """Restart the batches that were still running when the gateway stopped."""
+        for batch in await asyncio.to_thread(self.list_batches, None, 1 << 30):
+            if batch["status"] in ACTIVE_BATCH_STATES:
+                self._start(await asyncio.to_thread(self._load_batch, batch["id"]))
+
+
+    async def shutdown(self) -> None:
+        # running batches are resumed on the next start
+        for task in list(self._batch_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._batch_tasks.values(), return_exceptions=True)
+
+
+    def _start(self, batch: dict) -> None:
+        self._batches[batch["id"]] = batch
+        task = self._batch_tasks[batch["id"]] = asyncio.create_task(self._run_batch(batch))
+        task.add_done_callback(lambda t: self._on_batch_done(batch["id"], t))
+
+
+    def _on_batch_done(self, batch_id: str, task: asyncio.Task) -> None:
+        self._batch_tasks.pop(batch_id, None)
+        self._batches.pop(batch_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Batch {batch_id} failed: {task.exception()}")
+
+
+    def _get_semaphore(self, model_name: str) -> asyncio.Semaphore:
+        semaphore = self._model_semaphores.get(model_name)
+        if semaphore is None:
+            semaphore = self._model_semaphores[model_name] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+
+    def _read_requests(self, batch: dict) -> tuple:
+        """
+        Parse and validate the input file of the batch.
+
+        Returns:
+            tuple: (requests, errors, custom_ids already finished before a restart,
+                    request_counts of these finished requests)
+        """
+        requests, errors, custom_ids = [], [], set()
+        with open(self.files.get_content_path(batch["input_file_id"])) as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    custom_id = request["custom_id"]
+                    body = request["body"]
+                    if request.get("url", batch["endpoint"]) != batch["endpoint"]:
+                        raise ValueError(f"url must be {batch['endpoint']}")
+                    if not body.get("model"):
+                        raise ValueError("body.model is required")
+                    if custom_id in custom_ids:
+                        raise ValueError(f"duplicate custom_id {custom_id}")
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    errors.append({"code": "invalid_request", "message": str(e), "param": None, "line": line_number})
+                    continue
+                custom_ids.add(custom_id)
+                requests.append(request)
+
+        finished, request_counts = set(), {"total": len(requests), "completed": 0, "failed": 0}
+        for file_id, count_field in ((batch["output_file_id"], "completed"), (batch["error_file_id"], "failed")):
+            if file_id and os.path.exists(self.files.get_content_path(file_id)):
+                with open(self.files.get_content_path(file_id)) as f:
+                    for line in f:
+                        if line.strip():
+                            finished.add(json.loads(line)["custom_id"])
+                            request_counts[count_field] += 1
+        return requests, errors, finished, request_counts
+
+
+    def _create_result_file(self, batch: dict, field: str, purpose: str) -> None:
+        if batch[field] is None:
+            batch[field] = self.files.create(b"", f"{batch['id']}_{purpose}.jsonl", purpose, batch["user"])["id"]
+
+
+    def _append_result(self, file_id: str, result: dict) -> None:
+        with open(self.files.get_content_path(file_id), "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+    async def _update_batch(self, batch: dict, **fields) -> None:
+        batch.update(fields)
+        await asyncio.to_thread(self._save_batch, batch, batch["user"])
+
+
+    async def _run_batch(self, batch: dict) -> None:
+        requests, errors, finished, request_counts = await asyncio.to_thread(self._read_requests, batch)
+        if errors:
+            await self._update_batch(batch, status="failed", failed_at=int(time.time()),
+                                     errors={"object": "list", "data": errors})
+            return
+
+        await asyncio.to_thread(self._create_result_file, batch, "output_file_id", "batch_output")
+        await asyncio.to_thread(self._create_result_file, batch, "error_file_id", "batch_error")
+        batch["request_counts"] = request_counts
+        if batch["status"] == "validating":
+            await self._update_batch(batch, status="in_progress", in_progress_at=int(time.time()))
+
+        running: Set[asyncio.Task] = set()
+        try:
+            for request in requests:
+                if batch["status"] == "cancelling":
+                    break
+                if request["custom_id"] in finished:
+                    continue
+                semaphore = self._get_semaphore(request["body"]["model"])
+                await semaphore.acquire()
+                task = asyncio.create_task(self._run_request(batch, request))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda t, s=semaphore: s.release())
+            if running:
+                await asyncio.gather(*running)
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+
+        now = int(time.time())
+        if batch["status"] == "cancelling":
+            await self._update_batch(batch, status="cancelled", cancelled_at=now)
+        else:
+            await self._update_batch(batch, status="completed", finalizing_at=now, completed_at=now)
+
+
+    async def _run_request(self, batch: dict, request: dict) -> None:
+        body = {**request["body"], "stream": False}
+        request_id = f"batch_req_{uuid.uuid4().hex}"
+        status_code, response_body, error = await self._call_with_retries(batch, body)
+
+        result = {"id": request_id, "custom_id": request["custom_id"], "response": None, "error": None}
+        if error is None:
+            result["response"] = {"status_code": status_code, "request_id": request_id, "body": response_body}
+            batch["request_counts"]["completed"] += 1
+            file_id = batch["output_file_id"]
+        else:
+            result["response"] = {"status_code": status_code, "request_id": request_id, "body": None}
+            result["error"] = {"code": str(status_code), "message": error}
+            batch["request_counts"]["failed"] += 1
+            file_id = batch["error_file_id"]
+        await asyncio.to_thread(self._append_result, file_id, result)
+
+
+    async def _call_with_retries(self, batch: dict, body: dict) -> tuple:
+        """
+        Run one request of the batch, retrying rate limited, overloaded and
+        failed requests with exponential backoff.
+
+        Returns:
+            tuple: (status_code, response body, error message or None)
+        """
+        call_type = BATCH_ENDPOINTS[batch["endpoint"]]
+        route_call = getattr(self.route_handler, call_type)
+        attempt = 0
+        while True:
+            config_snapshot = config_loader.get_snapshot()
+            try:
+                user_token = self._get_user_token(batch["user"], config_snapshot.user_configs)
+                send_body, prompt_tokens = await self._fit_context_window(call_type, body, config_snapshot)
+                if self.rate_limiter is None:
+                    response = await route_call(dict(send_body), user_token, config_snapshot, batch=True,
+                                                prompt_tokens=prompt_tokens)
+                    return 200, self._to_json(response), None
+                reservation = self.rate_limiter.check_request(config_snapshot.user_configs.get(user_token),
+                                                              estimated_tokens=prompt_tokens or 0)
+                try:
+                    response = await route_call(dict(send_body), user_token, config_snapshot, batch=True,
+                                                prompt_tokens=prompt_tokens)
+                finally:
+                    # the estimate of a request no success callback reconciled is given back
+                    self.rate_limiter.release(reservation)
+                return 200, self._to_json(response), None
+
+            except RateLimitExceededError as e:
+                # wait for the limit instead of spending a retry
+                await asyncio.sleep(e.retry_after)
+                continue
+
+            except HTTPException as e:
+                status_code, error = e.status_code, str(e.detail)
+
+            except Exception as e:
+                status_code, error = 500, str(e)
+
+            if status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                return status_code, None, error
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+
+
+    async def _fit_context_window(self, call_type: str, body: dict, config_snapshot) -> tuple:
+        """Reject requests exceeding the context window of their model before they are queued, see TokenCounter."""
+        if self.token_counter is None:
+            return body, None
+        try:
+            model_route = config_snapshot.route_table.get(body.get("model"))
+            return await self.token_counter.fit_context_window(call_type, model_route, body)
+        except RouteNotFoundError as e:
+            raise HTTPException(status_code=400, detail=str(e.args[0]))
+        except ContextWindowExceededError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+    def _get_user_token(self, user: str, user_configs: dict) -> Optional[str]:
+        if user == "admin":
+            return settings.MASTER_TOKEN
+        for user_token, user_profile in user_configs.items():
+            if user_profile.get("id") == user:
+                return user_token
+        raise HTTPException(status_code=401, detail=f"User {user} of the batch no longer exists")
+
+
+    def _to_json(self, response) -> Any:
+        if isinstance(response, Response):
+            # passthrough models return the upstream bytes
+            return json.loads(response.body)
+        return response.model_dump()
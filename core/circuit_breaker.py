@@ -0,0 +1,210 @@
+from typing import (Deque, Dict, Optional)
+from collections import deque
+import time
+from core.shared_state import SharedState
+
+
+# Breaker states, the values are exported as the state gauge
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+
+class NoHealthyDeploymentError(Exception):
+    """
+    Raised when every deployment of a model is ejected by its circuit breaker.
+    """
+
+
+class DeploymentHealth:
+    __slots__ = ("state", "outcomes", "consecutive_failures", "ejections", "open_until",
+                 "probes_in_flight", "probe_successes", "latency_ewma")
+
+    def __init__(self, window_size: int):
+        self.state = CLOSED
+        # True for a failed request, False for a successful one
+        self.outcomes: Deque[bool] = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.open_until = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.latency_ewma: Optional[float] = None
+
+
+class CircuitBreaker:
+    """
+    Passive health checking per upstream api_base. A deployment whose error
+    rate or consecutive failures cross a threshold is ejected for a backoff
+    window that doubles on every ejection. Afterwards it is half-open and only
+    receives a limited number of probe requests until enough of them succeed.
+
+    With a `shared_state` an ejection is published to the other workers,
+    which eject the deployment for the rest of its window on their next
+    sync_shared_state().
+    """
+    def __init__(self,
+                 window_size: int = 20,
+                 min_requests: int = 5,
+                 failure_rate_threshold: float = 0.5,
+                 consecutive_failures_threshold: int = 5,
+                 base_ejection_time: float = 30.0,
+                 max_ejection_time: float = 300.0,
+                 half_open_max_requests: int = 1,
+                 half_open_success_threshold: int = 2,
+                 ewma_alpha: float = 0.3,
+                 prometheus_logger=None,
+                 shared_state: Optional[SharedState] = None):
+        self.window_size = window_size
+        self.min_requests = min_requests
+        self.failure_rate_threshold = failure_rate_threshold
+        self.consecutive_failures_threshold = consecutive_failures_threshold
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.half_open_max_requests = half_open_max_requests
+        self.half_open_success_threshold = half_open_success_threshold
+        self.ewma_alpha = ewma_alpha
+        self.prometheus_logger = prometheus_logger
+        # key: api_base --> value: DeploymentHealth
+        self.deployment_health: Dict[str, DeploymentHealth] = {}
+        self.shared_state = shared_state
+        # key: api_base --> value: (end of the ejection as unix time, ejection time) not published yet
+        self._unpublished_ejections: Dict[str, tuple] = {}
+
+
+    def _get_health(self, api_base: Optional[str]) -> DeploymentHealth:
+        api_base = str(api_base)
+        health = self.deployment_health.get(api_base)
+        if health is None:
+            health = self.deployment_health[api_base] = DeploymentHealth(self.window_size)
+        return health
+
+
+    def is_available(self, api_base: Optional[str]) -> bool:
+        """
+        Check whether a deployment may receive a request right now.
+        """
+        health = self._get_health(api_base)
+        if health.state == OPEN:
+            if time.monotonic() < health.open_until:
+                return False
+            # backoff window is over, let probe requests through
+            self._set_state(api_base, health, HALF_OPEN)
+
+        if health.state == HALF_OPEN:
+            return health.probes_in_flight < self.half_open_max_requests
+        return True
+
+
+    def on_request_start(self, api_base: Optional[str]) -> None:
+        health = self._get_health(api_base)
+        if health.state == HALF_OPEN:
+            health.probes_in_flight += 1
+
+
+    def on_request_cancelled(self, api_base: Optional[str]) -> None:
+        """
+        Release the probe slot of a request that was cancelled before it had an outcome,
+        or whose outcome says nothing about the deployment.
+        """
+        health = self._get_health(api_base)
+        if health.state == HALF_OPEN:
+            health.probes_in_flight = max(health.probes_in_flight - 1, 0)
+
+
+    def record_success(self, api_base: Optional[str], latency: Optional[float] = None) -> None:
+        health = self._get_health(api_base)
+        health.outcomes.append(False)
+        health.consecutive_failures = 0
+        if latency is not None:
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * health.latency_ewma
+            if self.prometheus_logger is not None:
+                self.prometheus_logger.set_deployment_latency(str(api_base), health.latency_ewma)
+
+        if health.state == HALF_OPEN:
+            health.probes_in_flight = max(health.probes_in_flight - 1, 0)
+            health.probe_successes += 1
+            if health.probe_successes >= self.half_open_success_threshold:
+                # deployment recovered, back to full rotation
+                health.ejections = 0
+                health.outcomes.clear()
+                self._set_state(api_base, health, CLOSED)
+
+
+    def record_failure(self, api_base: Optional[str], exception: BaseException) -> None:
+        """
+        Record a failed request. Client errors (4xx except 408/429) are not the
+        deployment's fault: they count neither as failure nor as success, and
+        only release the probe slot of a half-open deployment.
+        """
+        status_code = getattr(exception, "status_code", None)
+        if status_code is not None and 400 <= status_code < 500 and status_code not in (408, 429):
+            self.on_request_cancelled(api_base)
+            return
+
+        health = self._get_health(api_base)
+        health.outcomes.append(True)
+        health.consecutive_failures += 1
+        if self.prometheus_logger is not None:
+            reason = "timeout" if status_code == 408 or "timeout" in type(exception).__name__.lower() else "error"
+            self.prometheus_logger.log_deployment_failure(str(api_base), reason)
+
+        if health.state == HALF_OPEN:
+            health.probes_in_flight = max(health.probes_in_flight - 1, 0)
+            self._eject(api_base, health)
+            return
+
+        failures = sum(health.outcomes)
+        if (health.consecutive_failures >= self.consecutive_failures_threshold
+                or (len(health.outcomes) >= self.min_requests
+                    and failures / len(health.outcomes) >= self.failure_rate_threshold)):
+            self._eject(api_base, health)
+
+
+    def _eject(self, api_base: Optional[str], health: DeploymentHealth) -> None:
+        ejection_time = min(self.base_ejection_time * (2 ** health.ejections), self.max_ejection_time)
+        health.ejections += 1
+        self._open(api_base, health, ejection_time)
+        if self.shared_state is not None:
+            self._unpublished_ejections[str(api_base)] = (time.time() + ejection_time, ejection_time)
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_deployment_ejection(str(api_base), ejection_time)
+
+
+    def _open(self, api_base: Optional[str], health: DeploymentHealth, ejection_time: float) -> None:
+        health.open_until = time.monotonic() + ejection_time
+        health.probe_successes = 0
+        health.consecutive_failures = 0
+        health.outcomes.clear()
+        self._set_state(api_base, health, OPEN)
+
+
+    async def sync_shared_state(self) -> None:
+        """Publish the local ejections and apply the ones of the other workers."""
+        ejections, self._unpublished_ejections = self._unpublished_ejections, {}
+        for api_base, (ejected_until, ejection_time) in ejections.items():
+            await self.shared_state.set(f"breaker:{api_base}", repr(ejected_until).encode(), ttl=ejection_time)
+
+        api_bases = list(self.deployment_health)
+        ejected_until = await self.shared_state.get_many([f"breaker:{api_base}" for api_base in api_bases])
+        now = time.time()
+        for api_base in api_bases:
+            value = ejected_until[f"breaker:{api_base}"]
+            health = self.deployment_health[api_base]
+            if value is None or health.state == OPEN:
+                continue
+            remaining = float(value) - now
+            if remaining > 0:
+                # ejected by another worker
+                self._open(api_base, health, remaining)
+
+
+    def _set_state(self, api_base: Optional[str], health: DeploymentHealth, state: int) -> None:
+        health.state = state
+        if state != HALF_OPEN:
+            health.probes_in_flight = 0
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.set_breaker_state(str(api_base), state)
@@ -0,0 +1,261 @@
+from typing import (Any, Callable, Dict, Iterable, Mapping, Optional, Tuple)
+import asyncio
+import importlib.util
+import os
+import httpx
+import litellm
+from openai import (AsyncAzureOpenAI,
+                    AsyncOpenAI)
+from utils.setting import settings
+
+
+# litellm providers that talk to the upstream through an AsyncOpenAI client
+OPENAI_COMPATIBLE_PROVIDERS = ("openai", "hosted_vllm")
+
+# HTTP/2 needs the optional h2 package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PoolParams:
+    """
+    Connection pool settings of a deployment, from the `connection_pool`
+    block of its litellm_params (router_settings.connection_pool and the
+    EZLLM_POOL_* env vars provide the defaults).
+    """
+    __slots__ = ("max_connections", "max_keepalive_connections", "keepalive_expiry", "http2",
+                 "connect_timeout", "read_timeout", "verify", "key")
+
+    def __init__(self, pool_config: Optional[Mapping[str, Any]] = None):
+        pool_config = pool_config or {}
+        self.max_connections = int(pool_config.get("max_connections", settings.POOL_MAX_CONNECTIONS))
+        self.max_keepalive_connections = int(pool_config.get("max_keepalive_connections",
+                                                             settings.POOL_MAX_KEEPALIVE_CONNECTIONS))
+        self.keepalive_expiry = float(pool_config.get("keepalive_expiry", settings.POOL_KEEPALIVE_EXPIRY))
+        self.http2 = bool(pool_config.get("http2", settings.POOL_HTTP2))
+        self.connect_timeout = float(pool_config.get("connect_timeout", settings.POOL_CONNECT_TIMEOUT))
+        self.read_timeout = float(pool_config.get("read_timeout", settings.POOL_READ_TIMEOUT))
+        # False or the path of a CA bundle
+        self.verify = pool_config.get("verify", settings.POOL_VERIFY)
+        self.key = (self.max_connections, self.max_keepalive_connections, self.keepalive_expiry,
+                    self.http2, self.connect_timeout, self.read_timeout, self.verify)
+
+
+    def get_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports to its transport once it is closed."""
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class TrackedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport counting the requests in flight on the connection pool.
+    A request stays in flight until its response body is closed, which for
+    streamed completions is the end of the stream.
+    """
+    def __init__(self, transport: httpx.AsyncHTTPTransport, on_change: Callable[[], None]):
+        self.transport = transport
+        self.on_change = on_change
+        self.in_flight = 0
+
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.on_change()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self._on_request_end()
+            raise
+        response.stream = _TrackedStream(response.stream, self._on_request_end)
+        return response
+
+
+    def _on_request_end(self) -> None:
+        self.in_flight -= 1
+        self.on_change()
+
+
+    def get_connection_counts(self) -> Tuple[int, int]:
+        """
+        Return the (active, idle) connections of the pool. httpx exposes no
+        public view of its pool, so when its internals change only the
+        requests in flight are reported.
+        """
+        connections = getattr(getattr(self.transport, "_pool", None), "connections", None)
+        if connections is None:
+            return self.in_flight, 0
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return len(connections) - idle, idle
+
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class UpstreamPool:
+    __slots__ = ("api_base", "params", "transport", "http_client", "openai_clients", "azure_clients", "retired")
+
+    def __init__(self, api_base: str, params: PoolParams, on_change: Callable[["UpstreamPool"], None]):
+        self.api_base = api_base
+        self.params = params
+        http2 = params.http2
+        if http2 and not HTTP2_AVAILABLE:
+            print(f"HTTP/2 requested for {api_base} but the h2 package is not installed. Using HTTP/1.1 instead.")
+            http2 = False
+
+        transport = httpx.AsyncHTTPTransport(
+            verify=params.verify,
+            http2=http2,
+            limits=httpx.Limits(max_connections=params.max_connections,
+                                max_keepalive_connections=params.max_keepalive_connections,
+                                keepalive_expiry=params.keepalive_expiry),
+        )
+        self.transport = TrackedTransport(transport, lambda: on_change(self))
+        self.http_client = httpx.AsyncClient(transport=self.transport, timeout=params.get_timeout())
+        # key: api_key --> value: AsyncOpenAI client sharing the pool
+        self.openai_clients: Dict[Optional[str], AsyncOpenAI] = {}
+        # key: (api_key, api_version) --> value: (azure_ad_token, AsyncAzureOpenAI client sharing the pool)
+        self.azure_clients: Dict[Tuple[Optional[str], str], Tuple[Optional[str], AsyncAzureOpenAI]] = {}
+        # replaced by a config reload, closed once its last request ended
+        self.retired = False
+
+
+class ConnectionPoolManager:
+    """
+    Gateway owned keep-alive connection pools, one httpx.AsyncClient per
+    upstream api_base, shared by every deployment and api_key of that
+    api_base. Requests to openai compatible and azure providers are sent
+    through them by passing a pooled AsyncOpenAI / AsyncAzureOpenAI client
+    to litellm.
+    """
+    def __init__(self, prometheus_logger=None):
+        self.prometheus_logger = prometheus_logger
+        # key: (api_base, PoolParams.key) --> value: UpstreamPool
+        self.pools: Dict[Tuple[str, tuple], UpstreamPool] = {}
+
+
+    def _get_pool(self, api_base: str, params: PoolParams) -> UpstreamPool:
+        pool_key = (api_base, params.key)
+        pool = self.pools.get(pool_key)
+        if pool is None:
+            pool = self.pools[pool_key] = UpstreamPool(api_base, params, self._on_pool_change)
+            if self.prometheus_logger is not None:
+                self.prometheus_logger.set_pool_max_connections(api_base, params.max_connections)
+        return pool
+
+
+    def get_http_client(self, deployment) -> httpx.AsyncClient:
+        return self._get_pool(deployment.api_base, deployment.pool_params).http_client
+
+
+    def configure_request(self, deployment, kwargs: dict) -> dict:
+        """
+        Route the request of an openai compatible or azure deployment through
+        the pool of its api_base. Other providers keep the clients litellm creates.
+        Azure requests must already carry their authentication.
+        """
+        if not deployment.api_base:
+            return kwargs
+        if deployment.provider == "azure":
+            pool = self._get_pool(deployment.api_base, deployment.pool_params)
+            client = self._get_azure_client(pool, deployment, kwargs)
+            if client is None:
+                return kwargs
+            kwargs["client"] = client
+        elif deployment.provider in OPENAI_COMPATIBLE_PROVIDERS:
+            pool = self._get_pool(deployment.api_base, deployment.pool_params)
+            kwargs["client"] = self._get_openai_client(pool, kwargs.get("api_key"))
+        else:
+            return kwargs
+
+        # litellm passes its own timeout to every call, which would override the one of the pool
+        kwargs.setdefault("timeout", pool.params.get_timeout())
+        return kwargs
+
+
+    def _get_openai_client(self, pool: UpstreamPool, api_key: Optional[str]) -> AsyncOpenAI:
+        client = pool.openai_clients.get(api_key)
+        if client is None:
+            client = pool.openai_clients[api_key] = AsyncOpenAI(api_key=api_key or "EMPTY",
+                                                                base_url=pool.api_base,
+                                                                http_client=pool.http_client)
+        return client
+
+
+    def _get_azure_client(self, pool: UpstreamPool, deployment, kwargs: dict) -> Optional[AsyncAzureOpenAI]:
+        """
+        Return the pooled AsyncAzureOpenAI client of the request. litellm uses a
+        given client as is, so its api_version is resolved the way litellm
+        does, and it is replaced whenever the azure_ad_token is refreshed.
+        Credentials litellm resolves itself (env api keys, oidc tokens) keep
+        the client litellm creates.
+        """
+        api_key = kwargs.get("api_key")
+        azure_ad_token = None if api_key else kwargs.get("azure_ad_token")
+        if not api_key and (not azure_ad_token or azure_ad_token.startswith("oidc/")):
+            return None
+
+        api_version = (kwargs.get("api_version") or deployment.config.get("api_version") or litellm.api_version
+                       or os.getenv("AZURE_API_VERSION") or litellm.AZURE_DEFAULT_API_VERSION)
+        kwargs["api_version"] = api_version
+
+        client_key = (api_key, api_version)
+        token, client = pool.azure_clients.get(client_key, (None, None))
+        if client is None or token != azure_ad_token:
+            # the replaced client is not closed, it shares the http client of the pool
+            client = AsyncAzureOpenAI(api_key=api_key, azure_ad_token=azure_ad_token,
+                                      azure_endpoint=deployment.api_base, api_version=api_version,
+                                      http_client=pool.http_client)
+            pool.azure_clients[client_key] = (azure_ad_token, client)
+        return client
+
+
+    def retire_pools(self, deployments: Iterable) -> None:
+        """
+        Drop the pools no deployment of the new config uses anymore. They are
+        closed as soon as their in-flight requests have ended.
+        """
+        active_keys = {(deployment.api_base, deployment.pool_params.key) for deployment in deployments}
+        for pool_key in [pool_key for pool_key in self.pools if pool_key not in active_keys]:
+            pool = self.pools.pop(pool_key)
+            pool.retired = True
+            self._on_pool_change(pool)
+
+
+    def _on_pool_change(self, pool: UpstreamPool) -> None:
+        if pool.retired and pool.transport.in_flight == 0:
+            try:
+                asyncio.get_running_loop().create_task(pool.http_client.aclose())
+            except RuntimeError:
+                # no running loop, nothing was ever sent through the pool
+                pass
+            return
+
+        if self.prometheus_logger is not None:
+            active, idle = pool.transport.get_connection_counts()
+            self.prometheus_logger.set_pool_state(pool.api_base, pool.transport.in_flight, active, idle)
+
+
+    async def aclose(self) -> None:
+        for pool in self.pools.values():
+            await pool.http_client.aclose()
+        self.pools.clear()
@@ -0,0 +1,146 @@
+from typing import (Any, Awaitable, Callable, Dict, List, Optional, Tuple)
+import asyncio
+import litellm
+
+
+def normalize_embedding_input(embedding_input) -> Optional[Tuple[str, list]]:
+    """
+    Split the `input` of an embedding request into its single inputs.
+
+    Returns:
+        tuple: (input kind "text" or "tokens", list of inputs), None when the
+               input can not be merged with the inputs of other requests
+    """
+    if isinstance(embedding_input, str):
+        return "text", [embedding_input]
+    if not isinstance(embedding_input, list) or not embedding_input:
+        return None
+    if all(isinstance(item, str) for item in embedding_input):
+        return "text", embedding_input
+    if all(isinstance(item, int) for item in embedding_input):
+        # one input given as a token array
+        return "tokens", [embedding_input]
+    if all(isinstance(item, list) and item and all(isinstance(token, int) for token in item) for item in embedding_input):
+        return "tokens", embedding_input
+    return None
+
+
+def _get_field(item, field: str):
+    return item[field] if isinstance(item, dict) else getattr(item, field)
+
+
+class PendingBatch:
+    """Inputs of the requests collected for one upstream call."""
+    __slots__ = ("inputs", "waiters", "timer")
+
+    def __init__(self):
+        self.inputs: List[Any] = []
+        # (future of the caller, index of its first input, number of inputs)
+        self.waiters: List[Tuple[asyncio.Future, int, int]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching of embedding requests. Concurrent requests with the same
+    batch key (model, user and embedding params) are collected for up to
+    `max_wait` seconds or `max_batch_size` inputs, sent as one upstream call,
+    and every caller gets an EmbeddingResponse with only its own embeddings.
+    """
+    def __init__(self, prometheus_logger=None):
+        self.prometheus_logger = prometheus_logger
+        # key: batch_key --> value: PendingBatch still collecting inputs
+        self._pending: Dict[str, PendingBatch] = {}
+        self._tasks = set()
+
+
+    async def submit(self, batch_key: str, model_name: str, inputs: list,
+                     send: Callable[[list], Awaitable[Any]], max_batch_size: int, max_wait: float):
+        """
+        Add the inputs of a request to the pending batch of `batch_key` and wait
+        for its share of the upstream response. `send` is called with the
+        merged inputs and returns the upstream EmbeddingResponse.
+        """
+        batch = self._pending.get(batch_key)
+        if batch is not None and len(batch.inputs) + len(inputs) > max_batch_size:
+            self._flush(batch_key, model_name, send)
+            batch = None
+        if batch is None:
+            batch = self._pending[batch_key] = PendingBatch()
+            batch.timer = asyncio.get_running_loop().call_later(max_wait, self._flush, batch_key, model_name, send)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((future, len(batch.inputs), len(inputs)))
+        batch.inputs.extend(inputs)
+        if len(batch.inputs) >= max_batch_size:
+            self._flush(batch_key, model_name, send)
+        return await future
+
+
+    def _flush(self, batch_key: str, model_name: str, send: Callable[[list], Awaitable[Any]]) -> None:
+        batch = self._pending.pop(batch_key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._send(batch, model_name, send))
+        # keep a reference until the call ended, the callers only hold their futures
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+    async def _send(self, batch: PendingBatch, model_name: str, send: Callable[[list], Awaitable[Any]]) -> None:
+        if all(future.done() for future, _, _ in batch.waiters):
+            # every caller went away while the batch was collected
+            return
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.observe_embedding_batch(model_name, len(batch.waiters))
+        try:
+            response = await send(batch.inputs)
+        except BaseException as e:
+            for future, _, _ in batch.waiters:
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        embeddings = sorted(response.data, key=lambda item: _get_field(item, "index"))
+        usage_shares = self._split_usage(response, batch)
+        for (future, start, count), usage in zip(batch.waiters, usage_shares):
+            if not future.done():
+                future.set_result(self._split_response(response.model, embeddings[start:start + count], usage))
+
+
+    def _split_usage(self, response, batch: PendingBatch) -> List[litellm.Usage]:
+        """
+        Split the prompt tokens of the batch across its requests, proportionally
+        to the length of their inputs.
+        """
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        lengths = [len(item) for item in batch.inputs]
+        total_length = sum(lengths) or 1
+
+        shares, consumed, assigned = [], 0, 0
+        for _, start, count in batch.waiters:
+            consumed += sum(lengths[start:start + count])
+            # cumulative rounding keeps the sum of the shares equal to prompt_tokens
+            tokens = round(prompt_tokens * consumed / total_length) - assigned
+            assigned += tokens
+            shares.append(litellm.Usage(prompt_tokens=tokens, completion_tokens=0, total_tokens=tokens))
+        return shares
+
+
+    def _split_response(self, model: str, embeddings: list, usage: litellm.Usage) -> litellm.EmbeddingResponse:
+        return litellm.EmbeddingResponse(
+            model=model,
+            data=[
+                {"object": "embedding", "index": index, "embedding": _get_field(item, "embedding")}
+                for index, item in enumerate(embeddings)
+            ],
+            usage=usage,
+        )
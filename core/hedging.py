@@ -0,0 +1,119 @@
+from typing import (Deque, Dict, Mapping, Optional, Tuple)
+from collections import deque
+import math
+
+
+class LatencyStats:
+    """
+    Recent times to first response of a model, with the hedging threshold
+    recomputed every `update_interval` samples instead of on every request.
+    """
+    __slots__ = ("latencies", "pending_samples", "percentiles")
+
+    def __init__(self, window_size: int):
+        self.latencies: Deque[float] = deque(maxlen=window_size)
+        self.pending_samples = 0
+        # key: percentile --> value: latency (seconds)
+        self.percentiles: Dict[float, float] = {}
+
+
+class HedgeBudget:
+    """
+    Every request earns `max_extra_load` credits and a hedge spends one, so
+    hedges stay below that share of the model's traffic. At most `max_burst`
+    credits are saved up while hedging is not needed.
+    """
+    __slots__ = ("credits",)
+
+    def __init__(self):
+        self.credits = 0.0
+
+
+class RequestHedger:
+    """
+    Decides when a request is hedged to a second deployment: once it took
+    longer than a fixed `delay` or the `percentile` of the model's observed
+    time to first response (first chunk for streams), as long as the hedge
+    budget of the model allows it.
+    """
+    def __init__(self, window_size: int = 256, min_samples: int = 20, update_interval: int = 16,
+                 max_burst: float = 10.0, prometheus_logger=None):
+        self.window_size = window_size
+        # no percentile based hedging before this many samples were observed
+        self.min_samples = min_samples
+        self.update_interval = update_interval
+        self.max_burst = max_burst
+        self.prometheus_logger = prometheus_logger
+        # key: (model_name, is_stream) --> value: LatencyStats
+        self.stats: Dict[Tuple[str, bool], LatencyStats] = {}
+        # key: model_name --> value: HedgeBudget
+        self.budgets: Dict[str, HedgeBudget] = {}
+
+
+    def _get_stats(self, model_name: str, is_stream: bool) -> LatencyStats:
+        stats_key = (model_name, is_stream)
+        stats = self.stats.get(stats_key)
+        if stats is None:
+            stats = self.stats[stats_key] = LatencyStats(self.window_size)
+        return stats
+
+
+    def get_delay(self, model_name: str, is_stream: bool, hedge_params: Mapping) -> Optional[float]:
+        """
+        Return the seconds after which a request of the model is hedged, None
+        while there are not enough samples for the percentile yet.
+        """
+        delay = hedge_params.get("delay")
+        if delay is None:
+            stats = self._get_stats(model_name, is_stream)
+            percentile = float(hedge_params.get("percentile", 95))
+            delay = stats.percentiles.get(percentile)
+            if delay is None:
+                if len(stats.latencies) < self.min_samples:
+                    return None
+                delay = stats.percentiles[percentile] = self._percentile(stats.latencies, percentile)
+        return max(float(delay), float(hedge_params.get("min_delay", 0)))
+
+
+    def record_latency(self, model_name: str, is_stream: bool, latency: float) -> None:
+        stats = self._get_stats(model_name, is_stream)
+        stats.latencies.append(latency)
+        stats.pending_samples += 1
+        if stats.pending_samples >= self.update_interval:
+            # percentiles are recomputed lazily on the next get_delay
+            stats.pending_samples = 0
+            stats.percentiles.clear()
+
+
+    def on_request(self, model_name: str, hedge_params: Mapping) -> None:
+        """Earn hedge budget for a request of the model."""
+        budget = self.budgets.get(model_name)
+        if budget is None:
+            budget = self.budgets[model_name] = HedgeBudget()
+        budget.credits = min(budget.credits + float(hedge_params.get("max_extra_load", 0.05)), self.max_burst)
+
+
+    def try_hedge(self, model_name: str) -> bool:
+        """Spend hedge budget of the model, False if it is exhausted."""
+        budget = self.budgets.get(model_name)
+        if budget is None or budget.credits < 1:
+            self.log_skipped(model_name, "budget_exhausted")
+            return False
+        budget.credits -= 1
+        return True
+
+
+    def _percentile(self, latencies: Deque[float], percentile: float) -> float:
+        ordered = sorted(latencies)
+        index = min(max(math.ceil(percentile / 100 * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[index]
+
+
+    def log_hedged(self, model_name: str, winner: str) -> None:
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_hedged_request(model_name, winner)
+
+
+    def log_skipped(self, model_name: str, reason: str) -> None:
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_hedge_skipped(model_name, reason)
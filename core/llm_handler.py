@@ -1,104 +1,94 @@
-from typing import (Callable, Dict)
-import time
-from azure.identity import (ClientSecretCredential,
-                            DefaultAzureCredential,
-                            get_bearer_token_provider)
+from typing import Optional
+from core.azure_token_manager import AzureTokenManager
+from core.connection_pool import ConnectionPoolManager
+from core.circuit_breaker import (CircuitBreaker,
+                                  NoHealthyDeploymentError)
+from core.load_balancer import LoadBalancer
+from core.route_table import (Deployment,
+                              ModelRoute)
+from utils.setting import settings
 
 class LLMHandler:
-    def __init__(self):
+    def __init__(self, prometheus_logger=None, shared_state=None):
         self.azure_llm_handler = AzureLLMHandler()
-        
+        self.load_balancer = LoadBalancer()
+        self.circuit_breaker = CircuitBreaker(failure_rate_threshold=settings.BREAKER_FAILURE_RATE_THRESHOLD,
+                                              consecutive_failures_threshold=settings.BREAKER_CONSECUTIVE_FAILURES,
+                                              base_ejection_time=settings.BREAKER_BASE_EJECTION_TIME,
+                                              max_ejection_time=settings.BREAKER_MAX_EJECTION_TIME,
+                                              half_open_max_requests=settings.BREAKER_HALF_OPEN_MAX_REQUESTS,
+                                              prometheus_logger=prometheus_logger,
+                                              shared_state=shared_state)
+        self.connection_pools = ConnectionPoolManager(prometheus_logger=prometheus_logger)
+
 
     def get_llm_provider(self, model: str):
         return model.split('/')[0]
 
 
-    def configure_model_routing(self, **kwargs):
-        try:
-            routing_configs = kwargs.pop("routing_configs")
-            model_name = kwargs.get("model")
-            if model_name is None:
-                raise ValueError("Model must be provided in the kwargs")
+    def select_deployment(self, model_route: ModelRoute, exclude: Optional[Deployment] = None) -> Deployment:
+        """
+        Pick a healthy deployment of the model's pool for a request, other
+        than `exclude` (e.g. the deployment a request is hedged from).
+        """
+        # Skip deployments ejected by the circuit breaker
+        deployments = [
+            deployment for deployment in model_route.deployments
+            if deployment is not exclude and self.circuit_breaker.is_available(deployment.api_base)
+        ]
+        if not deployments:
+            raise NoHealthyDeploymentError(f"No healthy deployment available for model {model_route.model_name}")
+
+        # Pick one deployment of the model's pool for this request
+        return self.load_balancer.select_deployment(model_route.model_name, deployments,
+                                                    model_route.routing_strategy)
+
+
+    async def configure_model_routing(self, model_route: ModelRoute, request_params: dict,
+                                      exclude: Optional[Deployment] = None) -> tuple:
+        """
+        Pick a deployment of the model's pool and build the litellm kwargs of the request.
+
+        Args:
+            model_route (ModelRoute): compiled route of the requested model
+            request_params (dict): request body sent by the client
+            exclude (Deployment): deployment that must not be picked
 
-            llm_route_config = routing_configs.get(model_name)
-            if llm_route_config is None:
-                raise KeyError(f"No route configuration found for model {model_name}")
+        Returns:
+            tuple: (kwargs for litellm, selected Deployment)
+        """
+        deployment = self.select_deployment(model_route, exclude=exclude)
 
-            # Update kwargs with specific route configurations
-            kwargs["model"] = llm_route_config.get("model")
-            kwargs["api_base"] = llm_route_config.get("api_base")
-            kwargs["api_key"] = llm_route_config.get("api_key")
+        # Update kwargs with the precompiled route configurations
+        kwargs = {**request_params, **deployment.litellm_kwargs}
+
+        # Determine the custom provider and handle accordingly
+        if deployment.provider == "azure":
+            kwargs = await self.azure_llm_handler.configure_azure_authentication(deployment.config, **kwargs)
+
+        # Reuse the keep-alive connections of the deployment's api_base
+        kwargs = self.connection_pools.configure_request(deployment, kwargs)
+
+        return kwargs, deployment
 
-            # Determine the custom provider and handle accordingly
-            custom_llm_provider = self.get_llm_provider(llm_route_config.get("model"))
-            if custom_llm_provider == "azure":
-                kwargs = self.azure_llm_handler.configure_azure_authentication(llm_route_config, **kwargs)
-            
-            return kwargs
-        except KeyError as e:
-            print(f"Missing required key: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            
 
 
 class AzureLLMHandler:
     def __init__(self):
         self.scopes = 'https://cognitiveservices.azure.com/.default'
-        self.token_cache: Dict[str, Dict[str, Any]] = {}
+        self.token_manager = AzureTokenManager(self.scopes, refresh_margin=settings.AZURE_TOKEN_REFRESH_MARGIN)
 
 
-    def configure_azure_authentication(self, llm_route_config: dict, **kwargs):
-        azure_ad_token_provider = llm_route_config.get("azure_ad_token_provider")
-        azure_ad_token = llm_route_config.get("azure_ad_token_provider")
-        
-        if not azure_ad_token and not azure_ad_token_provider:
-            azure_ad_token_provider = self.get_azure_ad_token_provider(client_id = llm_route_config.get("client_id"), 
-                                                                        tenant_id = llm_route_config.get("tenant_id"), 
-                                                                        client_secret =  llm_route_config.get("client_secret"))
-            azure_ad_token = azure_ad_token_provider()
+    async def configure_azure_authentication(self, llm_route_config: dict, **kwargs):
+        azure_ad_token = llm_route_config.get("azure_ad_token")
+
+        if not azure_ad_token:
+            azure_ad_token = await self.token_manager.get_token(client_id=llm_route_config.get("client_id"),
+                                                                tenant_id=llm_route_config.get("tenant_id"),
+                                                                client_secret=llm_route_config.get("client_secret"))
 
         kwargs["azure_ad_token"] = azure_ad_token
-        kwargs["extra_headers"] = llm_route_config.get("extra_headers")
+        extra_headers = llm_route_config.get("extra_headers")
+        kwargs["extra_headers"] = dict(extra_headers) if extra_headers else extra_headers
 
         return kwargs
-
-    def _get_cached_token_provider(self, cache_key: str) ->  Callable[[], str]:
-        token_info = self.token_cache.get(cache_key)
-        if token_info and not self._check_expire(token_info):
-            return token_info['azure_ad_token_provider']
-        return None
-
-
-    def _set_cache(self, cache_key: str, azure_ad_token_provider: Callable[[], str], expires_on: int) -> None:
-        self.token_cache[cache_key] = {
-            'azure_ad_token_provider': azure_ad_token_provider,
-            'expires_on': expires_on
-        }
-
-    def get_azure_ad_token_provider(self, client_id: str, tenant_id: str, client_secret: str) -> Callable[[], str]:
-        cache_key = f"{client_id}_{tenant_id}"
-        azure_ad_token_provider = self._get_cached_token_provider(cache_key)
-        if azure_ad_token_provider:
-            return azure_ad_token_provider
-        else:
-            try:
-                if not client_id or not tenant_id or not client_secret:
-                    raise ValueError("Client ID, Tenant ID, and Client Secret must be provided")
-
-                credential = ClientSecretCredential(client_id=client_id, tenant_id=tenant_id, client_secret=client_secret)
-                azure_ad_token_provider = get_bearer_token_provider(credential, self.scopes)
-
-                self._set_cache(cache_key, azure_ad_token_provider, expires_on = credential.get_token(self.scopes)[1])
-
-            except ValueError as e:
-                print(f"Invalid client credentials: {e}. Using DefaultAzureCredential instead.")
-            credential = DefaultAzureCredential()
-
-            return azure_ad_token_provider
-    
-    def _check_expire(self, token_info):
-        current_time = int(time.time())
-        expires_on = token_info.get('expires_on', 0)
-        return expires_on - current_time < 60
-
@@ -0,0 +1,87 @@
+from typing import (Dict, Optional)
+import itertools
+import random
+
+
+ROUTING_STRATEGIES = (
+    "round_robin",
+    "least_outstanding",
+    "latency_ewma",
+    "weighted",
+)
+
+
+class DeploymentStats:
+    __slots__ = ("outstanding", "latency_ewma")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+
+
+class LoadBalancer:
+    def __init__(self, default_strategy: str = "round_robin", ewma_alpha: float = 0.3):
+        self.default_strategy = default_strategy
+        self.ewma_alpha = ewma_alpha
+        # key: deployment_id --> value: DeploymentStats
+        self.deployment_stats: Dict[str, DeploymentStats] = {}
+        # key: model_name --> value: round robin counter
+        self._round_robin_counters: Dict[str, itertools.count] = {}
+
+
+    def _get_stats(self, deployment_id: str) -> DeploymentStats:
+        stats = self.deployment_stats.get(deployment_id)
+        if stats is None:
+            stats = self.deployment_stats[deployment_id] = DeploymentStats()
+        return stats
+
+
+    def select_deployment(self, model_name: str, deployments: list, strategy: Optional[str] = None):
+        """
+        Pick one deployment of a model's pool.
+
+        Args:
+            model_name (str): model name requested by the client
+            deployments (list): Deployment entries of the pool
+            strategy (str): one of ROUTING_STRATEGIES, defaults to the balancer default
+
+        Returns:
+            Deployment: the selected deployment
+        """
+        if not deployments:
+            raise KeyError(f"No deployment configured for model {model_name}")
+        if len(deployments) == 1:
+            return deployments[0]
+
+        strategy = strategy or self.default_strategy
+        if strategy == "round_robin":
+            counter = self._round_robin_counters.setdefault(model_name, itertools.count())
+            return deployments[next(counter) % len(deployments)]
+
+        if strategy == "least_outstanding":
+            return min(deployments, key=lambda d: self._get_stats(d.deployment_id).outstanding)
+
+        if strategy == "latency_ewma":
+            # deployments without any observation yet are tried first
+            return min(deployments, key=lambda d: self._get_stats(d.deployment_id).latency_ewma or 0.0)
+
+        if strategy == "weighted":
+            weights = [d.weight for d in deployments]
+            return random.choices(deployments, weights=weights, k=1)[0]
+
+        raise ValueError(f"Unknown routing strategy {strategy}, expected one of {ROUTING_STRATEGIES}")
+
+
+    def on_request_start(self, deployment_id: str) -> None:
+        self._get_stats(deployment_id).outstanding += 1
+
+
+    def on_request_end(self, deployment_id: str, latency: Optional[float] = None) -> None:
+        stats = self._get_stats(deployment_id)
+        stats.outstanding = max(stats.outstanding - 1, 0)
+        if latency is not None:
+            if stats.latency_ewma is None:
+                stats.latency_ewma = latency
+            else:
+                stats.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * stats.latency_ewma
+
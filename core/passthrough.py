@@ -0,0 +1,210 @@
+from datetime import datetime
+from typing import (Any, AsyncIterator, Dict, Optional)
+import json
+import litellm
+from litellm import CustomLogger
+from starlette.responses import Response
+from core.connection_pool import ConnectionPoolManager
+from core.route_table import Deployment
+from utils.sse import SSEStreamingResponse
+
+# key: call_type --> value: OpenAI endpoint forwarded to
+PASSTHROUGH_ENDPOINTS = {
+    "chat_completion": "/chat/completions",
+    "completion": "/completions",
+    "embedding": "/embeddings",
+}
+
+
+class PassthroughError(Exception):
+    """Error response of the upstream, forwarded to the client as is."""
+    def __init__(self, status_code: int, content: bytes):
+        super().__init__(f"Upstream returned status {status_code}")
+        self.status_code = status_code
+        self.content = content
+
+
+class PassthroughResponse:
+    """Raw body of a non-streaming upstream response."""
+    __slots__ = ("content", "status_code")
+
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+
+
+class SSEUsageParser:
+    """
+    Tail parser of an upstream SSE stream. Forwarded bytes are only cut at
+    event boundaries and searched for `"total_tokens"`; only the usage event
+    at the end of the stream is JSON decoded.
+    """
+    __slots__ = ("buffer", "usage", "drop_usage_event")
+
+    def __init__(self, drop_usage_event: bool = False):
+        self.buffer = b""
+        self.usage: Optional[Dict[str, Any]] = None
+        # the usage event was requested by the gateway, not by the client
+        self.drop_usage_event = drop_usage_event
+
+
+    def feed(self, data: bytes) -> bytes:
+        """Return the complete events of the received data that are forwarded."""
+        buffer = self.buffer + data if self.buffer else data
+        end = buffer.rfind(b"\n\n")
+        if end < 0:
+            self.buffer = buffer
+            return b""
+        events, self.buffer = buffer[:end + 2], buffer[end + 2:]
+        if b'"total_tokens"' in events:
+            events = self._parse_usage(events)
+        return events
+
+
+    def flush(self) -> bytes:
+        events, self.buffer = self.buffer, b""
+        if b'"total_tokens"' in events:
+            events = self._parse_usage(events)
+        return events
+
+
+    def _parse_usage(self, events: bytes) -> bytes:
+        forwarded = []
+        for event in events.split(b"\n\n"):
+            if b'"total_tokens"' in event and event.startswith(b"data:"):
+                try:
+                    data = json.loads(event[len(b"data:"):])
+                except ValueError:
+                    data = {}
+                if data.get("usage"):
+                    self.usage = data["usage"]
+                    if self.drop_usage_event and not data.get("choices"):
+                        continue
+            forwarded.append(event)
+        return b"\n\n".join(forwarded)
+
+
+class PassthroughHandler:
+    """
+    Forwards requests of models with `passthrough: true` to their openai
+    compatible deployment without converting them through litellm. Only the
+    model name, the credentials and the user are rewritten in the request
+    body, and the upstream response bytes are sent to the client unchanged.
+    Token usage is reported to the litellm callbacks (metrics, rate limits)
+    like for requests sent through litellm.
+    """
+    def __init__(self, connection_pools: ConnectionPoolManager):
+        self.connection_pools = connection_pools
+
+
+    def get_upstream_call(self, call_type: str, deployment: Deployment, metadata: Optional[dict] = None):
+        """
+        Return the upstream call of the deployment, called with the request body
+        as kwargs. `metadata` is handed to the success callbacks like litellm
+        does for the calls it sends (see RouteHandler._get_call_metadata).
+        """
+        endpoint = PASSTHROUGH_ENDPOINTS[call_type]
+
+        async def upstream_call(**body):
+            return await self.forward(endpoint, deployment, body, metadata=metadata)
+
+        return upstream_call
+
+
+    def build_request(self, request_params: dict, deployment: Deployment, user: Optional[str]) -> dict:
+        body = {**request_params, "model": deployment.upstream_model}
+        if user is not None:
+            body["user"] = user
+        return body
+
+
+    async def forward(self, endpoint: str, deployment: Deployment, body: dict, metadata: Optional[dict] = None):
+        is_stream = body.get("stream", False)
+        parser = None
+        if is_stream:
+            stream_options = body.get("stream_options") or {}
+            # ask for the usage event the client did not ask for, and drop it again
+            parser = SSEUsageParser(drop_usage_event=not stream_options.get("include_usage", False))
+            body["stream_options"] = {**stream_options, "include_usage": True}
+
+        http_client = self.connection_pools.get_http_client(deployment)
+        headers = {"Content-Type": "application/json"}
+        api_key = deployment.litellm_kwargs.get("api_key")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        start_time = datetime.now()
+        request = http_client.build_request("POST", deployment.api_base.rstrip("/") + endpoint,
+                                            content=json.dumps(body).encode(), headers=headers)
+        response = await http_client.send(request, stream=True)
+        if response.status_code >= 400:
+            try:
+                content = await response.aread()
+            finally:
+                await response.aclose()
+            raise PassthroughError(response.status_code, content)
+
+        if is_stream:
+            return self._stream(response, parser, body, start_time, metadata)
+
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        usage = json.loads(content).get("usage")
+        await self._log_success(body, usage, start_time, None, metadata)
+        return PassthroughResponse(content, response.status_code)
+
+
+    async def _stream(self, response, parser: SSEUsageParser, body: dict, start_time: datetime,
+                      metadata: Optional[dict] = None) -> AsyncIterator[bytes]:
+        completion_start_time = None
+        try:
+            async for data in response.aiter_raw():
+                if completion_start_time is None:
+                    completion_start_time = datetime.now()
+                events = parser.feed(data)
+                if events:
+                    yield events
+            events = parser.flush()
+            if events:
+                yield events
+        finally:
+            await response.aclose()
+        await self._log_success(body, parser.usage, start_time, completion_start_time, metadata)
+
+
+    async def _log_success(self, body: dict, usage: Optional[dict], start_time: datetime,
+                           completion_start_time: Optional[datetime], metadata: Optional[dict] = None) -> None:
+        usage = usage or {}
+        end_time = datetime.now()
+        kwargs = {
+            # the upstream model like litellm reports it, the gateway model name is in the metadata
+            "model": body.get("model"),
+            "user": body.get("user"),
+            "stream": body.get("stream", False),
+            "standard_logging_object": {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+            },
+            "start_time": start_time,
+            "api_call_start_time": start_time,
+            "completion_start_time": completion_start_time,
+            "end_time": end_time,
+            # same shape as the metadata litellm hands to the callbacks
+            "litellm_params": {"metadata": metadata or {}},
+        }
+        for callback in litellm.callbacks:
+            if not isinstance(callback, CustomLogger):
+                continue
+            try:
+                await callback.async_log_success_event(kwargs, None, start_time, end_time)
+            except Exception as e:
+                print(f"Error in passthrough success callback: {e}")
+
+
+    def to_response(self, response, is_stream: bool, on_disconnect=None) -> Response:
+        if is_stream:
+            return SSEStreamingResponse(response, on_disconnect=on_disconnect)
+        return Response(content=response.content, status_code=response.status_code, media_type="application/json")
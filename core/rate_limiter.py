@@ -0,0 +1,232 @@
+from contextvars import ContextVar
+from typing import (Dict, List, Optional, Tuple)
+import itertools
+import math
+import time
+from litellm import CustomLogger
+from core.shared_state import (SharedCounters,
+                               SharedState)
+
+
+# (level, user_profile field naming the entity of that level)
+RATE_LIMIT_LEVELS = (
+    ("user", "id"),
+    ("project", "project"),
+    ("org", "org"),
+)
+
+
+# reservation of the request being handled, handed to the success callbacks through the call metadata
+_rate_limit_reservation: ContextVar[Optional[int]] = ContextVar("ezllm_rate_limit_reservation", default=None)
+
+
+def get_rate_limit_reservation() -> Optional[int]:
+    return _rate_limit_reservation.get()
+
+
+class RateLimitExceededError(Exception):
+    def __init__(self, message: str, retry_after: float, level: str, limit_type: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.level = level
+        self.limit_type = limit_type
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        # tokens added per second
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+
+    def get_wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` tokens are available, 0 if they already are.
+        """
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+
+    def consume(self, amount: float) -> None:
+        # tokens may go negative when the actual usage is only known afterwards,
+        # and a negative amount gives back what an estimate consumed too much
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter(CustomLogger):
+    """
+    RPM / TPM limits per user, project and org enforced with in-memory token
+    buckets. Requests are checked before dispatch and consume their estimated
+    prompt tokens right away; token usage is reconciled from the litellm
+    success callback once the response is known. Requests that never reach
+    a success callback (cache hits, coalesced followers, failures) get
+    their estimate back from release() once their response is complete.
+
+    With a `shared_state` the buckets are shared by all workers: every worker
+    checks its local copy of a bucket and also consumes from it what the
+    other workers consumed, as reported by the periodic sync_shared_state().
+    """
+    def __init__(self, user_configs: dict, tenant_configs: dict, prometheus_logger=None,
+                 shared_state: Optional[SharedState] = None):
+        self.prometheus_logger = prometheus_logger
+        # key: (level, name, limit_type) --> value: TokenBucket
+        self.buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        # consumption of every bucket across workers, per refill period of the buckets
+        self.shared_counters = SharedCounters(shared_state, window=60.0) if shared_state is not None else None
+        # key: shared counter key --> value: TokenBucket
+        self.shared_buckets: Dict[str, TokenBucket] = {}
+        # key: reservation id --> value: (user_profile, estimated tokens) not reconciled yet
+        self._reservations: Dict[int, Tuple[dict, int]] = {}
+        self._reservation_ids = itertools.count(1)
+        self.update_configs(user_configs, tenant_configs)
+
+
+    def update_configs(self, user_configs: dict, tenant_configs: dict) -> None:
+        # key: level ("user" / "project" / "org") --> value: {name: {"rpm": int, "tpm": int, ...}}
+        self.tenant_configs = tenant_configs
+        # key: user_id --> value: user_profile
+        self.user_profiles = {user_profile['id']: user_profile for user_profile in user_configs.values()}
+
+
+    def _get_bucket(self, level: str, name: str, limit_type: str, limit: float) -> TokenBucket:
+        bucket_key = (level, name, limit_type)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None or bucket.capacity != limit:
+            bucket = self.buckets[bucket_key] = TokenBucket(capacity=limit, refill_rate=limit / 60.0)
+            if self.shared_counters is not None:
+                shared_key = self._get_shared_key(bucket_key)
+                self.shared_buckets[shared_key] = bucket
+                self.shared_counters.track(shared_key)
+        return bucket
+
+
+    def _get_shared_key(self, bucket_key: Tuple[str, str, str]) -> str:
+        return "ratelimit:" + ":".join(bucket_key)
+
+
+    def _consume(self, level: str, name: str, limit_type: str, bucket: TokenBucket, amount: float) -> None:
+        bucket.consume(amount)
+        if self.shared_counters is not None:
+            self.shared_counters.add(self._get_shared_key((level, name, limit_type)), amount)
+
+
+    def _get_buckets(self, user_profile: dict, limit_type: str) -> List[Tuple[str, str, TokenBucket]]:
+        buckets = []
+        for level, field in RATE_LIMIT_LEVELS:
+            name = user_profile.get(field)
+            if name is None:
+                continue
+            limits = self.tenant_configs.get(level, {}).get(name) or {}
+            limit = limits.get(limit_type)
+            if limit:
+                buckets.append((level, name, self._get_bucket(level, name, limit_type, float(limit))))
+        return buckets
+
+
+    def check_request(self, user_profile: Optional[dict], estimated_tokens: int = 0) -> Optional[int]:
+        """
+        Check every rpm / tpm limit of the user, its project and its org and,
+        if none of them is exceeded, count the request against the rpm limits
+        and its estimated prompt tokens against the tpm limits.
+
+        Returns:
+            int: reservation of the estimate, reconciled by the success callback
+            of the request or given back by release(); None without an estimate
+
+        Raises:
+            RateLimitExceededError: a limit is exceeded, retry_after tells when to retry
+        """
+        _rate_limit_reservation.set(None)
+        if not user_profile:
+            return None
+
+        rpm_buckets = self._get_buckets(user_profile, "rpm")
+        tpm_buckets = self._get_buckets(user_profile, "tpm")
+
+        for limit_type, buckets, amount in (("rpm", rpm_buckets, 1),
+                                            ("tpm", tpm_buckets, max(estimated_tokens, 1))):
+            for level, _, bucket in buckets:
+                wait_time = bucket.get_wait_time(min(amount, bucket.capacity))
+                if wait_time > 0:
+                    if self.prometheus_logger is not None:
+                        self.prometheus_logger.log_rate_limited_request(level, limit_type)
+                    raise RateLimitExceededError(
+                        f"Rate limit exceeded: {level} {limit_type} limit reached",
+                        retry_after=math.ceil(wait_time),
+                        level=level,
+                        limit_type=limit_type,
+                    )
+
+        # only consume once every level allowed the request
+        for level, name, bucket in rpm_buckets:
+            self._consume(level, name, "rpm", bucket, 1)
+        if not estimated_tokens or not tpm_buckets:
+            return None
+        for level, name, bucket in tpm_buckets:
+            self._consume(level, name, "tpm", bucket, estimated_tokens)
+        reservation = next(self._reservation_ids)
+        self._reservations[reservation] = (user_profile, estimated_tokens)
+        _rate_limit_reservation.set(reservation)
+        return reservation
+
+
+    def record_usage(self, user_profile: Optional[dict], total_tokens: int, reservation: Optional[int] = None) -> None:
+        """
+        Count the actual usage of a request, less the estimate of its reservation
+        if no other call of the request reconciled or released it already.
+        """
+        estimated_tokens = 0
+        if reservation is not None:
+            reserved = self._reservations.pop(reservation, None)
+            if reserved is not None:
+                estimated_tokens = reserved[1]
+        # without a reported usage the estimate stands
+        if not user_profile or not total_tokens or total_tokens == estimated_tokens:
+            return
+        for level, name, bucket in self._get_buckets(user_profile, "tpm"):
+            self._consume(level, name, "tpm", bucket, total_tokens - estimated_tokens)
+
+
+    def release(self, reservation: Optional[int]) -> None:
+        """
+        Give back the estimate of a reservation no success callback reconciled,
+        called once the response of the request is complete.
+        """
+        reserved = self._reservations.pop(reservation, None) if reservation is not None else None
+        if reserved is None:
+            return
+        user_profile, estimated_tokens = reserved
+        for level, name, bucket in self._get_buckets(user_profile, "tpm"):
+            self._consume(level, name, "tpm", bucket, -estimated_tokens)
+
+
+    async def sync_shared_state(self) -> None:
+        """Push the local consumption and consume what the other workers consumed meanwhile."""
+        for shared_key, amount in (await self.shared_counters.sync()).items():
+            bucket = self.shared_buckets.get(shared_key)
+            if bucket is not None:
+                bucket.consume(amount)
+
+
+    async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
+        try:
+            standard_logging_payload = kwargs.get("standard_logging_object") or {}
+            user_profile = self.user_profiles.get(kwargs.get("user", ""))
+            metadata = (kwargs.get("litellm_params") or {}).get("metadata") or {}
+            self.record_usage(user_profile, standard_logging_payload.get("total_tokens", 0),
+                              reservation=metadata.get("rate_limit_reservation"))
+        except Exception as e:
+            print(f"Error in RateLimiter.async_log_success_event: {e}")
@@ -0,0 +1,143 @@
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional)
+import asyncio
+from utils.sse import close_stream
+
+
+class StreamBroadcast:
+    """
+    Broadcast buffer of one upstream stream. A single pump task reads the
+    upstream chunks into a shared buffer, and every subscriber iterates over
+    that buffer from the first chunk, so followers that attach late still
+    receive the complete stream.
+    """
+    def __init__(self, upstream_call: Callable[[], Awaitable[Any]], on_done: Callable[[], None]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._new_chunk = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump(upstream_call))
+
+
+    async def _pump(self, upstream_call: Callable[[], Awaitable[Any]]) -> None:
+        response = None
+        try:
+            response = await upstream_call()
+            self._opened.set_result(True)
+            async for chunk in response:
+                self.chunks.append(chunk)
+                self._new_chunk.set()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+            if not self._opened.done():
+                self._opened.set_exception(e)
+        finally:
+            if not self._opened.done():
+                self._opened.cancel()
+            self.done = True
+            self._new_chunk.set()
+            self._on_done()
+            if response is not None:
+                await close_stream(response)
+
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """
+        Wait until the upstream stream is opened and return an iterator over
+        its chunks. Errors raised while opening the stream are re-raised here
+        so that every caller sees them before its response starts.
+        """
+        self.subscribers += 1
+        try:
+            await asyncio.shield(self._opened)
+        except BaseException:
+            self._unsubscribe()
+            raise
+        return self._iterate()
+
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                self._new_chunk.clear()
+                await self._new_chunk.wait()
+        finally:
+            self._unsubscribe()
+
+
+    def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        # nobody reads the stream anymore, stop the upstream generation
+        if self.subscribers <= 0 and not self.done:
+            self._pump_task.cancel()
+
+
+class RequestCoalescer:
+    def __init__(self, prometheus_logger=None):
+        self.prometheus_logger = prometheus_logger
+        # key: request_key --> value: in-flight upstream task / stream broadcast
+        self._inflight_calls: Dict[str, asyncio.Task] = {}
+        self._inflight_streams: Dict[str, StreamBroadcast] = {}
+
+
+    async def run(self, request_key: str, model: str, upstream_call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a non-streaming upstream call once for all identical concurrent
+        requests. Followers share the result (or the exception) of the leader.
+        """
+        task = self._inflight_calls.get(request_key)
+        if task is not None:
+            self._log_saved_call(model)
+        else:
+            task = asyncio.create_task(upstream_call())
+            self._inflight_calls[request_key] = task
+            task.add_done_callback(lambda t: self._on_call_done(request_key, t))
+
+        # shield the shared call so a disconnecting caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+
+    async def run_stream(self, request_key: str, model: str, upstream_call: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """
+        Open an upstream stream once for all identical concurrent requests.
+        Followers attach to the leader's chunk stream through a broadcast buffer.
+        """
+        broadcast = self._inflight_streams.get(request_key)
+        if broadcast is not None and not broadcast.done:
+            self._log_saved_call(model)
+        else:
+            broadcast = StreamBroadcast(upstream_call, on_done=lambda: self._on_stream_done(request_key, broadcast))
+            self._inflight_streams[request_key] = broadcast
+
+        return await broadcast.subscribe()
+
+
+    def _on_call_done(self, request_key: str, task: asyncio.Task) -> None:
+        if self._inflight_calls.get(request_key) is task:
+            del self._inflight_calls[request_key]
+        # mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+    def _on_stream_done(self, request_key: str, broadcast: StreamBroadcast) -> None:
+        if self._inflight_streams.get(request_key) is broadcast:
+            del self._inflight_streams[request_key]
+
+
+    def _log_saved_call(self, model: str) -> None:
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_coalesced_request(model)
@@ -0,0 +1,136 @@
+from contextvars import ContextVar
+from typing import (Callable, Dict, List, Optional, Sequence, Tuple)
+import time
+from starlette.types import (ASGIApp, Message, Receive, Scope, Send)
+
+
+class RequestTiming:
+    """
+    Phases of one gateway request (parse, auth, routing, queue, upstream,
+    ...), recorded by the code running them through request_phase().
+    """
+    __slots__ = ("method", "path", "traceparent", "start_time", "start_counter", "end_counter",
+                 "phases", "model", "status_code")
+
+    def __init__(self, method: str, path: str, traceparent: Optional[str] = None):
+        self.method = method
+        self.path = path
+        # W3C trace context of the client, continued by the exported spans
+        self.traceparent = traceparent
+        # wall clock time of the start, the phases are measured with perf_counter
+        self.start_time = time.time()
+        self.start_counter = time.perf_counter()
+        self.end_counter: Optional[float] = None
+        # (phase, start, end) as perf_counter values
+        self.phases: List[Tuple[str, float, float]] = []
+        # set once the request was routed to a configured model
+        self.model: Optional[str] = None
+        self.status_code: Optional[int] = None
+
+
+    def add_phase(self, phase: str, start: float, end: Optional[float] = None) -> None:
+        self.phases.append((phase, start, time.perf_counter() if end is None else end))
+
+
+    def get_durations(self) -> Dict[str, float]:
+        """Seconds per phase, summed over repeated phases (retries, hedges)."""
+        durations = {}
+        for phase, start, end in self.phases:
+            durations[phase] = durations.get(phase, 0.0) + end - start
+        return durations
+
+
+    def get_server_timing(self) -> str:
+        """Server-Timing header value of the phases so far, `total` being the time until now (milliseconds)."""
+        metrics = [f"{phase};dur={duration * 1000:.2f}" for phase, duration in self.get_durations().items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.start_counter) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+_request_timing: ContextVar[Optional[RequestTiming]] = ContextVar("ezllm_request_timing", default=None)
+
+
+def get_request_timing() -> Optional[RequestTiming]:
+    return _request_timing.get()
+
+
+def set_request_model(model: str) -> None:
+    request_timing = _request_timing.get()
+    if request_timing is not None:
+        request_timing.model = model
+
+
+class RequestPhase:
+    """Context manager adding the time spent in its block to the current request, if any."""
+    __slots__ = ("phase", "request_timing", "start")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+
+    def __enter__(self) -> "RequestPhase":
+        self.request_timing = _request_timing.get()
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.request_timing is not None:
+            self.request_timing.add_phase(self.phase, self.start)
+
+
+def request_phase(phase: str) -> RequestPhase:
+    return RequestPhase(phase)
+
+
+class RequestTimingMiddleware:
+    """
+    Track the phases of every HTTP request. The phases finished before the
+    response starts are sent in its Server-Timing header, and the complete
+    timing (including the `send` phase of the response body, the whole
+    stream for SSE) is handed to the `listeners` once the response ended.
+    """
+    def __init__(self, app: ASGIApp, listeners: Sequence[Callable[[RequestTiming], None]] = (),
+                 server_timing: bool = True):
+        self.app = app
+        self.listeners = tuple(listeners)
+        self.server_timing = server_timing
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers") or ():
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        request_timing = RequestTiming(scope.get("method", ""), scope.get("path", ""), traceparent=traceparent)
+        response_start = None
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal response_start
+            if message["type"] == "http.response.start":
+                response_start = time.perf_counter()
+                request_timing.status_code = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers") or ())
+                    headers.append((b"server-timing", request_timing.get_server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        token = _request_timing.set(request_timing)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timing.reset(token)
+            request_timing.end_counter = time.perf_counter()
+            if response_start is not None:
+                request_timing.add_phase("send", response_start, request_timing.end_counter)
+            for listener in self.listeners:
+                try:
+                    listener(request_timing)
+                except Exception as e:
+                    print(f"Error in request timing listener: {e}")
@@ -0,0 +1,136 @@
+from typing import (Any, AsyncIterator, List, Optional, Tuple)
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import time
+from utils.sse import close_stream
+
+# Request fields that do not change the generated output and therefore must not
+# be part of the cache key
+NON_CACHE_KEY_PARAMS = (
+    "user",
+    "stream",
+    "stream_options",
+    "metadata",
+    "timeout",
+)
+
+
+class CachedStream:
+    """
+    Chunk sequence of a finished streaming response.
+    """
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks: List[Any]):
+        self.chunks = chunks
+
+
+class ResponseCache:
+    def __init__(self, max_size: int = 1024, default_ttl: int = 300, max_stream_chunks: int = 4096,
+                 prometheus_logger=None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.max_stream_chunks = max_stream_chunks
+        self.prometheus_logger = prometheus_logger
+        # key: cache_key --> value: (expires_at, model, response)
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+
+
+    def get_cache_key(self, call_type: str, request_params: dict) -> str:
+        """
+        Build a canonical hash of the routed request: call type, model name,
+        messages or prompt and sampling params.
+
+        Args:
+            call_type (str): "chat_completion" or "completion"
+            request_params (dict): request body sent by the client
+
+        Returns:
+            str: sha256 hex digest of the request
+        """
+        key_params = {
+            key: value for key, value in request_params.items()
+            if key not in NON_CACHE_KEY_PARAMS
+        }
+        key_params["call_type"] = call_type
+        canonical_request = json.dumps(key_params, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+
+
+    def get(self, cache_key: str, model: str) -> Optional[Any]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            self._log_event("miss", model)
+            return None
+
+        expires_at, _, response = entry
+        if expires_at <= time.monotonic():
+            del self._entries[cache_key]
+            self._log_event("eviction", model, reason="ttl")
+            self._log_event("miss", model)
+            return None
+
+        self._entries.move_to_end(cache_key)
+        self._log_event("hit", model)
+        return response
+
+
+    def set(self, cache_key: str, model: str, response: Any, ttl: Optional[int] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        self._entries[cache_key] = (time.monotonic() + ttl, model, response)
+        self._entries.move_to_end(cache_key)
+
+        # LRU eviction once the size bound is exceeded
+        while len(self._entries) > self.max_size:
+            _, (_, evicted_model, _) = self._entries.popitem(last=False)
+            self._log_event("eviction", evicted_model, reason="size")
+
+
+    async def record_stream(self, response, cache_key: str, model: str, ttl: Optional[int] = None) -> AsyncIterator[Any]:
+        """
+        Pass the chunks of an upstream stream through while recording them.
+        The stream is only stored once it was consumed completely, so streams
+        that fail or are abandoned by the client are never replayed.
+        """
+        chunks = []
+        recording = True
+        try:
+            async for chunk in response:
+                if recording:
+                    chunks.append(chunk)
+                    if len(chunks) > self.max_stream_chunks:
+                        # too long to keep in memory, stop recording
+                        chunks, recording = [], False
+                yield chunk
+        finally:
+            await close_stream(response)
+
+        if recording:
+            self.set(cache_key, model, CachedStream(chunks), ttl=ttl)
+
+
+    async def replay_stream(self, cached_stream: CachedStream, chunk_delay: float = 0) -> AsyncIterator[Any]:
+        """
+        Replay the recorded chunks of a stream, optionally paced by chunk_delay seconds.
+        """
+        for chunk in cached_stream.chunks:
+            if chunk_delay:
+                await asyncio.sleep(chunk_delay)
+            yield chunk
+
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+    def _log_event(self, event: str, model: str, reason: Optional[str] = None) -> None:
+        if self.prometheus_logger is None:
+            return
+        if event == "hit":
+            self.prometheus_logger.log_cache_hit(model)
+        elif event == "miss":
+            self.prometheus_logger.log_cache_miss(model)
+        elif event == "eviction":
+            self.prometheus_logger.log_cache_eviction(model, reason)
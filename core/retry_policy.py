@@ -0,0 +1,85 @@
+from typing import (Any, Mapping, Optional)
+import asyncio
+import random
+import time
+import httpx
+from core.circuit_breaker import NoHealthyDeploymentError
+from core.scheduler import SchedulerRejectedError
+
+
+# upstream statuses retried (and falling back to the next model) unless a model sets its own `retry_on`
+DEFAULT_RETRY_ON = (408, 429, 500, 502, 503, 504)
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """
+    HTTP status of a failed upstream call, including the failures raised by
+    the gateway itself (408 for timeouts, 502 for connection errors, 503
+    when the model has no deployment able to take the request).
+    """
+    if isinstance(error, (NoHealthyDeploymentError, SchedulerRejectedError)):
+        return 503
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return 408
+    if isinstance(error, httpx.TransportError):
+        return 502
+    status_code = getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+class RetryPolicy:
+    """
+    Retries of a model, from the `retry_policy` block of its routing config
+    (router_settings.retry_policy provides the defaults). Retries wait with
+    exponential backoff and full jitter.
+    """
+    __slots__ = ("max_retries", "backoff", "max_backoff", "retry_on")
+
+    def __init__(self, retry_config: Optional[Mapping[str, Any]] = None):
+        retry_config = retry_config or {}
+        self.max_retries = int(retry_config.get("max_retries", 0))
+        # seconds of the first backoff, doubled with every retry up to max_backoff
+        self.backoff = float(retry_config.get("backoff", 0.5))
+        self.max_backoff = float(retry_config.get("max_backoff", 8))
+        self.retry_on = frozenset(int(status_code) for status_code in retry_config.get("retry_on", DEFAULT_RETRY_ON))
+
+
+    def get_backoff(self, retry: int) -> float:
+        """Seconds to wait before the `retry`-th retry (starting at 0)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+
+class RetryBudget:
+    """
+    Gateway wide cap of retries and fallbacks: every request earns `ratio`
+    credits and every extra attempt spends one, so that retries add at most
+    that share of load to failing backends instead of multiplying it. At
+    least `min_per_second` credits are earned per second for low traffic,
+    and at most `max_burst` credits are saved up.
+    """
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_burst: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_burst = max_burst
+        self.credits = max_burst
+        self.updated_at = time.monotonic()
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.credits = min(self.max_burst, self.credits + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+
+    def on_request(self) -> None:
+        """Earn retry budget for a request."""
+        self.credits = min(self.credits + self.ratio, self.max_burst)
+
+
+    def try_spend(self) -> bool:
+        """Spend retry budget for an extra attempt, False if it is exhausted."""
+        self._refill()
+        if self.credits < 1:
+            return False
+        self.credits -= 1
+        return True
@@ -1,29 +1,55 @@
-import httpx
+import asyncio
+import time
 import litellm
+from core.circuit_breaker import NoHealthyDeploymentError
+from core.embedding_batcher import (EmbeddingBatcher,
+                                    normalize_embedding_input)
+from core.hedging import RequestHedger
 from core.llm_handler import LLMHandler
+from core.passthrough import (PassthroughError,
+                              PassthroughHandler)
+from core.rate_limiter import get_rate_limit_reservation
+from core.request_coalescer import RequestCoalescer
+from core.request_timing import (get_request_timing,
+                                 request_phase,
+                                 set_request_model)
+from core.response_cache import ResponseCache
+from core.retry_policy import (RetryBudget,
+                               get_status_code)
+from core.route_table import (Deployment,
+                              ModelRoute,
+                              RouteNotFoundError)
+from core.scheduler import (AdmissionScheduler,
+                            SchedulerRejectedError)
 from fastapi import HTTPException
+from utils.setting import settings
+from utils.sse import close_stream
 
 
-# Skip SSL verification for the backend LLM API
-litellm.client_session = httpx.Client(verify=False)
-
 class RouteHandler:
-    def __init__(self):
-        self.llm_handler = LLMHandler()
-
-    def _extract_request_data(self, kwargs: dict) -> tuple:
-        master_token = kwargs.pop("master_token")
-        user_token = kwargs.pop("user_token")
-        user_configs = kwargs.pop("user_configs")
-        req_url_path = kwargs.pop("req_url_path")
-        
-        return master_token, user_token, user_configs, req_url_path, kwargs
-
+    def __init__(self, prometheus_logger=None, shared_state=None):
+        self.prometheus_logger = prometheus_logger
+        self.llm_handler = LLMHandler(prometheus_logger=prometheus_logger, shared_state=shared_state)
+        self.response_cache = ResponseCache(max_size=settings.RESPONSE_CACHE_MAX_SIZE,
+                                            default_ttl=settings.RESPONSE_CACHE_TTL,
+                                            max_stream_chunks=settings.RESPONSE_CACHE_MAX_STREAM_CHUNKS,
+                                            prometheus_logger=prometheus_logger)
+        self.request_coalescer = RequestCoalescer(prometheus_logger=prometheus_logger)
+        self.passthrough_handler = PassthroughHandler(self.llm_handler.connection_pools)
+        self.hedger = RequestHedger(window_size=settings.HEDGE_LATENCY_WINDOW,
+                                    min_samples=settings.HEDGE_MIN_SAMPLES,
+                                    prometheus_logger=prometheus_logger)
+        self.embedding_batcher = EmbeddingBatcher(prometheus_logger=prometheus_logger)
+        self.scheduler = AdmissionScheduler(default_max_queue_size=settings.SCHEDULER_MAX_QUEUE_SIZE,
+                                            default_queue_timeout=settings.SCHEDULER_QUEUE_TIMEOUT,
+                                            prometheus_logger=prometheus_logger)
+        self.retry_budget = RetryBudget(ratio=settings.RETRY_BUDGET_RATIO,
+                                        min_per_second=settings.RETRY_BUDGET_MIN_PER_SECOND)
 
-    def _process_user(self, user_token: str, master_token: str, user_configs: dict) -> dict:
+    def _process_user(self, user_token: str, user_configs: dict) -> dict:
         user_info = {}
 
-        if user_token == master_token:
+        if user_token == settings.MASTER_TOKEN:
             user_info["user"] = "admin"
         else:
             user_profile: dict = user_configs.get(user_token, {})
@@ -32,46 +58,538 @@ class RouteHandler:
         return user_info
 
 
-    async def chat_completion(self, **kwargs) -> litellm.ModelResponse:
-        try: 
-            master_token, user_token, user_configs, req_url_path, remaining_kwargs = self._extract_request_data(kwargs)
+    def _process_tenant(self, user_token: str, user_configs: dict, tenant_configs: dict, batch: bool = False,
+                        prompt_tokens: int = None) -> tuple:
+        """
+        Resolve the tenant (project or org, see EZLLM_SCHEDULER_FAIRNESS_LEVEL)
+        a request is scheduled for, and its scheduling weight. Batch requests
+        are scheduled as a separate tenant with a fraction of that weight, and
+        requests with an estimated prompt size weigh less the longer their
+        prompt is, so that tenants share the prefill capacity rather than
+        request counts.
+        """
+        if user_token == settings.MASTER_TOKEN:
+            tenant, weight = "admin", 1.0
+        else:
+            level = settings.SCHEDULER_FAIRNESS_LEVEL
+            user_profile: dict = user_configs.get(user_token, {})
+            tenant = user_profile.get(level) or "default"
+            tenant_config = tenant_configs.get(level, {}).get(tenant) or {}
+            weight = tenant_config.get("weight", 1.0)
 
-            updated_kwargs = self.llm_handler.configure_model_routing(**remaining_kwargs)
-            user_info = self._process_user(user_token, master_token, user_configs)
-            updated_kwargs.update(user_info)
+        if prompt_tokens:
+            weight /= 1 + prompt_tokens / settings.SCHEDULER_REQUEST_TOKENS
+        if batch:
+            return f"{tenant}/batch", weight * settings.BATCH_SCHEDULING_WEIGHT
+        return tenant, weight
 
 
-            response = await litellm.acompletion(**updated_kwargs)
-            return response  
-        
-        except AttributeError as e:
-            # Specifically handle cases where an attribute error occurs
-            detail_msg = f"Attribute error occurred: {str(e)}"
-            raise HTTPException(status_code=400, detail=detail_msg)
-        
-        except Exception as e:
-            # General exception catch to prevent leaking of server errors
-            raise HTTPException(status_code=500, detail=e)
+    def _get_disconnect_logger(self, model_name: str):
+        if self.prometheus_logger is None:
+            return None
+        return lambda chunks_sent: self.prometheus_logger.log_abandoned_stream(model_name, chunks_sent)
+
+
+    def _get_cached_response(self, call_type: str, model_route: ModelRoute, kwargs: dict) -> tuple:
+        """
+        Look up a request in the response cache. Streaming requests are only
+        cached when the model also enables `stream` in its cache_params, and a
+        hit is returned as a replay of the recorded chunks.
+
+        Returns:
+            tuple: (cache_key, cache_params, cached_response). cache_key is None
+                   when the request is not cacheable for the model.
+        """
+        model_name = model_route.model_name
+        cache_params = model_route.cache_params
+        if cache_params is None:
+            return None, None, None
+
+        is_stream = kwargs.get("stream", False)
+        if is_stream and not cache_params.get("stream", False):
+            return None, None, None
+        if is_stream:
+            call_type = f"{call_type}_stream"
+
+        cache_key = self.response_cache.get_cache_key(call_type, kwargs)
+        cached_response = self.response_cache.get(cache_key, model_name)
+        if cached_response is not None and is_stream:
+            cached_response = self.response_cache.replay_stream(cached_response,
+                                                                chunk_delay=cache_params.get("replay_chunk_delay", 0))
+        return cache_key, cache_params, cached_response
+
+
+    def _cache_response(self, cache_key: str, cache_params: dict, model_name: str, response, stream: bool):
+        """
+        Store a response in the cache. A stream is wrapped so that its chunks
+        are recorded while they are sent and stored once the stream finished.
+        """
+        if stream:
+            return self.response_cache.record_stream(response, cache_key, model_name, ttl=cache_params.get("ttl"))
+
+        self.response_cache.set(cache_key, model_name, response, ttl=cache_params.get("ttl"))
+        return response
+
+
+    async def _call_deployment(self, llm_call, updated_kwargs: dict, is_stream: bool,
+                               deployment: Deployment, tenant: str, weight: float):
+        """
+        Call the selected deployment once the admission scheduler granted a slot,
+        and report its load, latency and health to the load balancer and the
+        circuit breaker.
+        """
+        deployment_id = deployment.deployment_id
+        api_base = deployment.api_base
+
+        self.llm_handler.load_balancer.on_request_start(deployment_id)
+        self.llm_handler.circuit_breaker.on_request_start(api_base)
+        scheduled = False
+        try:
+            with request_phase("queue"):
+                scheduled = await self.scheduler.acquire(deployment, tenant, weight)
+            start_time = time.monotonic()
+            with request_phase("upstream"):
+                response = await llm_call(**updated_kwargs)
+        except BaseException as e:
+            self._end_deployment_call(deployment_id, api_base, scheduled, error=e)
+            raise
+
+        latency = time.monotonic() - start_time
+        if is_stream:
+            return self._track_stream(response, deployment_id, api_base, scheduled, latency)
+
+        self._end_deployment_call(deployment_id, api_base, scheduled, latency=latency)
+        return response
+
+
+    async def _track_stream(self, response, deployment_id: str, api_base: str, scheduled: bool, latency: float):
+        """
+        Keep a streaming request outstanding on its deployment until the stream
+        ends, and count errors raised mid-stream as deployment failures.
+        """
+        request_timing = get_request_timing()
+        phase, phase_start = "first_chunk", time.perf_counter()
+        try:
+            async for chunk in response:
+                if phase == "first_chunk" and request_timing is not None:
+                    request_timing.add_phase(phase, phase_start)
+                    phase, phase_start = "stream", time.perf_counter()
+                yield chunk
+        except BaseException as e:
+            self._end_deployment_call(deployment_id, api_base, scheduled, error=e)
+            raise
+        else:
+            self._end_deployment_call(deployment_id, api_base, scheduled, latency=latency)
+        finally:
+            if request_timing is not None:
+                request_timing.add_phase(phase, phase_start)
+            # release the upstream generation and connection right away, e.g. when the client went away
+            await close_stream(response)
+
+
+    def _end_deployment_call(self, deployment_id: str, api_base: str, scheduled: bool,
+                             latency: float = None, error: BaseException = None) -> None:
+        if scheduled:
+            self.scheduler.release(deployment_id)
+
+        circuit_breaker = self.llm_handler.circuit_breaker
+        if error is None:
+            self.llm_handler.load_balancer.on_request_end(deployment_id, latency)
+            circuit_breaker.record_success(api_base, latency)
+            return
+
+        self.llm_handler.load_balancer.on_request_end(deployment_id)
+        if isinstance(error, Exception) and not isinstance(error, SchedulerRejectedError):
+            circuit_breaker.record_failure(api_base, error)
+        else:
+            # cancelled or rejected before the deployment was asked
+            circuit_breaker.on_request_cancelled(api_base)
+
+
+    async def _first_response(self, model_name: str, llm_call, updated_kwargs: dict, is_stream: bool,
+                              deployment: Deployment, tenant: str, weight: float):
+        """
+        Call the deployment and, for streams, also wait for the first chunk,
+        so that the time to first response of the model is observed.
+        """
+        start_time = time.monotonic()
+        response = await self._call_deployment(llm_call, updated_kwargs, is_stream, deployment, tenant, weight)
+        if is_stream:
+            response = await self._wait_first_chunk(response)
+
+        self.hedger.record_latency(model_name, is_stream, time.monotonic() - start_time)
+        return response
+
+
+    async def _wait_first_chunk(self, response):
+        """Wait for the first chunk of a stream, so that errors before the first chunk are raised here."""
+        try:
+            first_chunks = (await response.__anext__(),)
+        except StopAsyncIteration:
+            first_chunks = ()
+        except BaseException:
+            await response.aclose()
+            raise
+        return self._resume_stream(first_chunks, response)
+
+
+    async def _resume_stream(self, first_chunks: tuple, response):
+        try:
+            for chunk in first_chunks:
+                yield chunk
+            async for chunk in response:
+                yield chunk
+        finally:
+            await response.aclose()
+
+
+    async def _call_hedged(self, model_route: ModelRoute, llm_call, updated_kwargs: dict, is_stream: bool,
+                           deployment: Deployment, tenant: str, weight: float, prepare_hedge):
+        """
+        Call the deployment and, if it did not respond (or send its first chunk)
+        within the hedging delay of the model, send the same request to a second
+        deployment. The first successful response is used and the other call is
+        cancelled.
+        """
+        model_name = model_route.model_name
+        hedge_params = model_route.hedge_params
+        self.hedger.on_request(model_name, hedge_params)
+        delay = self.hedger.get_delay(model_name, is_stream, hedge_params)
+
+        tasks = [asyncio.create_task(self._first_response(model_name, llm_call, updated_kwargs, is_stream,
+                                                          deployment, tenant, weight))]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.hedger.try_hedge(model_name):
+                    try:
+                        hedge_call, hedge_kwargs, hedge_deployment = await prepare_hedge(deployment)
+                    except NoHealthyDeploymentError:
+                        self.hedger.log_skipped(model_name, "no_deployment")
+                    else:
+                        tasks.append(asyncio.create_task(self._first_response(
+                            model_name, hedge_call, hedge_kwargs, is_stream, hedge_deployment, tenant, weight
+                        )))
+            winner = await self._first_success(tasks)
+        except BaseException:
+            await self._discard_calls(tasks, is_stream)
+            raise
+
+        await self._discard_calls([task for task in tasks if task is not winner], is_stream)
+        if len(tasks) > 1:
+            self.hedger.log_hedged(model_name, "primary" if winner is tasks[0] else "hedge")
+        return winner.result()
+
+
+    async def _first_success(self, tasks: list) -> asyncio.Task:
+        """Return the first call that succeeded, or raise the error of the primary call if all failed."""
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    return task
+        raise tasks[0].exception() or tasks[-1].exception()
+
+
+    async def _discard_calls(self, tasks: list, is_stream: bool) -> None:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                # the cancelled call releases its deployment in _call_deployment
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            elif not task.cancelled() and task.exception() is None and is_stream:
+                await task.result().aclose()
+
+
+    def _get_call_metadata(self, model_route: ModelRoute, req_body: dict) -> dict:
+        """
+        Metadata handed to the success callbacks: the gateway model name the
+        usage is recorded under and the rate limit reservation of the prompt
+        estimate (the rate limiter only adds the difference to the actual usage).
+        """
+        metadata = {**(req_body.get("metadata") or {}), "model_name": model_route.model_name}
+        reservation = get_rate_limit_reservation()
+        if reservation is not None:
+            metadata["rate_limit_reservation"] = reservation
+        return metadata
 
 
-    async def completion(self, **kwargs) -> litellm.ModelResponse:
-        try: 
-            master_token, user_token, user_configs, req_url_path, remaining_kwargs = self._extract_request_data(kwargs)
+    async def _call_upstream(self, call_type: str, llm_call, model_route: ModelRoute, request_params: dict,
+                             updated_kwargs: dict, deployment: Deployment,
+                             cache_key: str = None, cache_params: dict = None,
+                             tenant: str = "default", weight: float = 1.0, user: str = None, prepare_hedge=None,
+                             wait_first_chunk: bool = False):
+        """
+        Send the routed request upstream. Identical concurrent requests of models
+        that enable `coalesce` in routing_configs.yaml share one upstream call,
+        and models that enable `hedging` race slow requests against a second
+        deployment (prepare_hedge returns its llm_call, kwargs and deployment).
+        With wait_first_chunk, a stream is only returned once its first chunk
+        arrived (hedged streams always are). Only requests of the same user are
+        coalesced, so that the usage of every caller is recorded.
+        """
+        model_name = model_route.model_name
+        is_stream = request_params.get("stream", False)
 
-            updated_kwargs = self.llm_handler.configure_model_routing(**remaining_kwargs)
-            user_info = self._process_user(user_token, master_token, user_configs)
-            updated_kwargs.update(user_info)
+        async def upstream_call():
+            if model_route.hedge_params is not None and prepare_hedge is not None:
+                response = await self._call_hedged(model_route, llm_call, updated_kwargs, is_stream, deployment,
+                                                   tenant, weight, prepare_hedge)
+            else:
+                response = await self._call_deployment(llm_call, updated_kwargs, is_stream, deployment, tenant, weight)
+                if is_stream and wait_first_chunk:
+                    response = await self._wait_first_chunk(response)
+            if cache_key is not None:
+                response = self._cache_response(cache_key, cache_params, model_name, response, stream=is_stream)
+            return response
 
-            response = await litellm.atext_completion(**updated_kwargs)
-            return response  
-        
-        except AttributeError as e:
+        if not model_route.coalesce:
+            return await upstream_call()
+
+        if is_stream:
+            request_key = f"{user}:{self.response_cache.get_cache_key(f'{call_type}_stream', request_params)}"
+            return await self.request_coalescer.run_stream(request_key, model_name, upstream_call)
+
+        request_key = f"{user}:{self.response_cache.get_cache_key(call_type, request_params)}"
+        return await self.request_coalescer.run(request_key, model_name, upstream_call)
+
+
+    async def _route_passthrough(self, call_type: str, model_route: ModelRoute, req_body: dict, user_token: str,
+                                 config_snapshot, batch: bool = False, prompt_tokens: int = None,
+                                 wait_first_chunk: bool = False):
+        """
+        Forward the request bytes to the deployment and its response bytes to
+        the client (models with `passthrough: true` in routing_configs.yaml).
+        """
+        passthrough_call_type = f"{call_type}_passthrough"
+        cache_key, cache_params, response = self._get_cached_response(passthrough_call_type, model_route, req_body)
+        if response is None:
+            with request_phase("routing"):
+                deployment = self.llm_handler.select_deployment(model_route)
+            user_info = self._process_user(user_token, config_snapshot.user_configs)
+            body = self.passthrough_handler.build_request(req_body, deployment, user_info["user"])
+            tenant, weight = self._process_tenant(user_token, config_snapshot.user_configs, config_snapshot.tenant_configs,
+                                                  batch=batch, prompt_tokens=prompt_tokens)
+            metadata = self._get_call_metadata(model_route, req_body)
+            upstream_call = self.passthrough_handler.get_upstream_call(call_type, deployment, metadata=metadata)
+
+            async def prepare_hedge(exclude: Deployment):
+                hedge_deployment = self.llm_handler.select_deployment(model_route, exclude=exclude)
+                return (self.passthrough_handler.get_upstream_call(call_type, hedge_deployment, metadata=metadata),
+                        self.passthrough_handler.build_request(req_body, hedge_deployment, user_info["user"]),
+                        hedge_deployment)
+
+            response = await self._call_upstream(passthrough_call_type, upstream_call, model_route, req_body, body,
+                                                 deployment, cache_key=cache_key, cache_params=cache_params,
+                                                 tenant=tenant, weight=weight, user=user_info["user"],
+                                                 prepare_hedge=prepare_hedge, wait_first_chunk=wait_first_chunk)
+
+        return self.passthrough_handler.to_response(response, req_body.get("stream", False),
+                                                    on_disconnect=self._get_disconnect_logger(model_route.model_name))
+
+
+    async def _route_request(self, call_type: str, llm_call, req_body: dict, user_token: str, config_snapshot,
+                             batch: bool = False, prompt_tokens: int = None):
+        model_route = config_snapshot.route_table.get(req_body.get("model"))
+        self.retry_budget.on_request()
+        if model_route.retry_policy.max_retries or model_route.fallbacks:
+            return await self._route_with_retries(call_type, llm_call, model_route, req_body, user_token,
+                                                  config_snapshot, batch=batch, prompt_tokens=prompt_tokens)
+        return await self._route_model(call_type, llm_call, model_route, req_body, user_token, config_snapshot,
+                                       batch=batch, prompt_tokens=prompt_tokens)
+
+
+    async def _route_with_retries(self, call_type: str, llm_call, model_route: ModelRoute, req_body: dict,
+                                  user_token: str, config_snapshot, batch: bool = False, prompt_tokens: int = None):
+        """
+        Route a request and, when it fails with a status in the `retry_on` of
+        its model, retry it with backoff (`retry_policy` in
+        routing_configs.yaml), then try the `fallbacks` of the model in order.
+        Every extra attempt spends retry budget, and streams are only retried
+        until their first chunk arrived, before anything was sent to the client.
+        """
+        route_table = config_snapshot.route_table
+        model_routes = [model_route] + [route_table.routes[fallback] for fallback in model_route.fallbacks
+                                        if fallback in route_table.routes]
+        error, failed_model, status_code = None, None, None
+        for route in model_routes:
+            body = req_body if route is model_route else {**req_body, "model": route.model_name}
+            retry_policy = route.retry_policy
+            for retry in range(retry_policy.max_retries + 1):
+                if error is not None:
+                    if not self._spend_retry(failed_model, status_code, "retry" if retry else "fallback"):
+                        raise error
+                    if retry:
+                        await asyncio.sleep(retry_policy.get_backoff(retry - 1))
+                try:
+                    return await self._route_model(call_type, llm_call, route, body, user_token, config_snapshot,
+                                                   batch=batch, prompt_tokens=prompt_tokens, wait_first_chunk=True)
+                except Exception as e:
+                    status_code = get_status_code(e)
+                    if status_code not in retry_policy.retry_on:
+                        raise
+                    error, failed_model = e, route.model_name
+                    if isinstance(e, NoHealthyDeploymentError):
+                        # no deployment of the model left to retry on
+                        break
+
+        self._log_failed_attempt(failed_model, status_code, "exhausted")
+        raise error
+
+
+    def _spend_retry(self, model_name: str, status_code: int, action: str) -> bool:
+        if not self.retry_budget.try_spend():
+            self._log_failed_attempt(model_name, status_code, "budget_exhausted")
+            return False
+        self._log_failed_attempt(model_name, status_code, action)
+        return True
+
+
+    def _log_failed_attempt(self, model_name: str, status_code: int, action: str) -> None:
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_failed_attempt(model_name, status_code, action)
+
+
+    async def _route_model(self, call_type: str, llm_call, model_route: ModelRoute, req_body: dict, user_token: str,
+                           config_snapshot, batch: bool = False, prompt_tokens: int = None,
+                           wait_first_chunk: bool = False):
+        if model_route.passthrough:
+            return await self._route_passthrough(call_type, model_route, req_body, user_token, config_snapshot,
+                                                 batch=batch, prompt_tokens=prompt_tokens,
+                                                 wait_first_chunk=wait_first_chunk)
+
+        cache_key, cache_params, cached_response = self._get_cached_response(call_type, model_route, req_body)
+        if cached_response is not None:
+            return cached_response
+
+        return await self._send_request(call_type, llm_call, model_route, req_body, user_token, config_snapshot,
+                                        cache_key=cache_key, cache_params=cache_params, batch=batch,
+                                        prompt_tokens=prompt_tokens, wait_first_chunk=wait_first_chunk)
+
+
+    async def _send_request(self, call_type: str, llm_call, model_route: ModelRoute, req_body: dict, user_token: str,
+                            config_snapshot, cache_key: str = None, cache_params: dict = None, batch: bool = False,
+                            prompt_tokens: int = None, wait_first_chunk: bool = False):
+        with request_phase("routing"):
+            updated_kwargs, deployment = await self.llm_handler.configure_model_routing(model_route, req_body)
+        user_info = self._process_user(user_token, config_snapshot.user_configs)
+        user_info["metadata"] = self._get_call_metadata(model_route, req_body)
+        updated_kwargs.update(user_info)
+        tenant, weight = self._process_tenant(user_token, config_snapshot.user_configs, config_snapshot.tenant_configs,
+                                              batch=batch, prompt_tokens=prompt_tokens)
+
+        async def prepare_hedge(exclude: Deployment):
+            hedge_kwargs, hedge_deployment = await self.llm_handler.configure_model_routing(model_route, req_body,
+                                                                                           exclude=exclude)
+            hedge_kwargs.update(user_info)
+            return llm_call, hedge_kwargs, hedge_deployment
+
+        return await self._call_upstream(call_type, llm_call, model_route, req_body, updated_kwargs, deployment,
+                                         cache_key=cache_key, cache_params=cache_params,
+                                         tenant=tenant, weight=weight, user=user_info["user"],
+                                         prepare_hedge=prepare_hedge, wait_first_chunk=wait_first_chunk)
+
+
+    async def _route_embedding(self, req_body: dict, user_token: str, config_snapshot, batch: bool = False):
+        """
+        Route an embedding request. Requests of models that enable
+        `embedding_batching` in routing_configs.yaml are merged with the
+        concurrent requests of the same user into one upstream call.
+        """
+        model_route = config_snapshot.route_table.get(req_body.get("model"))
+        set_request_model(model_route.model_name)
+        embedding_batch_params = model_route.embedding_batch_params
+        normalized_input = normalize_embedding_input(req_body.get("input"))
+        if model_route.passthrough or embedding_batch_params is None or normalized_input is None:
+            return await self._route_request("embedding", litellm.aembedding, req_body, user_token, config_snapshot,
+                                             batch=batch)
+
+        input_kind, inputs = normalized_input
+        max_batch_size = int(embedding_batch_params.get("max_batch_size", settings.EMBEDDING_BATCH_MAX_SIZE))
+        max_wait = float(embedding_batch_params.get("max_wait_ms", settings.EMBEDDING_BATCH_MAX_WAIT_MS)) / 1000
+        if len(inputs) >= max_batch_size:
+            # already a full batch
+            return await self._route_request("embedding", litellm.aembedding, req_body, user_token, config_snapshot,
+                                             batch=batch)
+
+        cache_key, cache_params, cached_response = self._get_cached_response("embedding", model_route, req_body)
+        if cached_response is not None:
+            return cached_response
+
+        user_info = self._process_user(user_token, config_snapshot.user_configs)
+        # only requests of the same user and with the same params share an upstream call
+        batch_key = self.response_cache.get_cache_key(f"embedding_batch_{input_kind}", {
+            **req_body, "input": None, "batch_user": user_info["user"], "batch": batch,
+        })
+
+        async def send(batch_inputs: list):
+            batch_body = {**req_body, "input": batch_inputs}
+            self.retry_budget.on_request()
+            if model_route.retry_policy.max_retries or model_route.fallbacks:
+                # the merged call is retried and falls back like a single request
+                return await self._route_with_retries("embedding", litellm.aembedding, model_route, batch_body,
+                                                      user_token, config_snapshot, batch=batch)
+            return await self._send_request("embedding", litellm.aembedding, model_route, batch_body, user_token,
+                                            config_snapshot, batch=batch)
+
+        response = await self.embedding_batcher.submit(batch_key, model_route.model_name, inputs, send,
+                                                       max_batch_size=max_batch_size, max_wait=max_wait)
+        if cache_key is not None:
+            response = self._cache_response(cache_key, cache_params, model_route.model_name, response, stream=False)
+        return response
+
+
+    def _to_http_exception(self, e: Exception) -> HTTPException:
+        """Map an error raised while routing a request to the HTTP error returned to the client."""
+        if isinstance(e, RouteNotFoundError):
+            return HTTPException(status_code=400, detail=str(e.args[0]))
+
+        if isinstance(e, NoHealthyDeploymentError):
+            # Fail fast instead of waiting for the upstream timeout of an ejected deployment
+            return HTTPException(status_code=503, detail=str(e))
+
+        if isinstance(e, SchedulerRejectedError):
+            # Backend is saturated: the queue is full or the request waited too long
+            return HTTPException(status_code=503, detail=str(e))
+
+        if isinstance(e, (litellm.RateLimitError, litellm.ServiceUnavailableError, litellm.Timeout)):
+            # Upstream still saturated once the retries and fallbacks failed, the client may retry later
+            return HTTPException(status_code=e.status_code, detail=str(e))
+
+        if isinstance(e, PassthroughError):
+            # Forward the upstream error of a passthrough model
+            return HTTPException(status_code=e.status_code, detail=e.content.decode(errors="replace"))
+
+        if isinstance(e, AttributeError):
             # Specifically handle cases where an attribute error occurs
-            detail_msg = f"Attribute error occurred: {str(e)}"
-            raise HTTPException(status_code=400, detail=detail_msg)
-        
+            return HTTPException(status_code=400, detail=f"Attribute error occurred: {str(e)}")
+
+        # General exception catch to prevent leaking of server errors
+        return HTTPException(status_code=500, detail=str(e))
+
+
+    async def chat_completion(self, req_body: dict, user_token: str, config_snapshot,
+                              batch: bool = False, prompt_tokens: int = None) -> litellm.ModelResponse:
+        try:
+            return await self._route_request("chat_completion", litellm.acompletion, req_body, user_token,
+                                             config_snapshot, batch=batch, prompt_tokens=prompt_tokens)
         except Exception as e:
-            # General exception catch to prevent leaking of server errors
-            raise HTTPException(status_code=500, detail=e)
+            raise self._to_http_exception(e)
+
 
+    async def completion(self, req_body: dict, user_token: str, config_snapshot,
+                         batch: bool = False, prompt_tokens: int = None) -> litellm.ModelResponse:
+        try:
+            return await self._route_request("completion", litellm.atext_completion, req_body, user_token,
+                                             config_snapshot, batch=batch, prompt_tokens=prompt_tokens)
+        except Exception as e:
+            raise self._to_http_exception(e)
 
+
+    async def embedding(self, req_body: dict, user_token: str, config_snapshot,
+                        batch: bool = False) -> litellm.EmbeddingResponse:
+        try:
+            return await self._route_embedding(req_body, user_token, config_snapshot, batch=batch)
+        except Exception as e:
+            raise self._to_http_exception(e)
@@ -0,0 +1,95 @@
+from types import MappingProxyType
+from typing import (Any, Mapping, Optional, Tuple)
+from core.connection_pool import PoolParams
+from core.retry_policy import RetryPolicy
+
+
+class RouteNotFoundError(KeyError):
+    """
+    Raised when the requested model has no route configuration.
+    """
+
+
+class Deployment:
+    """
+    One upstream deployment of a model with everything the request path
+    needs already resolved.
+    """
+    __slots__ = ("deployment_id", "model_name", "provider", "upstream_model", "api_base", "litellm_kwargs",
+                 "weight", "max_concurrency", "max_queue_size", "queue_timeout", "pool_params", "config")
+
+    def __init__(self, deployment_id: str, model_name: str, litellm_params: Mapping[str, Any]):
+        self.deployment_id = deployment_id
+        self.model_name = model_name
+        self.provider, _, self.upstream_model = litellm_params["model"].partition('/')
+        self.api_base = litellm_params.get("api_base")
+        # kwargs merged into every request sent to this deployment
+        self.litellm_kwargs = MappingProxyType({
+            "model": litellm_params.get("model"),
+            "api_base": litellm_params.get("api_base"),
+            "api_key": litellm_params.get("api_key"),
+        })
+        self.weight = float(litellm_params.get("weight", 1))
+        self.max_concurrency = litellm_params.get("max_concurrency")
+        self.max_queue_size = litellm_params.get("max_queue_size")
+        self.queue_timeout = litellm_params.get("queue_timeout")
+        self.pool_params = PoolParams(litellm_params.get("connection_pool"))
+        # raw litellm_params, e.g. for provider specific authentication
+        self.config = litellm_params
+
+
+class ModelRoute:
+    __slots__ = ("model_name", "deployments", "routing_strategy", "cache_params", "coalesce", "passthrough", "hedge_params",
+                 "embedding_batch_params", "max_context", "tokenizer", "clamp_max_tokens",
+                 "retry_policy", "fallbacks")
+
+    def __init__(self, model_name: str, model_route_config: Mapping[str, Any]):
+        self.model_name = model_name
+        self.deployments: Tuple[Deployment, ...] = tuple(
+            Deployment(deployment["deployment_id"], model_name, deployment)
+            for deployment in model_route_config.get("deployments", ())
+        )
+        self.routing_strategy = model_route_config.get("routing_strategy")
+        cache_params = model_route_config.get("cache_params") or {}
+        # None unless the model opted in to response caching
+        self.cache_params = cache_params if cache_params.get("enabled", False) else None
+        self.coalesce = bool(model_route_config.get("coalesce", False))
+        # forward the raw request / response bytes instead of going through litellm
+        self.passthrough = bool(model_route_config.get("passthrough", False))
+        hedge_params = model_route_config.get("hedging") or {}
+        # None unless the model opted in to request hedging
+        self.hedge_params = hedge_params if hedge_params.get("enabled", False) else None
+        embedding_batch_params = model_route_config.get("embedding_batching") or {}
+        # None unless the model opted in to micro-batching of embedding requests
+        self.embedding_batch_params = embedding_batch_params if embedding_batch_params.get("enabled", False) else None
+        max_context = model_route_config.get("max_context")
+        # context window (prompt + completion tokens) enforced by the gateway, None if not declared
+        self.max_context = int(max_context) if max_context else None
+        # local tokenizer the prompt tokens are counted with, see TokenCounter
+        self.tokenizer = model_route_config.get("tokenizer")
+        # lower max_tokens to the room left by the prompt instead of rejecting the request
+        self.clamp_max_tokens = bool(model_route_config.get("clamp_max_tokens", True))
+        self.retry_policy = RetryPolicy(model_route_config.get("retry_policy"))
+        # models tried in order once the retries of this model failed
+        self.fallbacks: Tuple[str, ...] = tuple(
+            fallback for fallback in model_route_config.get("fallbacks") or () if fallback != model_name
+        )
+
+
+class RouteTable:
+    """
+    Routing configs compiled once per config snapshot, so that routing a
+    request is a single dict lookup.
+    """
+    def __init__(self, routing_configs: Mapping[str, Any]):
+        self.routes: Mapping[str, ModelRoute] = MappingProxyType({
+            model_name: ModelRoute(model_name, model_route_config)
+            for model_name, model_route_config in routing_configs.items()
+        })
+
+
+    def get(self, model_name: Optional[str]) -> ModelRoute:
+        model_route = self.routes.get(model_name)
+        if model_route is None:
+            raise RouteNotFoundError(f"No route configuration found for model {model_name}")
+        return model_route
@@ -0,0 +1,171 @@
+from typing import (Deque, Dict, Optional, Tuple)
+from collections import deque
+import asyncio
+import time
+
+
+class SchedulerRejectedError(Exception):
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class DeploymentQueue:
+    __slots__ = ("max_concurrency", "max_queue_size", "in_flight", "queued",
+                 "waiters", "virtual_times", "virtual_time")
+
+    def __init__(self, max_concurrency: int, max_queue_size: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.in_flight = 0
+        self.queued = 0
+        # key: tenant --> value: queue of (future, weight) of the waiting requests of that tenant
+        self.waiters: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {}
+        # key: tenant --> value: virtual finish time of the tenant (stride scheduling)
+        self.virtual_times: Dict[str, float] = {}
+        # virtual time of the last dispatched request
+        self.virtual_time = 0.0
+
+
+class AdmissionScheduler:
+    """
+    Caps in-flight requests per deployment (`max_concurrency` in its
+    litellm_params) and holds excess requests in a bounded queue. Free slots
+    are handed out weighted-fair across tenants: every dispatch advances the
+    tenant's virtual time by 1 / weight of the request and the tenant with
+    the smallest virtual time is served next.
+    """
+    def __init__(self, default_max_queue_size: int = 256, default_queue_timeout: float = 30.0,
+                 prometheus_logger=None):
+        self.default_max_queue_size = default_max_queue_size
+        self.default_queue_timeout = default_queue_timeout
+        self.prometheus_logger = prometheus_logger
+        # key: deployment_id --> value: DeploymentQueue
+        self.queues: Dict[str, DeploymentQueue] = {}
+
+
+    def _get_queue(self, deployment_id: str, max_concurrency: int, max_queue_size: int) -> DeploymentQueue:
+        queue = self.queues.get(deployment_id)
+        if queue is None:
+            queue = self.queues[deployment_id] = DeploymentQueue(max_concurrency, max_queue_size)
+        else:
+            # follow config changes of the deployment
+            queue.max_concurrency = max_concurrency
+            queue.max_queue_size = max_queue_size
+        return queue
+
+
+    async def acquire(self, deployment, tenant: str, weight: float = 1.0) -> bool:
+        """
+        Wait for a free slot on the deployment.
+
+        Args:
+            deployment (Deployment): deployment the request is sent to
+            tenant (str): project / org the request is accounted to
+            weight (float): scheduling weight of the request (weight of the tenant, lowered for large prompts)
+
+        Returns:
+            bool: True if a slot was taken and release() must be called, False
+                  if the deployment has no concurrency limit.
+
+        Raises:
+            SchedulerRejectedError: the queue is full or the request waited too long
+        """
+        max_concurrency = deployment.max_concurrency
+        if not max_concurrency:
+            return False
+
+        deployment_id = deployment.deployment_id
+        queue = self._get_queue(deployment_id, int(max_concurrency),
+                                int(deployment.max_queue_size or self.default_max_queue_size))
+
+        if queue.in_flight < queue.max_concurrency and queue.queued == 0:
+            queue.in_flight += 1
+            self._log_queue(deployment_id, queue, wait_time=0.0)
+            return True
+
+        if queue.queued >= queue.max_queue_size:
+            self._log_rejected(deployment_id, "queue_full")
+            raise SchedulerRejectedError(f"Too many queued requests for deployment {deployment_id}", "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        if tenant not in queue.waiters:
+            queue.waiters[tenant] = deque()
+            # a tenant becoming active must not use up credit from its idle time
+            queue.virtual_times[tenant] = max(queue.virtual_times.get(tenant, 0.0), queue.virtual_time)
+        waiter = (future, max(float(weight or 1), 1e-6))
+        queue.waiters[tenant].append(waiter)
+        queue.queued += 1
+        self._log_queue(deployment_id, queue)
+
+        start_time = time.monotonic()
+        queue_timeout = float(deployment.queue_timeout or self.default_queue_timeout)
+        try:
+            await asyncio.wait_for(future, timeout=queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # the slot was granted while we gave up waiting, hand it on
+                self.release(deployment_id)
+            else:
+                self._remove_waiter(queue, tenant, waiter)
+                self._log_queue(deployment_id, queue)
+            if isinstance(e, asyncio.TimeoutError):
+                self._log_rejected(deployment_id, "queue_timeout")
+                raise SchedulerRejectedError(f"Request timed out after {queue_timeout}s in the queue of deployment {deployment_id}",
+                                             "queue_timeout")
+            raise
+
+        self._log_queue(deployment_id, queue, wait_time=time.monotonic() - start_time)
+        return True
+
+
+    def release(self, deployment_id: str) -> None:
+        queue = self.queues.get(deployment_id)
+        if queue is None:
+            return
+        queue.in_flight = max(queue.in_flight - 1, 0)
+        self._dispatch(queue)
+        self._log_queue(deployment_id, queue)
+
+
+    def _dispatch(self, queue: DeploymentQueue) -> None:
+        while queue.in_flight < queue.max_concurrency and queue.queued > 0:
+            tenant = min(queue.waiters, key=lambda t: queue.virtual_times[t])
+            tenant_waiters = queue.waiters[tenant]
+            future, weight = tenant_waiters.popleft()
+            queue.queued -= 1
+            if not tenant_waiters:
+                del queue.waiters[tenant]
+
+            queue.virtual_time = queue.virtual_times[tenant]
+            queue.virtual_times[tenant] += 1.0 / weight
+            if future.done():
+                continue
+            queue.in_flight += 1
+            future.set_result(True)
+
+
+    def _remove_waiter(self, queue: DeploymentQueue, tenant: str, waiter: Tuple[asyncio.Future, float]) -> None:
+        tenant_waiters = queue.waiters.get(tenant)
+        if not tenant_waiters:
+            return
+        try:
+            tenant_waiters.remove(waiter)
+            queue.queued -= 1
+        except ValueError:
+            return
+        if not tenant_waiters:
+            del queue.waiters[tenant]
+
+
+    def _log_queue(self, deployment_id: str, queue: DeploymentQueue, wait_time: Optional[float] = None) -> None:
+        if self.prometheus_logger is None:
+            return
+        self.prometheus_logger.set_scheduler_state(deployment_id, queue.queued, queue.in_flight)
+        if wait_time is not None:
+            self.prometheus_logger.observe_queue_wait(deployment_id, wait_time)
+
+
+    def _log_rejected(self, deployment_id: str, reason: str) -> None:
+        if self.prometheus_logger is not None:
+            self.prometheus_logger.log_scheduler_rejection(deployment_id, reason)
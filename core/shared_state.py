@@ -0,0 +1,488 @@
+from abc import (ABC,
+                 abstractmethod)
+from typing import (Deque, Dict, Iterable, List, Optional, Tuple)
+from collections import deque
+from urllib.parse import urlparse
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+
+class SharedStateError(Exception):
+    """
+    Raised when the shared state backend can not be reached or rejects a command.
+    """
+
+
+class SharedState(ABC):
+    """
+    Key value state shared by the workers of the gateway: atomic float
+    counters and byte values, both with an optional TTL (seconds). Keys
+    expire `ttl` seconds after their last write.
+    """
+    # True when the state is only visible to the current process
+    process_local = False
+
+    @abstractmethod
+    async def incr_many(self, increments: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        """Atomically add to every counter and return their new totals."""
+
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> Dict[str, Optional[bytes]]:
+        """Values of the keys, None for missing or expired keys."""
+
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Store a byte value."""
+
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Remove a key, missing keys are ignored."""
+
+
+    async def incr(self, key: str, amount: float = 1.0, ttl: Optional[float] = None) -> float:
+        return (await self.incr_many({key: amount}, ttl=ttl))[key]
+
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[key]
+
+
+    async def aclose(self) -> None:
+        pass
+
+
+class InProcessState(SharedState):
+    """Default backend, for a single worker."""
+    process_local = True
+
+    def __init__(self):
+        # key: key --> value: (value, expires_at or None)
+        self._entries: Dict[str, Tuple[object, Optional[float]]] = {}
+
+
+    def _get(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry[0]
+
+
+    async def incr_many(self, increments: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        totals = {}
+        for key, amount in increments.items():
+            total = totals[key] = float(self._get(key, now) or 0.0) + amount
+            self._entries[key] = (total, expires_at)
+        return totals
+
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Optional[bytes]]:
+        now = time.time()
+        values = {}
+        for key in keys:
+            value = self._get(key, now)
+            values[key] = value if value is None or isinstance(value, bytes) else str(value).encode()
+        return values
+
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (value, time.time() + ttl if ttl else None)
+
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+# slot of the shared memory table: state, key digest, expires_at (0 = never), counter, value length
+SLOT_HEADER = struct.Struct("<B7x16sddI4x")
+SLOT_EMPTY, SLOT_USED, SLOT_DELETED = 0, 1, 2
+
+
+class SharedMemoryState(SharedState):
+    """
+    Backend for the workers of one host: an open addressing hash table in a
+    memory mapped file (on /dev/shm by default), locked with flock for every
+    operation. Keys are stored as 16 byte digests and byte values are limited
+    to `value_size` bytes. When the probed slots of a key are all taken, the
+    one expiring first is evicted.
+    """
+    def __init__(self, path: str = "/dev/shm/ezllm-gateway-state", slots: int = 16384, value_size: int = 256,
+                 max_probes: int = 32):
+        self.path = path
+        self.slots = slots
+        self.value_size = value_size
+        self.slot_size = SLOT_HEADER.size + value_size
+        self.max_probes = min(max_probes, slots)
+        size = self.slots * self.slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+
+    def _find(self, digest: bytes, now: float, insert: bool) -> Optional[int]:
+        """Return the offset of the key's slot, or of a free slot for it when `insert`."""
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        free_offset = evict_offset = None
+        evict_expires_at = float("inf")
+        for probe in range(self.max_probes):
+            offset = ((start + probe) % self.slots) * self.slot_size
+            state, slot_digest, expires_at, _, _ = SLOT_HEADER.unpack_from(self._map, offset)
+            if state == SLOT_EMPTY:
+                if not insert:
+                    return None
+                return free_offset if free_offset is not None else offset
+            expired = state == SLOT_USED and 0 < expires_at <= now
+            if state == SLOT_USED and slot_digest == digest:
+                if not expired:
+                    return offset
+                # an expired entry of the key is reused as a new one
+                self._map[offset] = SLOT_DELETED
+                return offset if insert else None
+            if state == SLOT_DELETED or expired:
+                if free_offset is None:
+                    free_offset = offset
+            elif (expires_at or float("inf")) < evict_expires_at or evict_offset is None:
+                evict_offset, evict_expires_at = offset, expires_at or float("inf")
+        if not insert:
+            return None
+        return free_offset if free_offset is not None else evict_offset
+
+
+    def _digest(self, key: str) -> bytes:
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+
+    async def incr_many(self, increments: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        totals = {}
+        with self._locked():
+            now = time.time()
+            expires_at = now + ttl if ttl else 0.0
+            for key, amount in increments.items():
+                digest = self._digest(key)
+                offset = self._find(digest, now, insert=True)
+                state, slot_digest, _, counter, _ = SLOT_HEADER.unpack_from(self._map, offset)
+                if state != SLOT_USED or slot_digest != digest:
+                    counter = 0.0
+                total = totals[key] = counter + amount
+                SLOT_HEADER.pack_into(self._map, offset, SLOT_USED, digest, expires_at, total, 0)
+        return totals
+
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Optional[bytes]]:
+        values = {}
+        with self._locked():
+            now = time.time()
+            for key in keys:
+                offset = self._find(self._digest(key), now, insert=False)
+                if offset is None:
+                    values[key] = None
+                    continue
+                _, _, _, counter, length = SLOT_HEADER.unpack_from(self._map, offset)
+                start = offset + SLOT_HEADER.size
+                # entries written by incr have no value but their counter
+                values[key] = self._map[start:start + length] if length else str(counter).encode()
+        return values
+
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if len(value) > self.value_size:
+            raise ValueError(f"Value of {key} is larger than {self.value_size} bytes")
+        digest = self._digest(key)
+        with self._locked():
+            now = time.time()
+            offset = self._find(digest, now, insert=True)
+            SLOT_HEADER.pack_into(self._map, offset, SLOT_USED, digest, now + ttl if ttl else 0.0, 0.0, len(value))
+            start = offset + SLOT_HEADER.size
+            self._map[start:start + len(value)] = value
+
+
+    async def delete(self, key: str) -> None:
+        with self._locked():
+            offset = self._find(self._digest(key), time.time(), insert=False)
+            if offset is not None:
+                self._map[offset] = SLOT_DELETED
+
+
+    async def aclose(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+class _FileLock:
+    __slots__ = ("fd",)
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class RedisState(SharedState):
+    """
+    Backend shared across hosts, speaking the Redis protocol (RESP2) to
+    Redis or any compatible server. All commands go over one pipelined
+    connection that is reopened after an error.
+    """
+    def __init__(self, url: str = "redis://localhost:6379/0", key_prefix: str = "ezllm:",
+                 connect_timeout: float = 5.0):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname or "localhost"
+        self.port = parsed_url.port or 6379
+        self.username = parsed_url.username
+        self.password = parsed_url.password
+        self.db = int(parsed_url.path.lstrip("/") or 0)
+        self.key_prefix = key_prefix
+        self.connect_timeout = connect_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connect_lock = asyncio.Lock()
+        # the replies arrive in the order of the commands
+        self._replies: Deque[asyncio.Future] = deque()
+        self._reader_task: Optional[asyncio.Task] = None
+
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                    timeout=self.connect_timeout)
+            self._reader, self._writer = reader, writer
+            self._reader_task = asyncio.create_task(self._read_replies(reader))
+            setup = []
+            if self.password is not None:
+                setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+            if self.db:
+                setup.append(("SELECT", self.db))
+            if setup:
+                try:
+                    await self._send(setup)
+                except SharedStateError as e:
+                    # not left open unauthenticated or on the wrong db
+                    self._disconnect(e)
+                    raise
+
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                reply = await self._read_reply(reader)
+                future = self._replies.popleft()
+                if not future.done():
+                    future.set_result(reply)
+        except Exception as e:
+            # a connection replaced meanwhile is left alone
+            if self._reader is reader:
+                self._disconnect(SharedStateError(f"Connection to {self.host}:{self.port} lost: {e!r}"))
+
+
+    async def _read_reply(self, reader: asyncio.StreamReader):
+        line = await reader.readuntil(b"\r\n")
+        kind, data = line[:1], line[1:-2]
+        if kind == b"+":
+            return data
+        if kind == b"-":
+            return SharedStateError(data.decode(errors="replace"))
+        if kind == b":":
+            return int(data)
+        if kind == b"$":
+            length = int(data)
+            if length < 0:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(data)
+            if length < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise SharedStateError(f"Unexpected reply {line!r}")
+
+
+    def _disconnect(self, error: Exception) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        replies, self._replies = self._replies, deque()
+        for future in replies:
+            if not future.done():
+                future.set_exception(error)
+
+
+    def _encode(self, command: Iterable) -> bytes:
+        parts = []
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"*%d\r\n" % len(parts) + b"".join(parts)
+
+
+    async def _send(self, commands: List[tuple]) -> list:
+        """Send the commands in one write and return their replies, raising the first error reply."""
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in commands]
+        self._replies.extend(futures)
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        replies = await asyncio.gather(*futures)
+        for reply in replies:
+            if isinstance(reply, SharedStateError):
+                raise reply
+        return replies
+
+
+    async def _execute(self, commands: List[tuple]) -> list:
+        try:
+            if self._writer is None:
+                await self._connect()
+            return await self._send(commands)
+        except SharedStateError:
+            raise
+        except (OSError, asyncio.TimeoutError) as e:
+            self._disconnect(SharedStateError(str(e)))
+            raise SharedStateError(f"Redis {self.host}:{self.port} unavailable: {e!r}") from e
+
+
+    async def incr_many(self, increments: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        commands = [("MULTI",)]
+        for key, amount in increments.items():
+            commands.append(("INCRBYFLOAT", self.key_prefix + key, repr(float(amount))))
+            if ttl:
+                commands.append(("PEXPIRE", self.key_prefix + key, int(ttl * 1000)))
+        commands.append(("EXEC",))
+        results = (await self._execute(commands))[-1]
+        if results is None:
+            raise SharedStateError("Transaction aborted")
+        for result in results:
+            # error replies of the queued commands, e.g. a key holding a non numeric value
+            if isinstance(result, SharedStateError):
+                raise result
+        totals = results[::2] if ttl else results
+        return {key: float(total) for key, total in zip(increments, totals)}
+
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Optional[bytes]]:
+        if not keys:
+            return {}
+        values = (await self._execute([("MGET", *(self.key_prefix + key for key in keys))]))[0]
+        return dict(zip(keys, values))
+
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        command = ("SET", self.key_prefix + key, value) + (("PX", int(ttl * 1000)) if ttl else ())
+        await self._execute([command])
+
+
+    async def delete(self, key: str) -> None:
+        await self._execute([("DEL", self.key_prefix + key)])
+
+
+    async def aclose(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._disconnect(SharedStateError("Connection closed"))
+
+
+def create_shared_state(backend: str, url: str = "redis://localhost:6379/0",
+                        shm_path: str = "/dev/shm/ezllm-gateway-state") -> SharedState:
+    """
+    Args:
+        backend (str): "local" (single worker), "shm" (workers of one host) or "redis"
+    """
+    if backend == "local":
+        return InProcessState()
+    if backend == "shm":
+        return SharedMemoryState(shm_path)
+    if backend == "redis":
+        return RedisState(url)
+    raise ValueError(f"Unsupported shared state backend {backend}, supported: local, shm, redis")
+
+
+class SharedCounters:
+    """
+    Local fast path of counters shared per time window. Increments are
+    applied locally at once and pushed to the backend in one batch per
+    sync(), which returns what the other workers added since the previous
+    sync (or since the start of the window, for the first sync of a
+    window). Checks against the counters never wait for the backend, at the
+    cost of seeing the other workers' increments up to one sync late.
+    """
+    def __init__(self, shared_state: SharedState, window: float = 60.0):
+        self.shared_state = shared_state
+        self.window = window
+        # key: counter key --> value: increments not pushed yet
+        self._pending: Dict[str, float] = {}
+        # key: counter key of the current window --> value: backend total after the last sync
+        self._synced_totals: Dict[str, float] = {}
+
+
+    def track(self, key: str) -> None:
+        """Receive the increments of the other workers for a counter not incremented locally yet."""
+        self._pending.setdefault(key, 0.0)
+
+
+    def add(self, key: str, amount: float) -> None:
+        self._pending[key] = self._pending.get(key, 0.0) + amount
+
+
+    async def sync(self) -> Dict[str, float]:
+        """
+        Push the local increments and return, per counter, the amount added
+        by the other workers meanwhile.
+        """
+        increments = dict(self._pending)
+        if not increments:
+            return {}
+        window_index = int(time.time() // self.window)
+        window_keys = {key: f"{key}:{window_index}" for key in increments}
+        totals = await self.shared_state.incr_many(
+            {window_keys[key]: amount for key, amount in increments.items()}, ttl=2 * self.window
+        )
+
+        remote, synced_totals = {}, {}
+        for key, amount in increments.items():
+            # increments made while the batch was in flight are pushed with the next one
+            self._pending[key] -= amount
+            window_key = window_keys[key]
+            total = synced_totals[window_key] = totals[window_key]
+            remote_amount = total - self._synced_totals.get(window_key, 0.0) - amount
+            if remote_amount > 0:
+                remote[key] = remote_amount
+        self._synced_totals = synced_totals
+        return remote
+
+
+async def run_sync(participants: list, interval: float) -> None:
+    """Sync the shared state of every participant (`sync_shared_state()`) every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        for participant in participants:
+            try:
+                await participant.sync_shared_state()
+            except Exception as e:
+                # the participant keeps working on its local state until the backend is back
+                print(f"Shared state sync of {type(participant).__name__} failed: {e}")
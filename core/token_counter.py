@@ -0,0 +1,183 @@
+from typing import (Dict, List, Optional, Tuple)
+import asyncio
+import json
+import os
+from core.route_table import ModelRoute
+
+
+# tokens the chat template adds per message and to prime the reply (OpenAI / Llama 3 style templates)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# texts longer than this (characters) are encoded in a worker thread instead of the event loop
+MAX_INLINE_ENCODE_LENGTH = 16384
+
+
+class ContextWindowExceededError(Exception):
+    def __init__(self, message: str, prompt_tokens: int, max_context: int):
+        super().__init__(message)
+        self.prompt_tokens = prompt_tokens
+        self.max_context = max_context
+
+
+def _get_chat_texts(req_body: dict) -> Tuple[List[str], int]:
+    """
+    Collect the texts of a chat request the model reads.
+
+    Returns:
+        tuple: (texts, number of messages)
+    """
+    texts = []
+    messages = req_body.get("messages") or []
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            # only text parts, images are counted by the backend
+            texts.extend(part.get("text") or "" for part in content if isinstance(part, dict))
+        if message.get("name"):
+            texts.append(message["name"])
+        if message.get("tool_calls"):
+            texts.append(json.dumps(message["tool_calls"]))
+    if req_body.get("tools"):
+        texts.append(json.dumps(req_body["tools"]))
+    return texts, len(messages)
+
+
+class TokenCounter:
+    """
+    Gateway side estimate of the prompt tokens of a request, so that
+    requests exceeding the context window of a model (`max_context` in
+    routing_configs.yaml) are rejected, or their max_tokens clamped, before
+    they are queued and prefilled by the backend.
+
+    Prompts are encoded with the tokenizer of the model (`tokenizer` in
+    routing_configs.yaml, a local tokenizer.json or a directory containing
+    one), loaded on first use and cached. Models without a tokenizer are
+    estimated at 4 bytes of UTF-8 per token.
+    """
+    def __init__(self, tokenizer_dir: str = "tokenizers"):
+        # relative tokenizer paths of the routing configs are resolved against this directory
+        self.tokenizer_dir = tokenizer_dir
+        # key: tokenizer path --> value: future of the loaded tokenizer, None if it failed to load
+        self._tokenizers: Dict[str, asyncio.Future] = {}
+
+
+    def _get_tokenizer_path(self, tokenizer: str) -> str:
+        path = os.path.join(self.tokenizer_dir, tokenizer)
+        if os.path.isdir(path):
+            path = os.path.join(path, "tokenizer.json")
+        return path
+
+
+    def _load_tokenizer(self, path: str):
+        try:
+            from tokenizers import Tokenizer
+            return Tokenizer.from_file(path)
+        except Exception as e:
+            print(f"Error loading tokenizer {path}, prompt tokens are estimated instead: {e}")
+            return None
+
+
+    async def _get_tokenizer(self, model_route: ModelRoute):
+        if model_route.tokenizer is None:
+            return None
+        path = self._get_tokenizer_path(model_route.tokenizer)
+        future = self._tokenizers.get(path)
+        if future is None:
+            # concurrent first requests share one load
+            future = self._tokenizers[path] = asyncio.ensure_future(asyncio.to_thread(self._load_tokenizer, path))
+        return await asyncio.shield(future)
+
+
+    async def _count_text(self, tokenizer, text: str) -> int:
+        if not text:
+            return 0
+        if tokenizer is None:
+            return (len(text.encode("utf-8", errors="ignore")) + 3) // 4
+        if len(text) > MAX_INLINE_ENCODE_LENGTH:
+            encoding = await asyncio.to_thread(tokenizer.encode, text, add_special_tokens=False)
+        else:
+            encoding = tokenizer.encode(text, add_special_tokens=False)
+        return len(encoding.ids)
+
+
+    async def count_prompt_tokens(self, call_type: str, model_route: ModelRoute, req_body: dict) -> List[int]:
+        """
+        Estimate the prompt tokens of a chat_completion / completion request.
+
+        Returns:
+            list: prompt tokens per prompt of the request (completion requests
+                  may carry several prompts), empty if the prompt is not known
+        """
+        tokenizer = await self._get_tokenizer(model_route)
+        if call_type == "chat_completion":
+            texts, message_count = _get_chat_texts(req_body)
+            overhead = message_count * MESSAGE_OVERHEAD_TOKENS + REPLY_OVERHEAD_TOKENS
+            return [await self._count_text(tokenizer, "\n".join(texts)) + overhead]
+
+        prompt = req_body.get("prompt")
+        if isinstance(prompt, str):
+            return [await self._count_text(tokenizer, prompt)]
+        if not isinstance(prompt, list) or not prompt:
+            return []
+        if all(isinstance(token, int) for token in prompt):
+            # a single prompt given as token ids
+            return [len(prompt)]
+        prompt_tokens = []
+        for item in prompt:
+            if isinstance(item, str):
+                prompt_tokens.append(await self._count_text(tokenizer, item))
+            elif isinstance(item, list):
+                prompt_tokens.append(len(item))
+        return prompt_tokens
+
+
+    async def fit_context_window(self, call_type: str, model_route: ModelRoute,
+                                 req_body: dict) -> Tuple[dict, Optional[int]]:
+        """
+        Count the prompt tokens of a request and check them against the
+        context window of the model. A max_tokens (or max_completion_tokens)
+        beyond the room left by the prompt is clamped, unless the model sets
+        `clamp_max_tokens: false`.
+
+        Returns:
+            tuple: (request body to send, estimated prompt tokens or None if unknown)
+
+        Raises:
+            ContextWindowExceededError: the prompt (or, without clamping, prompt and max_tokens) exceeds max_context
+        """
+        prompt_tokens = await self.count_prompt_tokens(call_type, model_route, req_body)
+        if not prompt_tokens:
+            return req_body, None
+        total_prompt_tokens = sum(prompt_tokens)
+        max_context = model_route.max_context
+        if max_context is None:
+            return req_body, total_prompt_tokens
+
+        longest_prompt = max(prompt_tokens)
+        if longest_prompt >= max_context:
+            raise ContextWindowExceededError(
+                f"This model's maximum context length is {max_context} tokens, "
+                f"however the prompt has about {longest_prompt} tokens. Please reduce the length of the prompt.",
+                prompt_tokens=longest_prompt,
+                max_context=max_context,
+            )
+
+        max_tokens_field = "max_completion_tokens" if "max_completion_tokens" in req_body else "max_tokens"
+        max_tokens = req_body.get(max_tokens_field)
+        available_tokens = max_context - longest_prompt
+        if isinstance(max_tokens, int) and max_tokens > available_tokens:
+            if not model_route.clamp_max_tokens:
+                raise ContextWindowExceededError(
+                    f"This model's maximum context length is {max_context} tokens, however about "
+                    f"{longest_prompt + max_tokens} tokens were requested ({longest_prompt} in the prompt, "
+                    f"{max_tokens} for the completion). Please reduce the length of the prompt or {max_tokens_field}.",
+                    prompt_tokens=longest_prompt,
+                    max_context=max_context,
+                )
+            req_body = {**req_body, max_tokens_field: available_tokens}
+        return req_body, total_prompt_tokens
@@ -1,12 +1,17 @@
 # used for /metrics endpoint on EZLLM gateway
 #### What this does ####
 #    On success, log events to Prometheus
-from typing import Optional, Union, Any
+from typing import Optional, Union, Any, Dict, List, Tuple
+import asyncio
+import glob
+import os
 
 from litellm import CustomLogger
 from litellm.types.utils import ModelResponse, EmbeddingResponse, ImageResponse, StandardLoggingPayload
-from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, make_asgi_app, multiprocess
 from datetime import datetime, timedelta
+from core.request_timing import RequestTiming
+from utils.model_config import get_model_name
 
 
 LATENCY_BUCKETS = (
@@ -48,15 +53,112 @@ LATENCY_BUCKETS = (
     float("inf"),
 )
 
-class PrometheusLogger(CustomLogger):
-    def __init__(self, routing_configs: dict, user_configs: dict):
-        self.routing_configs = routing_configs
-        self.user_configs = user_configs
-        # 創建一個 dict 來保留 user_configs 的映射 (key: user_id --> value: user_profile)
-        self.user_profiles = {}
+# phases of a request take from a fraction of a millisecond (auth, routing) to minutes (stream)
+PHASE_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    float("inf"),
+)
 
-        for user_token, user_profile in user_configs.items():
-            self.user_profiles[user_profile['id']] = user_profile
+def get_multiprocess_dir() -> Optional[str]:
+    """Directory the workers share their metrics through, None when running a single process."""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+
+def make_metrics_app():
+    """
+    ASGI app of /metrics. With several workers (PROMETHEUS_MULTIPROC_DIR set
+    before prometheus_client is imported) every worker writes its metrics to
+    that directory, and a scrape of any worker returns the aggregate of all
+    of them: counters and histogram buckets are summed, gauges combined per
+    their multiprocess_mode.
+    """
+    multiprocess_dir = get_multiprocess_dir()
+    if multiprocess_dir is None:
+        return make_asgi_app()
+    os.makedirs(multiprocess_dir, exist_ok=True)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return make_asgi_app(registry=registry)
+
+
+def remove_dead_workers() -> None:
+    """
+    Drop the live gauges of the workers that exited without cleaning up
+    (crashed or killed), e.g. when their replacement starts. Counters and
+    histograms of dead workers are kept so that the totals never decrease.
+    """
+    multiprocess_dir = get_multiprocess_dir()
+    if multiprocess_dir is None:
+        return
+    pids = set()
+    for path in glob.glob(os.path.join(multiprocess_dir, "gauge_live*_*.db")):
+        pid = os.path.basename(path)[:-len(".db")].rsplit("_", 1)[-1]
+        if pid.isdigit():
+            pids.add(int(pid))
+    for pid in pids:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, multiprocess_dir)
+        except PermissionError:
+            # alive, owned by another user
+            continue
+
+
+def mark_worker_exit() -> None:
+    """Drop the live gauges of this worker when it shuts down."""
+    multiprocess_dir = get_multiprocess_dir()
+    if multiprocess_dir is not None:
+        multiprocess.mark_process_dead(os.getpid(), multiprocess_dir)
+
+
+class RequestMetrics:
+    """
+    Children of the per request metrics bound to the labels of one
+    (model, user), so that recording a request does not resolve labels.
+    """
+    __slots__ = ("tokens", "input_tokens", "output_tokens", "requests_success",
+                 "time_to_first_token", "llm_e2e_time", "overhead_latency", "total_e2e_time")
+
+    def __init__(self, logger: "PrometheusLogger", labels: dict):
+        self.tokens = logger.counter_tokens.labels(**labels)
+        self.input_tokens = logger.counter_input_tokens.labels(**labels)
+        self.output_tokens = logger.counter_output_tokens.labels(**labels)
+        self.requests_success = logger.counter_proxy_requests_success.labels(**labels)
+        self.time_to_first_token = logger.histogram_time_to_first_token.labels(**labels)
+        self.llm_e2e_time = logger.histogram_llm_e2e_time_request.labels(**labels)
+        self.overhead_latency = logger.histogram_overhead_latency.labels(**labels)
+        self.total_e2e_time = logger.histogram_total_e2e_time_request.labels(**labels)
+
+
+class PrometheusLogger(CustomLogger):
+    def __init__(self, routing_configs: dict, user_configs: dict, flush_interval: float = 0.5,
+                 max_pending: int = 4096):
+        # per request observations are queued and applied every flush_interval seconds
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.update_configs(routing_configs, user_configs)
 
         # Counter for total_output_tokens
         self.counter_tokens = Counter(
@@ -120,134 +222,364 @@ class PrometheusLogger(CustomLogger):
             buckets=LATENCY_BUCKETS,
         )
 
-    def _increment_token_metrics(
-        self,
-        standard_logging_payload: StandardLoggingPayload,
-        user_id: Optional[str],
-        project: Optional[str],
-        org: Optional[str],
-        model: Optional[str],
-    ):        # token metrics
-        self.counter_tokens.labels(
-            model=model,
-            project=project,
-            org=org,
-            user=user_id
-        ).inc(standard_logging_payload["total_tokens"])
-
-        self.counter_input_tokens.labels(
-            model=model,
-            project=project,
-            org=org,
-            user=user_id
-        ).inc(standard_logging_payload["prompt_tokens"])
-
-        self.counter_output_tokens.labels(
-            model=model,
-            project=project,
-            org=org,
-            user=user_id
-        ).inc(standard_logging_payload["completion_tokens"])
-
-
-    def _set_latency_metrics(
-        self,
-        kwargs: dict,
-        model: Optional[str],
-        user_id: Optional[str],
-        project: Optional[str],
-        org: Optional[str],
-    ):
-        # latency metrics
-        end_time: datetime = kwargs.get("end_time") or datetime.now()
-        start_time: Optional[datetime] = kwargs.get("start_time")
-        api_call_start_time = kwargs.get("api_call_start_time", None)
-        completion_start_time = kwargs.get("completion_start_time", None)
+        # response cache metrics
+        self.counter_cache_hits = Counter(
+            "ezllm:response_cache_hits_total",
+            "Total number of requests served from the response cache",
+            labelnames=["model"],
+        )
+
+        self.counter_cache_misses = Counter(
+            "ezllm:response_cache_misses_total",
+            "Total number of cacheable requests not found in the response cache",
+            labelnames=["model"],
+        )
 
-        if (
-            completion_start_time is not None
-            and isinstance(completion_start_time, datetime)
-            and kwargs.get("stream", False) is True  # only emit for streaming requests
-        ):
-            time_to_first_token_seconds = (
-                completion_start_time - api_call_start_time
-            ).total_seconds()
+        self.counter_cache_evictions = Counter(
+            "ezllm:response_cache_evictions_total",
+            "Total number of entries evicted from the response cache",
+            labelnames=["model", "reason"],
+        )
 
-            self.histogram_time_to_first_token.labels(
-                model=model,
-                project=project,
-                org=org,
-                user=user_id,
-            ).observe(time_to_first_token_seconds)
-        else:
-            print("Time to first token metric not emitted, stream option in model_parameters is not True")
-
-        if api_call_start_time is not None and isinstance(api_call_start_time, datetime):
-            api_call_total_time: timedelta = end_time - api_call_start_time
-            api_call_total_time_seconds = api_call_total_time.total_seconds()
-
-            self.histogram_llm_e2e_time_request.labels(               
-                model=model,
-                project=project,
-                org=org,
-                user=user_id,).observe(api_call_total_time_seconds)
-            
-            if start_time is not None and isinstance(start_time, datetime):
-                before_api_overhead: timedelta = api_call_start_time - start_time
-                before_api_overhead_seconds = before_api_overhead.total_seconds()
-
-                self.histogram_overhead_latency.labels(
-                    model=model,
-                    project=project,
-                    org=org,
-                    user=user_id,
-                ).observe(before_api_overhead_seconds)
-                # print(f"Overhead latency before API call: {before_api_overhead_seconds} seconds")
-
-        # Overhead after API call (assuming end_time is request end time)
-        if end_time is not None and api_call_start_time is not None:
-            api_call_end_time = kwargs.get("api_call_end_time", end_time)  # Ensure we have an end time for the API call
-            if isinstance(api_call_end_time, datetime):
-                after_api_overhead: timedelta = end_time - api_call_end_time
-                after_api_overhead_seconds = after_api_overhead.total_seconds()
+        self.counter_coalesced_requests = Counter(
+            "ezllm:coalesced_requests_total",
+            "Total number of upstream calls saved by sharing identical in-flight requests",
+            labelnames=["model"],
+        )
 
-                self.histogram_overhead_latency.labels(
-                    model=model,
-                    project=project,
-                    org=org,
-                    user=user_id,
-                ).observe(after_api_overhead_seconds)
+        # upstream deployment health metrics
+        self.gauge_breaker_state = Gauge(
+            "ezllm:deployment_breaker_state",
+            "Circuit breaker state of an upstream deployment (0 = closed, 1 = half-open, 2 = open)",
+            labelnames=["api_base"],
+            multiprocess_mode="livemax",
+        )
 
-                # print(f"Overhead latency after API call: {after_api_overhead_seconds} seconds")
+        self.gauge_deployment_latency = Gauge(
+            "ezllm:deployment_latency_ewma_seconds",
+            "Exponentially weighted moving average of the upstream latency of a deployment",
+            labelnames=["api_base"],
+            multiprocess_mode="livemostrecent",
+        )
 
-        # total request latency
-        if start_time is not None and isinstance(start_time, datetime):
-            total_time: timedelta = end_time - start_time
-            total_time_seconds = total_time.total_seconds()
+        self.counter_deployment_failures = Counter(
+            "ezllm:deployment_failures_total",
+            "Total number of failed upstream calls to a deployment",
+            labelnames=["api_base", "reason"],
+        )
 
-            self.histogram_total_e2e_time_request.labels(    
-                model=model,
-                project=project,
-                org=org,
-                user=user_id,           
-            ).observe(total_time_seconds)
+        self.counter_deployment_ejections = Counter(
+            "ezllm:deployment_ejections_total",
+            "Total number of times a deployment was ejected by its circuit breaker",
+            labelnames=["api_base"],
+        )
+
+        self.gauge_deployment_ejection_time = Gauge(
+            "ezllm:deployment_ejection_seconds",
+            "Duration of the last ejection of a deployment by its circuit breaker",
+            labelnames=["api_base"],
+            multiprocess_mode="livemostrecent",
+        )
+
+        self.counter_rate_limited_requests = Counter(
+            "ezllm:rate_limited_requests_total",
+            "Total number of requests rejected by a rpm / tpm limit",
+            labelnames=["level", "limit_type"],
+        )
+
+        # admission scheduler metrics
+        self.gauge_scheduler_queue_depth = Gauge(
+            "ezllm:scheduler_queue_depth",
+            "Number of requests waiting for a free slot on a deployment",
+            labelnames=["deployment"],
+            multiprocess_mode="livesum",
+        )
+
+        self.gauge_scheduler_in_flight = Gauge(
+            "ezllm:scheduler_in_flight_requests",
+            "Number of requests in flight on a deployment with a concurrency limit",
+            labelnames=["deployment"],
+            multiprocess_mode="livesum",
+        )
+
+        self.histogram_scheduler_queue_wait = Histogram(
+            "ezllm:scheduler_queue_wait_seconds",
+            "Time (seconds) a request waited for a free slot on a deployment",
+            labelnames=["deployment"],
+            buckets=LATENCY_BUCKETS,
+        )
+
+        self.counter_scheduler_rejections = Counter(
+            "ezllm:scheduler_rejected_requests_total",
+            "Total number of requests rejected by the admission scheduler",
+            labelnames=["deployment", "reason"],
+        )
+
+        # upstream connection pool metrics
+        self.gauge_pool_in_flight = Gauge(
+            "ezllm:upstream_pool_requests_in_flight",
+            "Number of requests in flight on the connection pool of an upstream api_base",
+            labelnames=["api_base"],
+            multiprocess_mode="livesum",
+        )
+
+        self.gauge_pool_connections = Gauge(
+            "ezllm:upstream_pool_connections",
+            "Number of open connections of the connection pool of an upstream api_base",
+            labelnames=["api_base", "state"],
+            multiprocess_mode="livesum",
+        )
+
+        self.gauge_pool_max_connections = Gauge(
+            "ezllm:upstream_pool_max_connections",
+            "Maximum number of connections of the connection pool of an upstream api_base",
+            labelnames=["api_base"],
+            multiprocess_mode="livesum",
+        )
 
+        # request hedging metrics
+        self.counter_hedged_requests = Counter(
+            "ezllm:hedged_requests_total",
+            "Total number of requests hedged to a second deployment, by the call that responded first",
+            labelnames=["model", "winner"],
+        )
+
+        self.counter_hedges_skipped = Counter(
+            "ezllm:hedges_skipped_total",
+            "Total number of slow requests that were not hedged",
+            labelnames=["model", "reason"],
+        )
+
+        # retry and fallback metrics
+        self.counter_failed_attempts = Counter(
+            "ezllm:upstream_failed_attempts_total",
+            "Total number of failed upstream attempts of requests with retries or fallbacks, by what happened next "
+            "(retry, fallback, budget_exhausted or exhausted)",
+            labelnames=["model", "status_code", "action"],
+        )
+
+        # embedding micro-batching metrics
+        self.histogram_embedding_batch_size = Histogram(
+            "ezllm:embedding_batch_requests",
+            "Number of embedding requests merged into one upstream call",
+            labelnames=["model"],
+            buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+        )
+
+        # client disconnect metrics
+        self.counter_abandoned_streams = Counter(
+            "ezllm:abandoned_streams_total",
+            "Total number of streams abandoned by the client before they ended",
+            labelnames=["model"],
+        )
+
+        self.counter_abandoned_stream_chunks = Counter(
+            "ezllm:abandoned_stream_chunks_total",
+            "Completion chunks sent on streams before the client abandoned them (usage chunk and [DONE] excluded)",
+            labelnames=["model"],
+        )
+
+        # request phase metrics
+        self.histogram_request_phase = Histogram(
+            "ezllm:request_phase_seconds",
+            "Time spent by requests in each phase (parse, auth, config, preflight, rate_limit, routing, queue, "
+            "upstream, first_chunk, stream, send)",
+            labelnames=["model", "phase"],
+            buckets=PHASE_BUCKETS,
+        )
+        # key: (model, phase) --> value: labeled histogram
+        self._phase_metrics = {}
+
+    def update_configs(self, routing_configs: dict, user_configs: dict):
+        self.routing_configs = routing_configs
+        self.user_configs = user_configs
+        # 創建一個 dict 來保留 user_configs 的映射 (key: user_id --> value: user_profile)
+        user_profiles = {}
+
+        for user_token, user_profile in user_configs.items():
+            user_profiles[user_profile['id']] = user_profile
+        self.user_profiles = user_profiles
+        # key: (model, user_id) --> value: RequestMetrics, rebuilt as projects / orgs may have changed
+        self._request_metrics: Dict[Tuple[str, str], RequestMetrics] = {}
+
+    def log_cache_hit(self, model: str):
+        self.counter_cache_hits.labels(model=model).inc()
+
+    def log_cache_miss(self, model: str):
+        self.counter_cache_misses.labels(model=model).inc()
+
+    def log_cache_eviction(self, model: str, reason: str):
+        self.counter_cache_evictions.labels(model=model, reason=reason).inc()
+
+    def log_coalesced_request(self, model: str):
+        self.counter_coalesced_requests.labels(model=model).inc()
+
+    def set_breaker_state(self, api_base: str, state: int):
+        self.gauge_breaker_state.labels(api_base=api_base).set(state)
+
+    def set_deployment_latency(self, api_base: str, latency: float):
+        self.gauge_deployment_latency.labels(api_base=api_base).set(latency)
+
+    def log_deployment_failure(self, api_base: str, reason: str):
+        self.counter_deployment_failures.labels(api_base=api_base, reason=reason).inc()
+
+    def log_deployment_ejection(self, api_base: str, ejection_time: float):
+        self.counter_deployment_ejections.labels(api_base=api_base).inc()
+        self.gauge_deployment_ejection_time.labels(api_base=api_base).set(ejection_time)
+
+    def log_rate_limited_request(self, level: str, limit_type: str):
+        self.counter_rate_limited_requests.labels(level=level, limit_type=limit_type).inc()
+
+    def set_scheduler_state(self, deployment: str, queue_depth: int, in_flight: int):
+        self.gauge_scheduler_queue_depth.labels(deployment=deployment).set(queue_depth)
+        self.gauge_scheduler_in_flight.labels(deployment=deployment).set(in_flight)
+
+    def observe_queue_wait(self, deployment: str, wait_time: float):
+        self.histogram_scheduler_queue_wait.labels(deployment=deployment).observe(wait_time)
 
-    def log_success_event(self, kwargs, response_obj, start_time, end_time):
-        print(f"Success API Call")
+    def log_scheduler_rejection(self, deployment: str, reason: str):
+        self.counter_scheduler_rejections.labels(deployment=deployment, reason=reason).inc()
 
+    def set_pool_state(self, api_base: str, in_flight: int, active: int, idle: int):
+        self.gauge_pool_in_flight.labels(api_base=api_base).set(in_flight)
+        self.gauge_pool_connections.labels(api_base=api_base, state="active").set(active)
+        self.gauge_pool_connections.labels(api_base=api_base, state="idle").set(idle)
 
-    def log_pre_api_call(self, model, messages, kwargs): 
-        print(f"Pre-API Call")
-    
-    def log_post_api_call(self, kwargs, response_obj, start_time, end_time): 
-        print(f"Post-API Call")
+    def set_pool_max_connections(self, api_base: str, max_connections: int):
+        self.gauge_pool_max_connections.labels(api_base=api_base).set(max_connections)
+
+    def log_hedged_request(self, model: str, winner: str):
+        self.counter_hedged_requests.labels(model=model, winner=winner).inc()
+
+    def log_hedge_skipped(self, model: str, reason: str):
+        self.counter_hedges_skipped.labels(model=model, reason=reason).inc()
+
+    def log_failed_attempt(self, model: str, status_code: Optional[int], action: str):
+        self.counter_failed_attempts.labels(model=model, status_code=status_code, action=action).inc()
+
+    def observe_embedding_batch(self, model: str, batch_size: int):
+        self.histogram_embedding_batch_size.labels(model=model).observe(batch_size)
+
+    def log_abandoned_stream(self, model: str, chunks_sent: int):
+        self.counter_abandoned_streams.labels(model=model).inc()
+        self.counter_abandoned_stream_chunks.labels(model=model).inc(chunks_sent)
+
+    def observe_request_timing(self, request_timing: RequestTiming):
+        # requests rejected before a model was routed (auth, unknown model) are left out
+        if request_timing.model is None:
+            return
+        for phase, duration in request_timing.get_durations().items():
+            phase_metrics = self._phase_metrics.get((request_timing.model, phase))
+            if phase_metrics is None:
+                phase_metrics = self._phase_metrics[(request_timing.model, phase)] = \
+                    self.histogram_request_phase.labels(model=request_timing.model, phase=phase)
+            phase_metrics.observe(duration)
+
+
+    def _get_request_metrics(self, model: str, user_id: str) -> RequestMetrics:
+        request_metrics = self._request_metrics.get((model, user_id))
+        if request_metrics is None:
+            user_profile = self.user_profiles[user_id]
+            labels = {
+                "model": model,
+                "project": user_profile.get("project", "default"),
+                "org": user_profile.get("org", "default"),
+                "user": user_id,
+            }
+            request_metrics = self._request_metrics[(model, user_id)] = RequestMetrics(self, labels)
+        return request_metrics
+
+
+    def _get_latencies(self, kwargs: dict) -> tuple:
+        """
+        Returns:
+            tuple: (time to first token, llm api call time, overhead before the api call,
+                    overhead after the api call, total request time) in seconds, None
+                    for the latencies that can not be computed for the request
+        """
+        end_time: datetime = kwargs.get("end_time") or datetime.now()
+        start_time: Optional[datetime] = kwargs.get("start_time")
+        api_call_start_time = kwargs.get("api_call_start_time", None)
+        completion_start_time = kwargs.get("completion_start_time", None)
+        time_to_first_token = llm_e2e_time = overhead_before = overhead_after = total_time = None
+
+        # only emitted for streaming requests
+        if isinstance(completion_start_time, datetime) and kwargs.get("stream", False) is True:
+            time_to_first_token = (completion_start_time - api_call_start_time).total_seconds()
+
+        if isinstance(api_call_start_time, datetime):
+            llm_e2e_time = (end_time - api_call_start_time).total_seconds()
+            if isinstance(start_time, datetime):
+                overhead_before = (api_call_start_time - start_time).total_seconds()
+
+            # overhead after the api call (end_time is the request end time)
+            api_call_end_time = kwargs.get("api_call_end_time", end_time)
+            if isinstance(api_call_end_time, datetime):
+                overhead_after = (end_time - api_call_end_time).total_seconds()
+
+        if isinstance(start_time, datetime):
+            total_time = (end_time - start_time).total_seconds()
+
+        return time_to_first_token, llm_e2e_time, overhead_before, overhead_after, total_time
+
+
+    def _record(self, observation: tuple) -> None:
+        """
+        Queue the observation of a request. Queued observations are applied to
+        the metrics together, `flush_interval` seconds after the first one.
+        """
+        self._pending.append(observation)
+        if len(self._pending) >= self.max_pending:
+            self.flush()
+        elif self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+
+    def flush(self) -> None:
+        """Apply the queued observations, counter increments summed up per (model, user)."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+
+        # key: RequestMetrics --> value: [requests, total tokens, prompt tokens, completion tokens]
+        totals = {}
+        for request_metrics, total_tokens, prompt_tokens, completion_tokens, latencies in pending:
+            request_totals = totals.get(request_metrics)
+            if request_totals is None:
+                request_totals = totals[request_metrics] = [0, 0, 0, 0]
+            request_totals[0] += 1
+            request_totals[1] += total_tokens
+            request_totals[2] += prompt_tokens
+            request_totals[3] += completion_tokens
+
+            time_to_first_token, llm_e2e_time, overhead_before, overhead_after, total_time = latencies
+            if time_to_first_token is not None:
+                request_metrics.time_to_first_token.observe(time_to_first_token)
+            if llm_e2e_time is not None:
+                request_metrics.llm_e2e_time.observe(llm_e2e_time)
+            if overhead_before is not None:
+                request_metrics.overhead_latency.observe(overhead_before)
+            if overhead_after is not None:
+                request_metrics.overhead_latency.observe(overhead_after)
+            if total_time is not None:
+                request_metrics.total_e2e_time.observe(total_time)
+
+        for request_metrics, (requests, total_tokens, prompt_tokens, completion_tokens) in totals.items():
+            request_metrics.requests_success.inc(requests)
+            request_metrics.tokens.inc(total_tokens)
+            request_metrics.input_tokens.inc(prompt_tokens)
+            request_metrics.output_tokens.inc(completion_tokens)
 
 
     def log_failure_event(self, kwargs, response_obj, start_time, end_time):
-        print(f"Failure API Call")
         try:
-            model = kwargs.get("model", "")
+            model = get_model_name(kwargs) or ""
             user_api_key = kwargs.get("user_token","")
             user_configs = self.user_configs[user_api_key]
 
@@ -259,7 +591,6 @@ class PrometheusLogger(CustomLogger):
                 status_code=response_obj
             ).inc()
 
-            # print(f"On Failure")
         except Exception as e:
             print(f"Error in log_failure_event: {e}")
             raise e
@@ -268,7 +599,6 @@ class PrometheusLogger(CustomLogger):
     #### ASYNC #### - for acompletion/aembeddings
 
     async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
-        print(f"On Async Success")
         try:
             # unpack kwargs
             standard_logging_payload: Optional[StandardLoggingPayload] = kwargs.get(
@@ -282,39 +612,14 @@ class PrometheusLogger(CustomLogger):
                     f"standard_logging_object is required, got={standard_logging_payload}"
                 )
 
-            model = kwargs.get("model", "")
-            user_id = kwargs.get("user","")
-            user_profile = self.user_profiles[user_id]
-
-            # input, output, total token metrics
-            self._increment_token_metrics(
-                standard_logging_payload=standard_logging_payload,
-                user_id=user_id,
-                project=user_profile.get("project", "default"),
-                org=user_profile.get("org", "default"),
-                model=model,
-            )
-
-            self.counter_proxy_requests_success.labels(
-                model=model,
-                project=user_profile.get("project", "default"),
-                org=user_profile.get("org", "default"),
-                user=user_id,
-            ).inc()
-
-            # set latency metrics
-            self._set_latency_metrics(
-                kwargs=kwargs,
-                model=model,
-                user_id=user_id,
-                project=user_profile.get("project", "default"),
-                org=user_profile.get("org", "default"),
-            )
+            request_metrics = self._get_request_metrics(get_model_name(kwargs) or "", kwargs.get("user", ""))
+            self._record((
+                request_metrics,
+                standard_logging_payload["total_tokens"],
+                standard_logging_payload["prompt_tokens"],
+                standard_logging_payload["completion_tokens"],
+                self._get_latencies(kwargs),
+            ))
         except Exception as e:
-            print(f"Error in log_failure_event: {e}")
+            print(f"Error in async_log_success_event: {e}")
             raise e
-
-
-    async def async_log_failure_event(self, kwargs, response_obj, start_time, end_time):
-        print(f"On Async Failure")
-      
\ No newline at end of file
@@ -0,0 +1,131 @@
+# used to export request traces of EZLLM gateway
+#### What this does ####
+#    Once a request ended, export its phases as OTLP spans (OTLP/HTTP JSON)
+from typing import List, Optional, Tuple
+import asyncio
+import os
+import re
+
+import httpx
+from core.request_timing import RequestTiming
+
+
+# W3C traceparent: version-trace_id-parent_id-flags
+TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+# OTLP status codes
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(trace id, parent span id) of a W3C traceparent header, (None, None) if it is missing or invalid."""
+    match = TRACEPARENT_PATTERN.match((traceparent or "").strip().lower())
+    if match is None or match.group(1) == "0" * 32:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class OTLPSpanExporter:
+    """
+    Request traces for an OpenTelemetry collector: every routed request is
+    exported as a server span with one child span per phase, continuing the
+    trace of the client's traceparent header when it sent one. Spans are
+    queued and posted in batches every `flush_interval` seconds.
+    """
+    def __init__(self, endpoint: str, service_name: str = "ezllm-gateway", flush_interval: float = 1.0,
+                 max_pending: int = 10000, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        # spans beyond this are dropped while the collector can not keep up
+        self.max_pending = max_pending
+        self._pending: List[dict] = []
+        self._dropped = 0
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+
+    def _to_unix_nano(self, request_timing: RequestTiming, counter: float) -> str:
+        # OTLP/JSON encodes 64 bit integers as strings
+        return str(int((request_timing.start_time + counter - request_timing.start_counter) * 1e9))
+
+
+    def export(self, request_timing: RequestTiming) -> None:
+        """Queue the spans of a request, skipped for requests rejected before a model was routed."""
+        if request_timing.model is None:
+            return
+        if len(self._pending) + len(request_timing.phases) + 1 > self.max_pending:
+            self._dropped += 1
+            return
+
+        trace_id, parent_span_id = parse_traceparent(request_timing.traceparent)
+        trace_id = trace_id or os.urandom(16).hex()
+        span_id = os.urandom(8).hex()
+        end_counter = request_timing.end_counter or request_timing.start_counter
+        status_code = request_timing.status_code
+        self._pending.append({
+            "traceId": trace_id,
+            "spanId": span_id,
+            "parentSpanId": parent_span_id or "",
+            "name": f"{request_timing.method} {request_timing.path}",
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": self._to_unix_nano(request_timing, request_timing.start_counter),
+            "endTimeUnixNano": self._to_unix_nano(request_timing, end_counter),
+            "attributes": [
+                {"key": "http.request.method", "value": {"stringValue": request_timing.method}},
+                {"key": "url.path", "value": {"stringValue": request_timing.path}},
+                {"key": "http.response.status_code", "value": {"intValue": str(status_code or 0)}},
+                {"key": "gen_ai.request.model", "value": {"stringValue": request_timing.model}},
+            ],
+            "status": {"code": STATUS_CODE_ERROR if status_code is None or status_code >= 500 else STATUS_CODE_OK},
+        })
+        for phase, start, end in request_timing.phases:
+            self._pending.append({
+                "traceId": trace_id,
+                "spanId": os.urandom(8).hex(),
+                "parentSpanId": span_id,
+                "name": phase,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": self._to_unix_nano(request_timing, start),
+                "endTimeUnixNano": self._to_unix_nano(request_timing, end),
+            })
+
+
+    async def flush(self) -> None:
+        spans, self._pending = self._pending, []
+        if self._dropped:
+            print(f"Span exporter dropped {self._dropped} requests")
+            self._dropped = 0
+        if not spans:
+            return
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "ezllm-gateway"}, "spans": spans}],
+            }],
+        }
+        try:
+            response = await self._client.post(self.endpoint, json=payload)
+            response.raise_for_status()
+        except Exception as e:
+            # traces are best effort, the spans are not retried
+            print(f"Error exporting {len(spans)} spans to {self.endpoint}: {e}")
+
+
+    async def run(self) -> None:
+        """Post the queued spans every `flush_interval` seconds until cancelled."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            # shielded so the spans queued at shutdown are still exported
+            await asyncio.shield(self.flush())
+
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
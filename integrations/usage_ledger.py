@@ -0,0 +1,220 @@
+# used for /admin/usage endpoint on EZLLM gateway
+#### What this does ####
+#    On success / failure, append the usage of the request to a SQLite ledger
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from litellm import CustomLogger
+from utils.model_config import get_model_name
+from utils.setting import settings
+
+
+# fields usage can be grouped by
+USAGE_GROUP_FIELDS = ("user", "project", "org", "model")
+
+# key: time bucket --> value: SQLite expression of the bucket a record belongs to
+USAGE_BUCKETS = {
+    "hour": "strftime('%Y-%m-%dT%H:00:00Z', timestamp, 'unixepoch')",
+    "day": "strftime('%Y-%m-%d', timestamp, 'unixepoch')",
+    # weeks start on monday
+    "week": "date(timestamp, 'unixepoch', 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', timestamp, 'unixepoch')",
+}
+
+CREATE_USAGE_TABLE = """
+CREATE TABLE IF NOT EXISTS usage (
+    timestamp REAL NOT NULL,
+    user TEXT,
+    project TEXT,
+    org TEXT,
+    model TEXT,
+    status_code INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    latency REAL
+)
+"""
+
+
+class UsageLedger(CustomLogger):
+    """
+    Persistent per request usage for chargeback reporting. Records are
+    queued in memory by the litellm callbacks and written to SQLite in
+    batches from a worker thread every `flush_interval` seconds, so that
+    requests never wait for the disk.
+    """
+    def __init__(self, user_configs: dict, db_path: str = "data/usage.db", flush_interval: float = 1.0,
+                 max_pending: int = 100000):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        # records beyond this are dropped while the ledger can not keep up
+        self.max_pending = max_pending
+        self._pending: List[tuple] = []
+        self._dropped = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        # one connection shared by the writer and the queries, used from worker threads
+        self._lock = threading.Lock()
+        self.update_configs(user_configs)
+
+
+    def update_configs(self, user_configs: dict):
+        self.user_configs = user_configs
+        self.user_profiles = {user_profile["id"]: user_profile for user_profile in user_configs.values()}
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(CREATE_USAGE_TABLE)
+            connection.execute("CREATE INDEX IF NOT EXISTS usage_timestamp ON usage (timestamp)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+
+    def _record(self, user_id: Optional[str], model: Optional[str], status_code: Optional[int],
+                prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0,
+                latency: Optional[float] = None) -> None:
+        if len(self._pending) >= self.max_pending:
+            self._dropped += 1
+            return
+        user_profile = self.user_profiles.get(user_id) or {}
+        self._pending.append((time.time(), user_id, user_profile.get("project", "default"),
+                              user_profile.get("org", "default"), model, status_code,
+                              prompt_tokens, completion_tokens, total_tokens, latency))
+
+
+    def log_failure_event(self, kwargs, response_obj, start_time, end_time):
+        # only the failures reported by the routes carry the user token (and the status code as response_obj)
+        user_token = kwargs.get("user_token")
+        if user_token is None:
+            return
+        if user_token == settings.MASTER_TOKEN:
+            user_id = "admin"
+        else:
+            user_id = (self.user_configs.get(user_token) or {}).get("id")
+        latency = end_time - start_time if isinstance(start_time, (int, float)) and isinstance(end_time, (int, float)) else None
+        self._record(user_id, get_model_name(kwargs), response_obj, latency=latency)
+
+
+    async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
+        standard_logging_payload = kwargs.get("standard_logging_object") or {}
+        request_start_time = kwargs.get("start_time")
+        request_end_time = kwargs.get("end_time")
+        latency = None
+        if isinstance(request_start_time, datetime) and isinstance(request_end_time, datetime):
+            latency = (request_end_time - request_start_time).total_seconds()
+        self._record(kwargs.get("user"), get_model_name(kwargs), 200,
+                     prompt_tokens=standard_logging_payload.get("prompt_tokens", 0),
+                     completion_tokens=standard_logging_payload.get("completion_tokens", 0),
+                     total_tokens=standard_logging_payload.get("total_tokens", 0),
+                     latency=latency)
+
+
+    def _write(self, records: List[tuple]) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            connection.commit()
+
+
+    async def flush(self) -> None:
+        records, self._pending = self._pending, []
+        if self._dropped:
+            print(f"Usage ledger dropped {self._dropped} records")
+            self._dropped = 0
+        if not records:
+            return
+        try:
+            await asyncio.to_thread(self._write, records)
+        except Exception as e:
+            print(f"Error writing the usage ledger: {e}")
+            # retried with the next flush
+            self._pending[:0] = records[:self.max_pending]
+
+
+    async def run(self) -> None:
+        """Write the queued records every `flush_interval` seconds until cancelled."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            # shielded so the records queued at shutdown are still written
+            await asyncio.shield(self.flush())
+
+
+    def _query(self, sql: str, params: list) -> List[dict]:
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+    async def get_usage(self, group_by: List[str], bucket: Optional[str] = None, start: Optional[float] = None,
+                        end: Optional[float] = None, filters: Optional[Dict[str, Any]] = None) -> List[dict]:
+        """
+        Aggregate the ledger by the `group_by` fields and, optionally, by time bucket.
+
+        Args:
+            group_by (list): fields of USAGE_GROUP_FIELDS
+            bucket (str): time bucket of USAGE_BUCKETS, or None for the whole range
+            start (float): unix timestamp of the first record included
+            end (float): unix timestamp the records are included until (exclusive)
+            filters (dict): key: field of USAGE_GROUP_FIELDS --> value: value the records must have
+
+        Returns:
+            list: one dict per group with requests, failed requests and token counts
+        """
+        for field in group_by:
+            if field not in USAGE_GROUP_FIELDS:
+                raise ValueError(f"Unsupported group_by field {field}, supported: {', '.join(USAGE_GROUP_FIELDS)}")
+        if bucket is not None and bucket not in USAGE_BUCKETS:
+            raise ValueError(f"Unsupported bucket {bucket}, supported: {', '.join(USAGE_BUCKETS)}")
+
+        columns = [f"{USAGE_BUCKETS[bucket]} AS bucket"] if bucket else []
+        columns += list(group_by)
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        for field, value in (filters or {}).items():
+            if field not in USAGE_GROUP_FIELDS:
+                raise ValueError(f"Unsupported filter {field}, supported: {', '.join(USAGE_GROUP_FIELDS)}")
+            conditions.append(f"{field} = ?")
+            params.append(value)
+
+        group_columns = (["bucket"] if bucket else []) + list(group_by)
+        sql = (
+            f"SELECT {', '.join(columns + ['COUNT(*) AS requests'])}, "
+            "COALESCE(SUM(status_code IS NOT 200), 0) AS failed_requests, "
+            "COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens, "
+            "COALESCE(SUM(completion_tokens), 0) AS completion_tokens, "
+            "COALESCE(SUM(total_tokens), 0) AS total_tokens "
+            "FROM usage"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            + (f" GROUP BY {', '.join(group_columns)} ORDER BY {', '.join(group_columns)}" if group_columns else "")
+        )
+        # include the records still queued
+        await self.flush()
+        return await asyncio.to_thread(self._query, sql, params)
+
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
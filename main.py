@@ -163,13 +163,60 @@
 #     uvicorn.run(app, host="0.0.0.0", port=os.getenv("PORT", 8080))
 
 
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import shutil
+import sys
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from prometheus_client import make_asgi_app
-from routes.chat import router as chat_router
 from utils.setting import settings
 
+
+def setup_multiprocess_metrics():
+    """
+    Aggregate the metrics of the workers through PROMETHEUS_MULTIPROC_DIR,
+    which prometheus_client only reads when it is imported. The directory is
+    set for the workers of `python main.py` (EZLLM_WORKERS), `uvicorn main:app
+    --workers N` and gunicorn. Servers started from the command line do not
+    empty it, so remove it before restarting them.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        return
+    is_worker = (settings.WORKERS > 1 or int(os.getenv("WEB_CONCURRENCY", 1)) > 1
+                 # uvicorn spawns its workers through multiprocessing, gunicorn forks them from its arbiter
+                 or multiprocessing.parent_process() is not None or "gunicorn" in sys.modules)
+    if not is_worker:
+        return
+    if "prometheus_client" in sys.modules:
+        raise RuntimeError("prometheus_client was imported before PROMETHEUS_MULTIPROC_DIR was set, "
+                           "the metrics of the workers would not be aggregated. Set PROMETHEUS_MULTIPROC_DIR "
+                           "before starting the server.")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = settings.PROMETHEUS_MULTIPROC_DIR
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+# before the modules below import prometheus_client
+setup_multiprocess_metrics()
+
+from core.request_timing import RequestTimingMiddleware
+from integrations.prometheus import (make_metrics_app,
+                                     mark_worker_exit,
+                                     remove_dead_workers)
+from routes.admin import router as admin_router
+from routes.batches import (router as batches_router,
+                            batch_manager)
+from core.shared_state import run_sync
+from routes.chat import (router as chat_router,
+                         rate_limiter,
+                         prometheusLogger,
+                         route_handler,
+                         shared_state,
+                         span_exporter,
+                         usage_ledger)
+from utils.config_loader import config_loader
+
 def setup_middleware(app: FastAPI):
     app.add_middleware(
         CORSMiddleware,
@@ -178,21 +225,78 @@ def setup_middleware(app: FastAPI):
         allow_methods=["*"],
         allow_headers=["*"]
     )
+    # Time the phases of every request (outermost, so that it also times the other middleware)
+    timing_listeners = [prometheusLogger.observe_request_timing]
+    if span_exporter is not None:
+        timing_listeners.append(span_exporter.export)
+    app.add_middleware(
+        RequestTimingMiddleware,
+        listeners=timing_listeners,
+        server_timing=settings.SERVER_TIMING
+    )
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Drop the gauges of the workers this one may replace
+    remove_dead_workers()
+    # Reload routing / user configs when their files change
+    config_watcher = None
+    if settings.CONFIG_WATCH_INTERVAL > 0:
+        config_watcher = asyncio.create_task(config_loader.watch(settings.CONFIG_WATCH_INTERVAL))
+    # Share rate limits and breaker ejections with the other workers
+    shared_state_sync = None
+    if not shared_state.process_local:
+        shared_state_sync = asyncio.create_task(run_sync([rate_limiter, route_handler.llm_handler.circuit_breaker],
+                                                         settings.SHARED_STATE_SYNC_INTERVAL))
+    # Write the usage ledger in batches
+    usage_ledger_writer = asyncio.create_task(usage_ledger.run())
+    # Export the request spans in batches
+    span_exporter_task = None
+    if span_exporter is not None:
+        span_exporter_task = asyncio.create_task(span_exporter.run())
+    # Restart the batches interrupted by the last shutdown
+    await batch_manager.resume()
+
+    yield
+
+    if config_watcher is not None:
+        config_watcher.cancel()
+    if shared_state_sync is not None:
+        shared_state_sync.cancel()
+    await batch_manager.shutdown()
+    usage_ledger_writer.cancel()
+    await asyncio.gather(usage_ledger_writer, return_exceptions=True)
+    usage_ledger.close()
+    if span_exporter_task is not None:
+        span_exporter_task.cancel()
+        await asyncio.gather(span_exporter_task, return_exceptions=True)
+        await span_exporter.aclose()
+    # Close the keep-alive connections to the backend LLM APIs
+    await route_handler.llm_handler.connection_pools.aclose()
+    await shared_state.aclose()
+    mark_worker_exit()
 
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     setup_middleware(app)
     
-    # Prometheus Metrics
-    metrics_app = make_asgi_app()
+    # Prometheus Metrics (aggregated across workers)
+    metrics_app = make_metrics_app()
     app.mount("/metrics", metrics_app)
 
     # Register Routes
     app.include_router(chat_router)
+    app.include_router(admin_router)
+    app.include_router(batches_router)
 
     return app
 
 app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=settings.PORT)
+    if settings.WORKERS > 1:
+        # The workers start without the metrics of the last run
+        multiprocess_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        shutil.rmtree(multiprocess_dir, ignore_errors=True)
+        os.makedirs(multiprocess_dir)
+    uvicorn.run("main:app", host="0.0.0.0", port=settings.PORT, workers=settings.WORKERS)
@@ -0,0 +1,57 @@
+from typing import Optional
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from auth.auth_manager import master_token_auth
+from routes.chat import usage_ledger
+from utils.config_loader import config_loader
+
+
+router = APIRouter()
+
+
+@router.post("/admin/config/reload", dependencies=[Depends(master_token_auth)])
+async def reload_configs():
+    try:
+        snapshot = await config_loader.reload()
+    except Exception as e:
+        # the current configs stay active
+        raise HTTPException(status_code=400, detail=f"Invalid configs: {str(e)}")
+
+    return {
+        "version": snapshot.version,
+        "loaded_at": snapshot.loaded_at,
+        "models": list(snapshot.routing_configs.keys()),
+        "users": len(snapshot.user_configs),
+    }
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Unix timestamp of an ISO 8601 date / datetime or of a number of seconds."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+@router.get("/admin/usage", dependencies=[Depends(master_token_auth)])
+async def get_usage(group_by: str = "project,model", bucket: Optional[str] = "day",
+                    start: Optional[str] = None, end: Optional[str] = None,
+                    user: Optional[str] = None, project: Optional[str] = None,
+                    org: Optional[str] = None, model: Optional[str] = None):
+    filters = {field: value for field, value in (("user", user), ("project", project), ("org", org), ("model", model))
+               if value is not None}
+    group_fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    try:
+        data = await usage_ledger.get_usage(group_fields, bucket=bucket or None, start=parse_time(start),
+                                            end=parse_time(end), filters=filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "object": "list",
+        "group_by": group_fields,
+        "bucket": bucket or None,
+        "data": data,
+    }
@@ -0,0 +1,132 @@
+from typing import Optional
+import asyncio
+from fastapi import APIRouter, Request, Depends, HTTPException
+from starlette.responses import FileResponse
+from auth.auth_manager import user_token_auth
+from core.batch_manager import (BatchManager,
+                                BatchNotFoundError)
+from routes.chat import (rate_limiter,
+                         route_handler,
+                         token_counter)
+from utils.config_loader import config_loader
+from utils.setting import settings
+
+
+router = APIRouter()
+batch_manager = BatchManager(route_handler, rate_limiter=rate_limiter,
+                             storage_dir=settings.BATCH_STORAGE_DIR,
+                             max_concurrency=settings.BATCH_MAX_CONCURRENCY,
+                             max_retries=settings.BATCH_MAX_RETRIES,
+                             retry_backoff=settings.BATCH_RETRY_BACKOFF,
+                             token_counter=token_counter)
+
+
+def get_user(request: Request) -> str:
+    api_token = request.headers.get("Authorization").replace("Bearer ", "").strip()
+    # the token may have been removed by a config reload since user_token_auth checked it
+    user_profile = config_loader.get_snapshot().user_configs.get(api_token)
+    if user_profile is None:
+        raise HTTPException(status_code=401, detail="Invalid user key")
+    return user_profile["id"]
+
+
+@router.post("/files", dependencies=[Depends(user_token_auth)])
+@router.post("/v1/files", dependencies=[Depends(user_token_auth)])
+async def upload_file(request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    purpose = form.get("purpose")
+    if upload is None or isinstance(upload, str):
+        raise HTTPException(status_code=400, detail="A JSONL file is required")
+    if purpose != "batch":
+        raise HTTPException(status_code=400, detail="Only files with purpose 'batch' are supported")
+
+    content = await upload.read()
+    return await asyncio.to_thread(batch_manager.files.create, content, upload.filename, purpose, get_user(request))
+
+
+@router.get("/files/{file_id}", dependencies=[Depends(user_token_auth)])
+@router.get("/v1/files/{file_id}", dependencies=[Depends(user_token_auth)])
+async def retrieve_file(file_id: str, request: Request):
+    try:
+        return await asyncio.to_thread(batch_manager.files.get, file_id, get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@router.get("/files/{file_id}/content", dependencies=[Depends(user_token_auth)])
+@router.get("/v1/files/{file_id}/content", dependencies=[Depends(user_token_auth)])
+async def retrieve_file_content(file_id: str, request: Request):
+    try:
+        file_object = await asyncio.to_thread(batch_manager.files.get, file_id, get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return FileResponse(batch_manager.files.get_content_path(file_id), media_type="application/jsonl",
+                        filename=file_object["filename"])
+
+
+@router.delete("/files/{file_id}", dependencies=[Depends(user_token_auth)])
+@router.delete("/v1/files/{file_id}", dependencies=[Depends(user_token_auth)])
+async def delete_file(file_id: str, request: Request):
+    try:
+        await asyncio.to_thread(batch_manager.files.delete, file_id, get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+@router.post("/batches", dependencies=[Depends(user_token_auth)])
+@router.post("/v1/batches", dependencies=[Depends(user_token_auth)])
+async def create_batch(request: Request):
+    req_body = await request.json()
+    try:
+        return await batch_manager.create_batch(input_file_id=req_body.get("input_file_id", ""),
+                                                endpoint=req_body.get("endpoint", ""),
+                                                completion_window=req_body.get("completion_window", "24h"),
+                                                metadata=req_body.get("metadata"),
+                                                user=get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/batches", dependencies=[Depends(user_token_auth)])
+@router.get("/v1/batches", dependencies=[Depends(user_token_auth)])
+async def list_batches(request: Request, limit: int = 20, after: Optional[str] = None):
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    try:
+        # one more batch than requested tells whether there is a next page
+        batches = await asyncio.to_thread(batch_manager.list_batches, get_user(request), limit + 1, after)
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    has_more = len(batches) > limit
+    batches = batches[:limit]
+    return {
+        "object": "list",
+        "data": batches,
+        "first_id": batches[0]["id"] if batches else None,
+        "last_id": batches[-1]["id"] if batches else None,
+        "has_more": has_more,
+    }
+
+
+@router.get("/batches/{batch_id}", dependencies=[Depends(user_token_auth)])
+@router.get("/v1/batches/{batch_id}", dependencies=[Depends(user_token_auth)])
+async def retrieve_batch(batch_id: str, request: Request):
+    try:
+        return await asyncio.to_thread(batch_manager.get_batch, batch_id, get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@router.post("/batches/{batch_id}/cancel", dependencies=[Depends(user_token_auth)])
+@router.post("/v1/batches/{batch_id}/cancel", dependencies=[Depends(user_token_auth)])
+async def cancel_batch(batch_id: str, request: Request):
+    try:
+        return await batch_manager.cancel_batch(batch_id, get_user(request))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,33 +1,98 @@
-import json
 import time
-from fastapi import APIRouter, Request, Depends
-from starlette.responses import StreamingResponse
+from functools import partial
+from fastapi import APIRouter, Request, Depends, HTTPException
+from starlette.responses import Response
+from core.rate_limiter import RateLimiter, RateLimitExceededError
+from core.request_timing import (request_phase,
+                                 set_request_model)
 from core.route_handler import RouteHandler
+from core.route_table import RouteNotFoundError
+from core.shared_state import create_shared_state
+from core.token_counter import (ContextWindowExceededError,
+                                TokenCounter)
 from integrations.prometheus import PrometheusLogger
+from integrations.tracing import OTLPSpanExporter
+from integrations.usage_ledger import UsageLedger
 from auth.auth_manager import user_token_auth
 from utils.config_loader import config_loader
 from utils.setting import settings
 import litellm
-from utils.openai import Completion
+from utils.sse import (SSEStreamingResponse,
+                       chat_sse_stream,
+                       completion_sse_stream)
 
 
 router = APIRouter()
-route_handler = RouteHandler()
-prometheusLogger = PrometheusLogger(*config_loader.load_configs())
-litellm.callbacks = [prometheusLogger]
-
-
-async def streaming_chunk_generator(response):
-    async for chunk in response:
-        yield f"data: {json.dumps(chunk.json())}\n\n"
-
-
-async def completion_streaming_chunk_generator(response):
-    async for chunk in response:
-        completion_data = json.loads(chunk.json())
-        completion_instance = Completion(**completion_data)
-
-        yield f"data: {completion_instance.json()}\n\n"
+prometheusLogger = PrometheusLogger(*config_loader.load_configs(), flush_interval=settings.METRICS_FLUSH_INTERVAL)
+shared_state = create_shared_state(settings.SHARED_STATE_BACKEND, url=settings.SHARED_STATE_URL,
+                                   shm_path=settings.SHARED_STATE_SHM_PATH)
+# a single worker keeps all its state in memory
+worker_shared_state = None if shared_state.process_local else shared_state
+rate_limiter = RateLimiter(config_loader.load_configs()[1], config_loader.load_tenant_configs(),
+                           prometheus_logger=prometheusLogger, shared_state=worker_shared_state)
+usage_ledger = UsageLedger(config_loader.load_configs()[1], db_path=settings.USAGE_LEDGER_PATH,
+                           flush_interval=settings.USAGE_LEDGER_FLUSH_INTERVAL)
+litellm.callbacks = [prometheusLogger, rate_limiter, usage_ledger]
+route_handler = RouteHandler(prometheus_logger=prometheusLogger, shared_state=worker_shared_state)
+token_counter = TokenCounter(tokenizer_dir=settings.TOKENIZER_DIR)
+span_exporter = OTLPSpanExporter(settings.TRACING_OTLP_ENDPOINT, flush_interval=settings.TRACING_FLUSH_INTERVAL) \
+    if settings.TRACING_OTLP_ENDPOINT else None
+
+
+def on_config_reload(snapshot):
+    prometheusLogger.update_configs(snapshot.routing_configs, snapshot.user_configs)
+    rate_limiter.update_configs(snapshot.user_configs, snapshot.tenant_configs)
+    usage_ledger.update_configs(snapshot.user_configs)
+    route_handler.llm_handler.connection_pools.retire_pools(
+        deployment for model_route in snapshot.route_table.routes.values() for deployment in model_route.deployments
+    )
+
+config_loader.add_reload_listener(on_config_reload)
+
+
+def check_rate_limits(api_token: str, user_configs: dict, estimated_tokens: int = 0):
+    try:
+        with request_phase("rate_limit"):
+            return rate_limiter.check_request(user_configs.get(api_token), estimated_tokens=estimated_tokens or 0)
+    except RateLimitExceededError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def release_when_complete(response, reservation):
+    """
+    Give back the rate limit estimate of a request that no success callback
+    reconciled (cache hits, coalesced followers) once its response is
+    complete, for streams when they end.
+    """
+    if isinstance(response, SSEStreamingResponse):
+        response.on_close = partial(rate_limiter.release, reservation)
+    else:
+        rate_limiter.release(reservation)
+    return response
+
+
+async def fit_context_window(call_type: str, req_body: dict, config_snapshot) -> tuple:
+    """
+    Count the prompt tokens of a request before it is dispatched, and reject
+    it (or clamp its max_tokens) if it does not fit the context window of
+    the model.
+
+    Returns:
+        tuple: (request body to send, estimated prompt tokens or None)
+    """
+    try:
+        model_route = config_snapshot.route_table.get(req_body.get("model"))
+        set_request_model(model_route.model_name)
+        with request_phase("preflight"):
+            return await token_counter.fit_context_window(call_type, model_route, req_body)
+    except RouteNotFoundError as e:
+        raise HTTPException(status_code=400, detail=str(e.args[0]))
+    except ContextWindowExceededError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/chat/completions", dependencies=[Depends(user_token_auth)])
@@ -35,25 +100,31 @@ async def completion_streaming_chunk_generator(response):
 async def chat_completion(request: Request):
     start_time = time.time()
     api_token = request.headers.get("Authorization").replace("Bearer ", "").strip()
-    req_body = await request.json()
-
-    req_body.update({
-        "master_token": settings.MASTER_TOKEN,
-        "user_token": api_token,
-        "routing_configs": config_loader.load_configs()[0],
-        "user_configs": config_loader.load_configs()[1],
-        "req_url_path": request.url.path
-    })
+    with request_phase("parse"):
+        req_body = await request.json()
+    # the request keeps this snapshot even if the configs are reloaded meanwhile
+    with request_phase("config"):
+        config_snapshot = config_loader.get_snapshot()
 
+    reservation = None
     try:
-        response = await route_handler.chat_completion(**req_body)
+        send_body, prompt_tokens = await fit_context_window("chat_completion", req_body, config_snapshot)
+        reservation = check_rate_limits(api_token, config_snapshot.user_configs, prompt_tokens)
+        response = await route_handler.chat_completion(send_body, api_token, config_snapshot, prompt_tokens=prompt_tokens)
+        if isinstance(response, Response):
+            # passthrough models already carry the upstream bytes
+            return release_when_complete(response, reservation)
         if req_body.get("stream", False):
-            return StreamingResponse(streaming_chunk_generator(response), media_type='text/event-stream')
-        return response
+            response = SSEStreamingResponse(chat_sse_stream(response),
+                                            on_disconnect=partial(prometheusLogger.log_abandoned_stream, req_body.get("model")))
+        return release_when_complete(response, reservation)
     
     except Exception as e:
+        rate_limiter.release(reservation)
         end_time = time.time()
-        prometheusLogger.log_failure_event(req_body, getattr(e, 'status_code', None), start_time, end_time)
+        failure_kwargs = {"model": req_body.get("model"), "user_token": api_token}
+        prometheusLogger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
+        usage_ledger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
         raise e
 
 
@@ -62,25 +133,54 @@ async def chat_completion(request: Request):
 async def completion(request: Request):
     start_time = time.time()
     api_token = request.headers.get("Authorization").replace("Bearer ", "").strip()
-    req_body = await request.json()
-
-    req_body.update({
-        "master_token": settings.MASTER_TOKEN,
-        "user_token": api_token,
-        "routing_configs": config_loader.load_configs()[0],
-        "user_configs": config_loader.load_configs()[1],
-        "req_url_path": request.url.path
-    })
+    with request_phase("parse"):
+        req_body = await request.json()
+    # the request keeps this snapshot even if the configs are reloaded meanwhile
+    with request_phase("config"):
+        config_snapshot = config_loader.get_snapshot()
 
+    reservation = None
     try:
-        response = await route_handler.completion(**req_body)
+        send_body, prompt_tokens = await fit_context_window("completion", req_body, config_snapshot)
+        reservation = check_rate_limits(api_token, config_snapshot.user_configs, prompt_tokens)
+        response = await route_handler.completion(send_body, api_token, config_snapshot, prompt_tokens=prompt_tokens)
+        if isinstance(response, Response):
+            # passthrough models already carry the upstream bytes
+            return release_when_complete(response, reservation)
         if req_body.get("stream", False):
-            return StreamingResponse(completion_streaming_chunk_generator(response), media_type='text/event-stream')
-        return response
+            response = SSEStreamingResponse(completion_sse_stream(response),
+                                            on_disconnect=partial(prometheusLogger.log_abandoned_stream, req_body.get("model")))
+        return release_when_complete(response, reservation)
+
+    except Exception as e:
+        rate_limiter.release(reservation)
+        end_time = time.time()
+        failure_kwargs = {"model": req_body.get("model"), "user_token": api_token}
+        prometheusLogger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
+        usage_ledger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
+        raise e
+
+
+@router.post("/embeddings", dependencies=[Depends(user_token_auth)])
+@router.post("/v1/embeddings", dependencies=[Depends(user_token_auth)])
+async def embedding(request: Request):
+    start_time = time.time()
+    api_token = request.headers.get("Authorization").replace("Bearer ", "").strip()
+    with request_phase("parse"):
+        req_body = await request.json()
+    # the request keeps this snapshot even if the configs are reloaded meanwhile
+    with request_phase("config"):
+        config_snapshot = config_loader.get_snapshot()
+
+    try:
+        check_rate_limits(api_token, config_snapshot.user_configs)
+        return await route_handler.embedding(req_body, api_token, config_snapshot)
 
     except Exception as e:
         end_time = time.time()
-        prometheusLogger.log_failure_event(req_body, getattr(e, 'status_code', None), start_time, end_time)
+        failure_kwargs = {"model": req_body.get("model"), "user_token": api_token}
+        prometheusLogger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
+        usage_ledger.log_failure_event(failure_kwargs, getattr(e, 'status_code', None), start_time, end_time)
         raise e
 
 
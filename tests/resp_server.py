@@ -0,0 +1,130 @@
+"""
+Local stand-in of a Redis server, speaking the subset of RESP2 the
+gateway's RedisState uses: AUTH, SELECT, MULTI / EXEC, INCRBYFLOAT,
+PEXPIRE, MGET, SET (with PX) and DEL.
+"""
+from typing import (Dict, List, Optional, Set, Tuple)
+import asyncio
+import time
+
+
+class FakeRedisServer:
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        # key: key --> value: (value, expires_at or None), shared by all dbs
+        self.entries: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands: List[tuple] = []
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+
+    async def start(self, port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+
+    async def stop(self) -> None:
+        self.drop_connections()
+        self._server.close()
+        await self._server.wait_closed()
+
+
+    def drop_connections(self) -> None:
+        for writer in list(self._writers):
+            writer.close()
+        self._writers.clear()
+
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.entries[key]
+            return None
+        return entry[0]
+
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> list:
+        line = await reader.readuntil(b"\r\n")
+        assert line[:1] == b"*", line
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readuntil(b"\r\n"))[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+
+    def _encode(self, reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return b"-" + str(reply).encode() + b"\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self._encode(item) for item in reply)
+        if reply == "OK" or reply == "QUEUED":
+            return b"+" + reply.encode() + b"\r\n"
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+    def _execute(self, name: str, args: list):
+        if name == "INCRBYFLOAT":
+            total = float(self._get(args[0]) or 0) + float(args[1])
+            expires_at = self.entries.get(args[0], (None, None))[1]
+            value = repr(total).encode()
+            self.entries[args[0]] = (value, expires_at)
+            return value
+        if name == "PEXPIRE":
+            if self._get(args[0]) is None:
+                return 0
+            self.entries[args[0]] = (self.entries[args[0]][0], time.monotonic() + int(args[1]) / 1000)
+            return 1
+        if name == "MGET":
+            return [self._get(key) for key in args]
+        if name == "SET":
+            expires_at = None
+            if len(args) == 4 and args[2].upper() == b"PX":
+                expires_at = time.monotonic() + int(args[3]) / 1000
+            self.entries[args[0]] = (args[1], expires_at)
+            return "OK"
+        if name == "DEL":
+            return sum(self.entries.pop(key, None) is not None for key in args)
+        if name == "SELECT":
+            return "OK"
+        return Exception(f"ERR unknown command '{name}'")
+
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        authenticated = self.password is None
+        transaction: Optional[list] = None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                name, args = args[0].decode().upper(), args[1:]
+                self.commands.append((name, *args))
+                if name == "AUTH":
+                    authenticated = args[-1].decode() == self.password
+                    reply = "OK" if authenticated else Exception("WRONGPASS invalid username-password pair")
+                elif not authenticated:
+                    reply = Exception("NOAUTH Authentication required.")
+                elif name == "MULTI":
+                    transaction, reply = [], "OK"
+                elif name == "EXEC":
+                    reply = [self._execute(queued_name, queued_args)
+                             for queued_name, queued_args in transaction]
+                    transaction = None
+                elif transaction is not None:
+                    transaction.append((name, args))
+                    reply = "QUEUED"
+                else:
+                    reply = self._execute(name, args)
+                writer.write(self._encode(reply))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+from azure.core.credentials import AccessToken
+from core.azure_token_manager import AzureTokenManager
+
+
+class FakeCredential:
+    """Token endpoint stand-in: every get_token call returns a new token valid for `validity` seconds."""
+    def __init__(self, validity: float, delay: float = 0.05):
+        self.validity = validity
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes) -> AccessToken:
+        # blocking, like the network call of the real credentials
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.fail:
+            raise RuntimeError("token endpoint unavailable")
+        return AccessToken(f"token-{calls}", int(time.time() + self.validity))
+
+
+def make_manager(credential: FakeCredential, refresh_margin: float = 300) -> AzureTokenManager:
+    return AzureTokenManager("https://cognitiveservices.azure.com/.default", refresh_margin=refresh_margin,
+                             min_validity=60, credential_factory=lambda *args: credential)
+
+
+def test_concurrent_callers_share_one_refresh():
+    async def test():
+        credential = FakeCredential(validity=3600)
+        manager = make_manager(credential)
+        tokens = await asyncio.gather(*(manager.get_token("client", "tenant", "secret") for _ in range(20)))
+        assert tokens == ["token-1"] * 20
+        assert credential.calls == 1
+        # cached afterwards
+        assert await manager.get_token("client", "tenant", "secret") == "token-1"
+        assert credential.calls == 1
+    asyncio.run(test())
+
+
+def test_token_in_use_is_refreshed_before_expiry():
+    async def test():
+        # the proactive refresh is due one to two seconds after the fetch (expires_on is truncated to seconds)
+        credential = FakeCredential(validity=302)
+        manager = make_manager(credential)
+        assert await manager.get_token() == "token-1"
+        expires_on = time.time() + 302
+        # used again after its refresh
+        assert await manager.get_token() == "token-1"
+        await asyncio.sleep(2.5)
+        assert credential.calls == 2
+        assert time.time() < expires_on
+        # handed out without waiting
+        assert await manager.get_token() == "token-2"
+    asyncio.run(test())
+
+
+def test_unused_token_is_not_refreshed():
+    async def test():
+        credential = FakeCredential(validity=302)
+        manager = make_manager(credential)
+        await manager.get_token()
+        await asyncio.sleep(2.5)
+        assert credential.calls == 1
+    asyncio.run(test())
+
+
+def test_failed_refresh_keeps_valid_token_and_retries():
+    async def test():
+        # within the refresh margin from the start: every use refreshes in the background
+        credential = FakeCredential(validity=200)
+        manager = make_manager(credential)
+        assert await manager.get_token() == "token-1"
+
+        credential.fail = True
+        assert await manager.get_token() == "token-1"
+        await asyncio.sleep(0.2)
+        # the background refresh failed, the still valid token keeps being used
+        assert credential.calls == 2
+        assert await manager.get_token() == "token-1"
+
+        credential.fail = False
+        await asyncio.sleep(0.2)
+        assert credential.calls == 3
+        assert await manager.get_token() == "token-3"
+    asyncio.run(test())
+
+
+def test_failed_refresh_without_valid_token_raises():
+    async def test():
+        credential = FakeCredential(validity=3600)
+        credential.fail = True
+        manager = make_manager(credential)
+        results = await asyncio.gather(*(manager.get_token() for _ in range(5)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert credential.calls == 1
+
+        credential.fail = False
+        assert await manager.get_token() == "token-2"
+    asyncio.run(test())
@@ -0,0 +1,52 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from auth.auth_manager import user_token_auth
+from core.batch_manager import BatchManager
+from utils.config_loader import ConfigSnapshot
+import routes.batches
+
+
+USER_CONFIGS = {"sk-test": {"id": "user-1"}, "sk-other": {"id": "user-2"}}
+
+
+def make_client(tmp_path, monkeypatch, user_configs=USER_CONFIGS) -> TestClient:
+    batch_manager = BatchManager(route_handler=None, storage_dir=str(tmp_path))
+    for i in range(5):
+        # created within the same second, listed by id then
+        batch_manager._save_batch({"id": f"batch_{i}", "object": "batch", "created_at": 1000}, "user-1")
+    batch_manager._save_batch({"id": "batch_other", "object": "batch", "created_at": 2000}, "user-2")
+    snapshot = ConfigSnapshot({}, user_configs, {}, 1)
+    monkeypatch.setattr(routes.batches, "batch_manager", batch_manager)
+    monkeypatch.setattr(routes.batches.config_loader, "get_snapshot", lambda: snapshot)
+
+    app = FastAPI()
+    app.include_router(routes.batches.router)
+    app.dependency_overrides[user_token_auth] = lambda: None
+    return TestClient(app)
+
+
+def test_list_batches_pages_with_after_cursor(tmp_path, monkeypatch):
+    client = make_client(tmp_path, monkeypatch)
+    headers = {"Authorization": "Bearer sk-test"}
+    pages, after = [], None
+    while True:
+        params = {"limit": 2, **({"after": after} if after else {})}
+        page = client.get("/v1/batches", params=params, headers=headers).json()
+        pages.append([batch["id"] for batch in page["data"]])
+        if not page["has_more"]:
+            break
+        after = page["last_id"]
+    assert pages == [["batch_4", "batch_3"], ["batch_2", "batch_1"], ["batch_0"]]
+
+    # exactly one full page left
+    page = client.get("/v1/batches", params={"limit": 1, "after": "batch_1"}, headers=headers).json()
+    assert ([batch["id"] for batch in page["data"]], page["has_more"]) == (["batch_0"], False)
+    # the cursor must be a batch of the user
+    assert client.get("/v1/batches", params={"after": "batch_other"}, headers=headers).status_code == 404
+
+
+def test_removed_token_is_rejected(tmp_path, monkeypatch):
+    # the token passed user_token_auth, then a config reload removed it
+    client = make_client(tmp_path, monkeypatch, user_configs={"sk-other": {"id": "user-2"}})
+    response = client.get("/v1/batches", headers={"Authorization": "Bearer sk-test"})
+    assert response.status_code == 401
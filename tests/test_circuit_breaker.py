@@ -0,0 +1,61 @@
+import litellm
+from core.circuit_breaker import (CLOSED,
+                                  HALF_OPEN,
+                                  OPEN,
+                                  CircuitBreaker)
+
+
+API_BASE = "http://upstream"
+
+
+class EjectionRecorder:
+    def __init__(self):
+        self.ejections = []
+
+    def log_deployment_ejection(self, api_base: str, ejection_time: float):
+        self.ejections.append((api_base, ejection_time))
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def make_half_open_breaker(prometheus_logger=None) -> CircuitBreaker:
+    breaker = CircuitBreaker(consecutive_failures_threshold=2, base_ejection_time=0, half_open_max_requests=1,
+                             half_open_success_threshold=1, prometheus_logger=prometheus_logger)
+    for _ in range(2):
+        breaker.record_failure(API_BASE, litellm.ServiceUnavailableError("down", "openai", "upstream"))
+    assert breaker.deployment_health[API_BASE].state == OPEN
+    assert breaker.is_available(API_BASE)
+    assert breaker.deployment_health[API_BASE].state == HALF_OPEN
+    return breaker
+
+
+def test_client_error_is_not_a_successful_probe():
+    breaker = make_half_open_breaker()
+    breaker.on_request_start(API_BASE)
+    assert not breaker.is_available(API_BASE)
+
+    breaker.record_failure(API_BASE, litellm.BadRequestError("bad request", "upstream", "openai"))
+    health = breaker.deployment_health[API_BASE]
+    # still half-open, and the probe slot is free again
+    assert health.state == HALF_OPEN
+    assert health.probe_successes == 0
+    assert breaker.is_available(API_BASE)
+
+    breaker.on_request_start(API_BASE)
+    breaker.record_success(API_BASE)
+    assert health.state == CLOSED
+
+
+def test_client_error_does_not_reset_consecutive_failures():
+    breaker = CircuitBreaker(consecutive_failures_threshold=2, min_requests=100)
+    breaker.record_failure(API_BASE, litellm.ServiceUnavailableError("down", "openai", "upstream"))
+    breaker.record_failure(API_BASE, litellm.BadRequestError("bad request", "upstream", "openai"))
+    breaker.record_failure(API_BASE, litellm.ServiceUnavailableError("down", "openai", "upstream"))
+    assert breaker.deployment_health[API_BASE].state == OPEN
+
+
+def test_ejection_is_reported_to_prometheus():
+    recorder = EjectionRecorder()
+    make_half_open_breaker(prometheus_logger=recorder)
+    assert recorder.ejections == [(API_BASE, 0)]
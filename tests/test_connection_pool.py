@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncAzureOpenAI
+
+from core.connection_pool import (ConnectionPoolManager,
+                                  TrackedTransport)
+from core.route_table import Deployment
+
+
+def azure_deployment(**litellm_params):
+    return Deployment("gpt-4o/0", "gpt-4o", {"model": "azure/gpt-4o",
+                                             "api_base": "https://example.openai.azure.com", **litellm_params})
+
+
+def test_connection_counts_fall_back_to_in_flight_without_pool_internals():
+    transport = TrackedTransport(SimpleNamespace(), lambda: None)
+    transport.in_flight = 3
+    assert transport.get_connection_counts() == (3, 0)
+
+
+def test_connection_counts_read_the_httpx_pool():
+    transport = TrackedTransport(httpx.AsyncHTTPTransport(), lambda: None)
+    assert transport.get_connection_counts() == (0, 0)
+
+
+def test_azure_requests_share_the_pool_and_follow_token_refresh():
+    pools = ConnectionPoolManager()
+    deployment = azure_deployment(api_version="2024-06-01")
+
+    first = pools.configure_request(deployment, {"azure_ad_token": "token-1"})
+    again = pools.configure_request(deployment, {"azure_ad_token": "token-1"})
+    refreshed = pools.configure_request(deployment, {"azure_ad_token": "token-2"})
+
+    assert isinstance(first["client"], AsyncAzureOpenAI)
+    assert first["api_version"] == "2024-06-01"
+    assert again["client"] is first["client"]
+    assert refreshed["client"] is not first["client"]
+    http_client = pools.get_http_client(deployment)
+    assert first["client"]._client is http_client
+    assert refreshed["client"]._client is http_client
+    asyncio.run(pools.aclose())
+
+
+def test_azure_credentials_resolved_by_litellm_keep_its_client():
+    pools = ConnectionPoolManager()
+    deployment = azure_deployment()
+
+    assert "client" not in pools.configure_request(deployment, {"api_key": None})
+    assert "client" not in pools.configure_request(deployment, {"azure_ad_token": "oidc/azure/token"})
+    assert "client" in pools.configure_request(deployment, {"api_key": "key"})
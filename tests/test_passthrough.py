@@ -0,0 +1,88 @@
+import asyncio
+import json
+import httpx
+import litellm
+from core.passthrough import PassthroughHandler
+from core.rate_limiter import RateLimiter
+from core.route_table import Deployment
+from utils.model_config import get_model_name
+
+
+USAGE = {"prompt_tokens": 30, "completion_tokens": 20, "total_tokens": 50}
+
+
+class FakeConnectionPools:
+    def __init__(self, handler):
+        self.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def get_http_client(self, deployment):
+        return self.http_client
+
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    if body.get("stream"):
+        events = [{"choices": [{"index": 0, "delta": {"content": "hi"}}]}, {"choices": [], "usage": USAGE}]
+        content = b"".join(b"data: " + json.dumps(event).encode() + b"\n\n" for event in events)
+        return httpx.Response(200, stream=httpx.ByteStream(content + b"data: [DONE]\n\n"))
+    content = json.dumps({"choices": [{"index": 0, "message": {"content": "hi"}}], "usage": USAGE}).encode()
+    return httpx.Response(200, stream=httpx.ByteStream(content))
+
+
+def make_rate_limiter() -> RateLimiter:
+    user_configs = {"sk-test": {"id": "user-1", "project": "project-1", "org": "org-1"}}
+    tenant_configs = {"project": {"project-1": {"tpm": 1000}}}
+    return RateLimiter(user_configs, tenant_configs)
+
+
+async def send(stream: bool, estimated_tokens: int) -> float:
+    rate_limiter = make_rate_limiter()
+    litellm.callbacks = [rate_limiter]
+    user_profile = rate_limiter.user_profiles["user-1"]
+    reservation = rate_limiter.check_request(user_profile, estimated_tokens=estimated_tokens)
+
+    deployment = Deployment("bench-0", "bench", {"model": "hosted_vllm/upstream-bench", "api_base": "http://upstream/v1"})
+    handler = PassthroughHandler(FakeConnectionPools(upstream))
+    metadata = {"model_name": "bench", "rate_limit_reservation": reservation}
+    upstream_call = handler.get_upstream_call("chat_completion", deployment, metadata=metadata)
+    body = handler.build_request({"model": "bench", "messages": [], "stream": stream}, deployment, "user-1")
+    response = await upstream_call(**body)
+    if stream:
+        async for _ in response:
+            pass
+    bucket = rate_limiter.buckets[("project", "project-1", "tpm")]
+    # without refill in between, what was consumed from the bucket
+    return bucket.capacity - bucket.tokens
+
+
+class ModelRecorder(litellm.CustomLogger):
+    def __init__(self):
+        self.models = []
+
+    async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
+        self.models.append((kwargs["model"], get_model_name(kwargs)))
+
+
+def test_passthrough_reports_gateway_model_name():
+    recorder = ModelRecorder()
+    deployment = Deployment("bench-0", "bench", {"model": "hosted_vllm/upstream-bench", "api_base": "http://upstream/v1"})
+    handler = PassthroughHandler(FakeConnectionPools(upstream))
+    body = handler.build_request({"model": "bench", "messages": []}, deployment, "user-1")
+    assert body["model"] == "upstream-bench"
+    try:
+        litellm.callbacks = [recorder]
+        upstream_call = handler.get_upstream_call("chat_completion", deployment, metadata={"model_name": "bench"})
+        asyncio.run(upstream_call(**body))
+    finally:
+        litellm.callbacks = []
+    # reported like litellm reports its calls: upstream model, gateway model name in the metadata
+    assert recorder.models == [("upstream-bench", "bench")]
+
+
+def test_passthrough_charges_tpm_once():
+    try:
+        for stream in (False, True):
+            consumed = asyncio.run(send(stream, estimated_tokens=40))
+            assert abs(consumed - USAGE["total_tokens"]) < 1
+    finally:
+        litellm.callbacks = []
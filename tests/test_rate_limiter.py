@@ -0,0 +1,132 @@
+import asyncio
+import types
+from unittest import mock
+import litellm
+import pytest
+import core.rate_limiter
+from core.rate_limiter import (RateLimiter,
+                               RateLimitExceededError)
+from core.route_handler import RouteHandler
+from tests.test_route_handler import model_config
+from utils.config_loader import ConfigSnapshot
+
+
+USER_CONFIGS = {"sk-test": {"id": "user-1", "project": "project-1", "org": "org-1"},
+                "sk-other": {"id": "user-2", "project": "project-1", "org": "org-1"}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    # only the buckets' clock, the event loop keeps the real one
+    monkeypatch.setattr(core.rate_limiter, "time", types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def success_kwargs(user: str, total_tokens: int, reservation) -> dict:
+    return {"user": user, "standard_logging_object": {"total_tokens": total_tokens},
+            "litellm_params": {"metadata": {"rate_limit_reservation": reservation}}}
+
+
+def test_rpm_bucket_refills(clock):
+    rate_limiter = RateLimiter(USER_CONFIGS, {"user": {"user-1": {"rpm": 2}}})
+    user_profile = USER_CONFIGS["sk-test"]
+    rate_limiter.check_request(user_profile)
+    rate_limiter.check_request(user_profile)
+    with pytest.raises(RateLimitExceededError) as error:
+        rate_limiter.check_request(user_profile)
+    assert (error.value.level, error.value.limit_type, error.value.retry_after) == ("user", "rpm", 30)
+
+    # 2 requests per minute: one more after 30 seconds
+    clock.now += 30
+    rate_limiter.check_request(user_profile)
+    with pytest.raises(RateLimitExceededError):
+        rate_limiter.check_request(user_profile)
+
+
+def test_every_level_is_checked_and_consumed_only_if_all_allow(clock):
+    tenant_configs = {"user": {"user-1": {"tpm": 1000}, "user-2": {"tpm": 1000}},
+                      "project": {"project-1": {"tpm": 1500}},
+                      "org": {"org-1": {"rpm": 3}}}
+    rate_limiter = RateLimiter(USER_CONFIGS, tenant_configs)
+    rate_limiter.check_request(USER_CONFIGS["sk-test"], estimated_tokens=800)
+    # the project is shared with user-1
+    with pytest.raises(RateLimitExceededError) as error:
+        rate_limiter.check_request(USER_CONFIGS["sk-other"], estimated_tokens=800)
+    assert (error.value.level, error.value.limit_type) == ("project", "tpm")
+    # the rejected request consumed nothing, neither its user nor the org rpm
+    assert rate_limiter.buckets[("user", "user-2", "tpm")].tokens == 1000
+    assert rate_limiter.buckets[("org", "org-1", "rpm")].tokens == 2
+
+    rate_limiter.check_request(USER_CONFIGS["sk-other"], estimated_tokens=100)
+    rate_limiter.check_request(USER_CONFIGS["sk-other"], estimated_tokens=100)
+    with pytest.raises(RateLimitExceededError) as error:
+        rate_limiter.check_request(USER_CONFIGS["sk-other"], estimated_tokens=100)
+    assert (error.value.level, error.value.limit_type) == ("org", "rpm")
+
+
+def test_estimate_is_reconciled_once(clock):
+    rate_limiter = RateLimiter(USER_CONFIGS, {"org": {"org-1": {"tpm": 10000}}})
+    bucket = lambda: rate_limiter.buckets[("org", "org-1", "tpm")]
+
+    # reconciled with the actual usage by the success callback, releasing it afterwards changes nothing
+    reservation = rate_limiter.check_request(USER_CONFIGS["sk-test"], estimated_tokens=500)
+    assert bucket().tokens == 9500
+    asyncio.run(rate_limiter.async_log_success_event(success_kwargs("user-1", 700, reservation), None, None, None))
+    assert bucket().tokens == 9300
+    rate_limiter.release(reservation)
+    assert bucket().tokens == 9300
+
+    # released first (the callback of a non-streaming litellm call runs in the background):
+    # the callback counts the whole usage
+    reservation = rate_limiter.check_request(USER_CONFIGS["sk-test"], estimated_tokens=500)
+    rate_limiter.release(reservation)
+    assert bucket().tokens == 9300
+    asyncio.run(rate_limiter.async_log_success_event(success_kwargs("user-1", 700, reservation), None, None, None))
+    assert bucket().tokens == 8600
+
+    # no success callback (cache hit, coalesced follower, failure): the estimate is given back
+    reservation = rate_limiter.check_request(USER_CONFIGS["sk-test"], estimated_tokens=500)
+    rate_limiter.release(reservation)
+    assert bucket().tokens == 8600
+    assert rate_limiter._reservations == {}
+
+
+def test_coalesced_follower_gets_its_estimate_back(clock):
+    snapshot = ConfigSnapshot({"llama": model_config("http://up", coalesce=True)}, USER_CONFIGS, {}, 1)
+    rate_limiter = RateLimiter(USER_CONFIGS, {"user": {"user-1": {"tpm": 10000}}})
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs["metadata"]["rate_limit_reservation"])
+        await asyncio.sleep(0.05)
+        return litellm.ModelResponse(model="upstream", choices=[{"message": {"role": "assistant", "content": "hi"}}])
+
+    async def request(route_handler: RouteHandler):
+        # like routes/chat.py: reserve, route, release once the response is complete
+        reservation = rate_limiter.check_request(USER_CONFIGS["sk-test"], estimated_tokens=500)
+        body = {"model": "llama", "messages": [{"role": "user", "content": "hello"}]}
+        await route_handler.chat_completion(body, "sk-test", snapshot, prompt_tokens=500)
+        rate_limiter.release(reservation)
+        return reservation
+
+    async def test():
+        route_handler = RouteHandler()
+        reservations = await asyncio.gather(request(route_handler), request(route_handler))
+        # the success callback of the one upstream call
+        await rate_limiter.async_log_success_event(success_kwargs("user-1", 700, calls[0]), None, None, None)
+        return reservations
+
+    with mock.patch.object(litellm, "acompletion", acompletion):
+        reservations = asyncio.run(test())
+    assert calls == [reservations[0]]
+    # only the usage of the upstream call is counted
+    assert rate_limiter.buckets[("user", "user-1", "tpm")].tokens == 10000 - 700
@@ -0,0 +1,131 @@
+import asyncio
+import types
+from unittest import mock
+import litellm
+import pytest
+import core.response_cache
+from core.response_cache import (CachedStream,
+                                 ResponseCache)
+from core.route_handler import RouteHandler
+from tests.test_route_handler import (USER_CONFIGS,
+                                      model_config)
+from utils.config_loader import ConfigSnapshot
+from utils.sse import chat_sse_stream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    # only the cache's clock, the event loop keeps the real one
+    monkeypatch.setattr(core.response_cache, "time", types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_chunks(texts: list) -> list:
+    return [litellm.ModelResponse(stream=True, id="chatcmpl-1", created=1, model="upstream",
+                                  choices=[{"index": 0, "delta": {"content": text}}]) for text in texts]
+
+
+async def upstream_stream(chunks: list, state: dict, fail_after: int = None):
+    try:
+        for i, chunk in enumerate(chunks):
+            if i == fail_after:
+                raise litellm.APIConnectionError("connection reset", "openai", "upstream")
+            yield chunk
+    finally:
+        state["closed"] = True
+
+
+def test_ttl_expiry(clock):
+    cache = ResponseCache(default_ttl=60)
+    cache.set("a", "llama", "response a")
+    cache.set("b", "llama", "response b", ttl=120)
+    clock.now += 61
+    assert cache.get("a", "llama") is None
+    assert cache.get("b", "llama") == "response b"
+    clock.now += 60
+    assert cache.get("b", "llama") is None
+    assert len(cache._entries) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_size=2)
+    cache.set("a", "llama", "response a")
+    cache.set("b", "llama", "response b")
+    # a is used again, b is the least recently used one now
+    assert cache.get("a", "llama") == "response a"
+    cache.set("c", "llama", "response c")
+    assert cache.get("b", "llama") is None
+    assert cache.get("a", "llama") == "response a"
+    assert cache.get("c", "llama") == "response c"
+
+
+def test_complete_stream_is_recorded_and_replayed():
+    cache = ResponseCache()
+    chunks = make_chunks(["Hel", "lo", "!"])
+    state = {}
+
+    async def test():
+        recorded = [chunk async for chunk in cache.record_stream(upstream_stream(chunks, state), "key", "llama")]
+        assert recorded == chunks
+        cached = cache.get("key", "llama")
+        assert isinstance(cached, CachedStream)
+        return [chunk async for chunk in cache.replay_stream(cached)]
+
+    assert asyncio.run(test()) == chunks
+    assert state["closed"]
+
+
+def test_aborted_or_failed_stream_is_not_cached():
+    cache = ResponseCache()
+    chunks = make_chunks(["Hel", "lo", "!"])
+
+    async def test():
+        # the client went away after the first chunk
+        state = {}
+        stream = cache.record_stream(upstream_stream(chunks, state), "aborted", "llama")
+        assert await stream.__anext__() == chunks[0]
+        await stream.aclose()
+        assert state["closed"]
+
+        # the upstream failed mid-stream
+        with pytest.raises(litellm.APIConnectionError):
+            async for _ in cache.record_stream(upstream_stream(chunks, {}, fail_after=2), "failed", "llama"):
+                pass
+
+    asyncio.run(test())
+    assert cache.get("aborted", "llama") is None
+    assert cache.get("failed", "llama") is None
+
+
+def test_replayed_stream_matches_the_original_frames():
+    snapshot = ConfigSnapshot({"llama": model_config("http://up", cache_params={"enabled": True, "stream": True})},
+                              USER_CONFIGS, {}, 1)
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return upstream_stream(make_chunks(["Hel", "lo", "!"]), {})
+
+    async def request(route_handler: RouteHandler) -> bytes:
+        body = {"model": "llama", "messages": [{"role": "user", "content": "hello"}], "stream": True}
+        response = await route_handler.chat_completion(body, "sk-test", snapshot)
+        return b"".join([frame async for frame in chat_sse_stream(response)])
+
+    async def test():
+        route_handler = RouteHandler()
+        return await request(route_handler), await request(route_handler)
+
+    with mock.patch.object(litellm, "acompletion", acompletion):
+        original, replayed = asyncio.run(test())
+    assert len(calls) == 1
+    assert original.count(b"data: ") == 4
+    assert replayed == original
@@ -0,0 +1,90 @@
+import asyncio
+from unittest import mock
+import litellm
+import pytest
+from fastapi import HTTPException
+from core.route_handler import RouteHandler
+from utils.config_loader import ConfigSnapshot
+
+
+USER_CONFIGS = {"sk-test": {"id": "user-1", "project": "project-1", "org": "org-1"}}
+
+
+def model_config(*api_bases: str, **gateway_params) -> dict:
+    deployments = [{"deployment_id": f"{api_base}/{i}", "model": "openai/upstream", "api_base": api_base}
+                   for i, api_base in enumerate(api_bases)]
+    return {"routing_strategy": "round_robin", "deployments": deployments, **gateway_params}
+
+
+def make_embedding_response(inputs: list) -> litellm.EmbeddingResponse:
+    return litellm.EmbeddingResponse(model="upstream", data=[
+        {"object": "embedding", "index": i, "embedding": [float(i)]} for i in range(len(inputs))
+    ])
+
+
+def test_batched_embeddings_retry_and_fall_back():
+    snapshot = ConfigSnapshot({
+        "bge": model_config("http://down", retry_policy={"max_retries": 1, "backoff": 0.01}, fallbacks=["bge-backup"],
+                            embedding_batching={"enabled": True, "max_batch_size": 8, "max_wait_ms": 5}),
+        "bge-backup": model_config("http://up"),
+    }, USER_CONFIGS, {}, 1)
+    calls = []
+
+    async def aembedding(**kwargs):
+        calls.append((kwargs["api_base"], list(kwargs["input"])))
+        if kwargs["api_base"] == "http://down":
+            raise litellm.ServiceUnavailableError("down", "openai", "upstream")
+        return make_embedding_response(kwargs["input"])
+
+    async def test():
+        route_handler = RouteHandler()
+        return await asyncio.gather(*(route_handler.embedding({"model": "bge", "input": f"text {i}"}, "sk-test", snapshot)
+                                      for i in range(3)))
+
+    with mock.patch.object(litellm, "aembedding", aembedding):
+        responses = asyncio.run(test())
+    inputs = ["text 0", "text 1", "text 2"]
+    # one merged call, retried once, then sent to the fallback
+    assert calls == [("http://down", inputs), ("http://down", inputs), ("http://up", inputs)]
+    assert [response.data[0]["embedding"] for response in responses] == [[0.0], [1.0], [2.0]]
+
+
+def test_coalescing_is_per_user():
+    snapshot = ConfigSnapshot({"llama": model_config("http://up", coalesce=True)},
+                              {**USER_CONFIGS, "sk-other": {"id": "user-2"}}, {}, 1)
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs["user"])
+        await asyncio.sleep(0.05)
+        return litellm.ModelResponse(model="upstream", choices=[{"message": {"role": "assistant", "content": "hi"}}])
+
+    async def test():
+        route_handler = RouteHandler()
+        body = {"model": "llama", "messages": [{"role": "user", "content": "hello"}]}
+        return await asyncio.gather(*(route_handler.chat_completion(dict(body), user_token, snapshot)
+                                      for user_token in ("sk-test", "sk-test", "sk-other")))
+
+    with mock.patch.object(litellm, "acompletion", acompletion):
+        responses = asyncio.run(test())
+    # the identical requests of user-1 share one call, user-2 gets its own so its usage is recorded
+    assert sorted(calls) == ["user-1", "user-2"]
+    assert len(responses) == 3
+
+
+def test_routing_errors_map_to_http_errors():
+    snapshot = ConfigSnapshot({"llama": model_config("http://up")}, USER_CONFIGS, {}, 1)
+
+    async def acompletion(**kwargs):
+        raise ValueError("unexpected upstream payload")
+
+    async def test(model):
+        await RouteHandler().chat_completion({"model": model, "messages": []}, "sk-test", snapshot)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(test("unknown"))
+    assert error.value.status_code == 400
+
+    with mock.patch.object(litellm, "acompletion", acompletion), pytest.raises(HTTPException) as error:
+        asyncio.run(test("llama"))
+    assert (error.value.status_code, error.value.detail) == (500, "unexpected upstream payload")
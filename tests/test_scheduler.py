@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from core.route_handler import RouteHandler
+from core.route_table import Deployment
+from core.scheduler import (AdmissionScheduler,
+                            SchedulerRejectedError)
+
+
+def make_deployment(**limits) -> Deployment:
+    return Deployment("llama/0", "llama", {"model": "openai/llama", "api_base": "http://up", **limits})
+
+
+async def dispatch_order(requests: list) -> list:
+    """Queue the requests (tenant, weight) behind a held slot and return the tenants in the order they are admitted."""
+    scheduler = AdmissionScheduler()
+    deployment = make_deployment(max_concurrency=1)
+    assert await scheduler.acquire(deployment, "holder")
+    order = []
+
+    async def request(tenant: str, weight: float):
+        await scheduler.acquire(deployment, tenant, weight)
+        order.append(tenant)
+
+    tasks = [asyncio.create_task(request(tenant, weight)) for tenant, weight in requests]
+    await asyncio.sleep(0.01)
+    for _ in requests:
+        # one request at a time: the admitted one finishes before the next slot is free
+        scheduler.release(deployment.deployment_id)
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_max_concurrency_admission():
+    async def test():
+        scheduler = AdmissionScheduler()
+        # no limit: nothing to release
+        assert await scheduler.acquire(make_deployment(), "project-1") is False
+
+        deployment = make_deployment(max_concurrency=2)
+        assert await scheduler.acquire(deployment, "project-1")
+        assert await scheduler.acquire(deployment, "project-1")
+        waiting = asyncio.create_task(scheduler.acquire(deployment, "project-1"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        queue = scheduler.queues[deployment.deployment_id]
+        assert (queue.in_flight, queue.queued) == (2, 1)
+
+        scheduler.release(deployment.deployment_id)
+        assert await asyncio.wait_for(waiting, timeout=1)
+        assert (queue.in_flight, queue.queued) == (2, 0)
+    asyncio.run(test())
+
+
+def test_full_queue_rejects():
+    async def test():
+        scheduler = AdmissionScheduler()
+        deployment = make_deployment(max_concurrency=1, max_queue_size=1)
+        await scheduler.acquire(deployment, "project-1")
+        waiting = asyncio.create_task(scheduler.acquire(deployment, "project-1"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(SchedulerRejectedError) as error:
+            await scheduler.acquire(deployment, "project-2")
+        assert error.value.reason == "queue_full"
+        scheduler.release(deployment.deployment_id)
+        assert await waiting
+    asyncio.run(test())
+
+
+def test_queue_timeout_rejects_and_frees_the_queue_slot():
+    async def test():
+        scheduler = AdmissionScheduler()
+        deployment = make_deployment(max_concurrency=1, max_queue_size=1, queue_timeout=0.05)
+        await scheduler.acquire(deployment, "project-1")
+        with pytest.raises(SchedulerRejectedError) as error:
+            await scheduler.acquire(deployment, "project-1")
+        assert error.value.reason == "queue_timeout"
+        queue = scheduler.queues[deployment.deployment_id]
+        assert (queue.in_flight, queue.queued, queue.waiters) == (1, 0, {})
+
+        # the slot goes to the next request, not to the one that gave up
+        waiting = asyncio.create_task(scheduler.acquire(deployment, "project-1"))
+        await asyncio.sleep(0.01)
+        scheduler.release(deployment.deployment_id)
+        assert await waiting
+        assert queue.in_flight == 1
+    asyncio.run(test())
+
+
+def test_tenants_take_turns():
+    # project-1 queued its burst first, project-2 is still served every other slot
+    requests = [("project-1", 1.0)] * 6 + [("project-2", 1.0)] * 2
+    order = asyncio.run(dispatch_order(requests))
+    assert order == ["project-1", "project-2", "project-1", "project-2"] + ["project-1"] * 4
+
+
+def test_slots_are_shared_by_weight():
+    requests = [("project-1", 3.0)] * 4 + [("project-2", 1.0)] * 4
+    order = asyncio.run(dispatch_order(requests))
+    assert order == ["project-1", "project-2", "project-1", "project-1", "project-1",
+                     "project-2", "project-2", "project-2"]
+
+
+def test_batch_requests_yield_to_interactive_ones():
+    route_handler = RouteHandler()
+    user_configs = {"sk-test": {"id": "user-1", "project": "project-1"}}
+    interactive = route_handler._process_tenant("sk-test", user_configs, {})
+    batch = route_handler._process_tenant("sk-test", user_configs, {}, batch=True)
+    assert interactive == ("project-1", 1.0)
+    assert batch[0] == "project-1/batch" and batch[1] < interactive[1]
+
+    # batch requests queued first still leave most slots to the interactive ones of the same project
+    order = asyncio.run(dispatch_order([batch] * 3 + [interactive] * 10))
+    assert order[:11].count("project-1/batch") == 1
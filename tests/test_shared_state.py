@@ -0,0 +1,165 @@
+import asyncio
+import multiprocessing
+import time
+import pytest
+from core.shared_state import (RedisState,
+                               SharedMemoryState,
+                               SharedState,
+                               SharedStateError)
+from tests.resp_server import FakeRedisServer
+
+
+def run_with_server(test, password=None):
+    async def main():
+        server = FakeRedisServer(password=password)
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+
+def test_redis_incr_many_and_get_many():
+    async def test(server):
+        state = RedisState(f"redis://127.0.0.1:{server.port}/2")
+        totals = await state.incr_many({"a": 1.5, "b": 2}, ttl=60)
+        assert totals == {"a": 1.5, "b": 2.0}
+        # pipelined calls, the replies are matched to their calls in order
+        results = await asyncio.gather(*(state.incr_many({"a": 1, "c": 1}) for _ in range(20)))
+        assert sorted(result["a"] for result in results) == [2.5 + i for i in range(20)]
+        assert await state.get_many(["a", "b", "missing"]) == {"a": b"21.5", "b": b"2.0", "missing": None}
+        await state.set("value", b"\x00bytes\r\n")
+        assert await state.get("value") == b"\x00bytes\r\n"
+        await state.delete("value")
+        assert await state.get("value") is None
+        assert ("SELECT", b"2") in server.commands
+        await state.aclose()
+    run_with_server(test)
+
+
+def test_redis_ttl_expiry():
+    async def test(server):
+        state = RedisState(f"redis://127.0.0.1:{server.port}/0")
+        await state.incr_many({"counter": 5}, ttl=0.05)
+        await state.set("value", b"v", ttl=0.05)
+        await asyncio.sleep(0.1)
+        assert await state.get_many(["counter", "value"]) == {"counter": None, "value": None}
+        assert await state.incr("counter", 1, ttl=60) == 1.0
+        await state.aclose()
+    run_with_server(test)
+
+
+def test_redis_auth():
+    async def test(server):
+        state = RedisState(f"redis://:secret@127.0.0.1:{server.port}/0")
+        assert await state.incr("a", 1) == 1.0
+        await state.aclose()
+
+        state = RedisState(f"redis://:wrong@127.0.0.1:{server.port}/0")
+        for _ in range(2):
+            # the failed connection is not reused unauthenticated
+            with pytest.raises(SharedStateError, match="WRONGPASS"):
+                await state.incr("a", 1)
+        await state.aclose()
+    run_with_server(test, password="secret")
+
+
+def test_redis_reconnect():
+    async def test(server):
+        state = RedisState(f"redis://127.0.0.1:{server.port}/0")
+        assert await state.incr("a", 1) == 1.0
+
+        # connection dropped by the server between two calls
+        server.drop_connections()
+        await asyncio.sleep(0.05)
+        assert await state.incr("a", 1) == 2.0
+
+        # server down: calls fail instead of waiting, and succeed once it is back
+        port = server.port
+        await server.stop()
+        await asyncio.sleep(0.05)
+        with pytest.raises(SharedStateError):
+            await state.incr("a", 1)
+        await server.start(port)
+        assert await state.incr("a", 1) == 3.0
+        await state.aclose()
+    run_with_server(test)
+
+
+def test_shm_probing_tombstones_and_eviction(tmp_path):
+    async def test():
+        # every key collides on a table this small
+        state = SharedMemoryState(str(tmp_path / "state"), slots=4, max_probes=4)
+        for i in range(4):
+            await state.incr(f"key-{i}", i + 1, ttl=60 + i)
+        await state.delete("key-1")
+        # the tombstone of key-1 does not end the probe sequence of the other keys
+        assert await state.get_many([f"key-{i}" for i in range(4)]) == {
+            "key-0": b"1.0", "key-1": None, "key-2": b"3.0", "key-3": b"4.0",
+        }
+        # and is reused
+        await state.set("key-4", b"value", ttl=60)
+        assert await state.get("key-4") == b"value"
+        assert await state.get("key-3") == b"4.0"
+
+        # full table: the entry expiring first is evicted
+        await state.incr("key-5", 6, ttl=120)
+        assert await state.get("key-0") is None
+        assert await state.get_many(["key-2", "key-3", "key-4", "key-5"]) == {
+            "key-2": b"3.0", "key-3": b"4.0", "key-4": b"value", "key-5": b"6.0",
+        }
+        await state.aclose()
+    asyncio.run(test())
+
+
+def test_shm_ttl_expiry(tmp_path):
+    async def test():
+        state = SharedMemoryState(str(tmp_path / "state"), slots=4, max_probes=4)
+        await state.incr("counter", 5, ttl=0.05)
+        await state.set("value", b"v", ttl=0.05)
+        await state.incr("kept", 1)
+        await asyncio.sleep(0.1)
+        assert await state.get_many(["counter", "value", "kept"]) == {"counter": None, "value": None, "kept": b"1.0"}
+        # an expired counter starts over
+        assert await state.incr("counter", 1, ttl=60) == 1.0
+        await state.aclose()
+    asyncio.run(test())
+
+
+def increment_shared_memory(path: str, increments: int) -> None:
+    async def increment():
+        state = SharedMemoryState(path, slots=64)
+        for _ in range(increments):
+            await state.incr_many({"shared": 1, "other": 0.5}, ttl=60)
+        await state.aclose()
+    asyncio.run(increment())
+
+
+def test_shm_shared_by_processes(tmp_path):
+    path = str(tmp_path / "state")
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=increment_shared_memory, args=(path, 500)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    async def check():
+        state = SharedMemoryState(path, slots=64)
+        assert await state.get_many(["shared", "other"]) == {"shared": b"1000.0", "other": b"500.0"}
+        await state.aclose()
+    asyncio.run(check())
+
+
+def test_incomplete_backend_fails_on_construction():
+    class CountersOnlyState(SharedState):
+        async def incr_many(self, increments, ttl=None):
+            return {}
+
+        async def get_many(self, keys):
+            return {}
+
+    with pytest.raises(TypeError, match="delete"):
+        CountersOnlyState()
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from utils.sse import (SSE_DONE,
+                       SSEStreamingResponse,
+                       count_completion_chunks)
+
+
+def event(data: dict) -> bytes:
+    return b"data: " + json.dumps(data, separators=(",", ":")).encode() + b"\n\n"
+
+
+def test_count_completion_chunks():
+    content = event({"choices": [{"index": 0, "delta": {"content": "data: not an event"}}]})
+    usage = event({"choices": [], "usage": {"total_tokens": 3}})
+    assert count_completion_chunks(content) == 1
+    # several events in one write (passthrough), the usage chunk and [DONE] are not completion chunks
+    assert count_completion_chunks(content * 2 + usage + SSE_DONE) == 2
+    assert count_completion_chunks(b": keep-alive comment\n\n") == 0
+
+
+def test_client_disconnect_mid_stream_stops_the_upstream():
+    chunk = event({"choices": [{"index": 0, "delta": {"content": "hi"}}]})
+    state = {"closed": False, "disconnected_after": None, "on_close": 0}
+    sent = []
+
+    async def upstream():
+        try:
+            while True:
+                yield chunk
+                await asyncio.sleep(0.01)
+        finally:
+            state["closed"] = True
+
+    async def test():
+        client_gone = asyncio.Event()
+
+        async def receive():
+            await client_gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                sent.append(message["body"])
+                if len(sent) == 3:
+                    client_gone.set()
+
+        def on_close():
+            state["on_close"] += 1
+
+        def on_disconnect(chunks_sent):
+            state["disconnected_after"] = chunks_sent
+
+        response = SSEStreamingResponse(upstream(), on_disconnect=on_disconnect, on_close=on_close)
+        await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=5)
+
+    asyncio.run(test())
+    # the generation stopped with the client instead of running to its end
+    assert state["closed"]
+    assert state["disconnected_after"] == len(sent) >= 3
+    assert state["on_close"] == 1
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from tokenizers import (Tokenizer,
+                        models,
+                        pre_tokenizers)
+from core.route_table import ModelRoute
+from core.token_counter import (ContextWindowExceededError,
+                                TokenCounter)
+
+
+def make_route(**gateway_params) -> ModelRoute:
+    return ModelRoute("llama", {"deployments": [], **gateway_params})
+
+
+def fit(token_counter: TokenCounter, call_type: str, model_route: ModelRoute, req_body: dict) -> tuple:
+    return asyncio.run(token_counter.fit_context_window(call_type, model_route, req_body))
+
+
+def test_bytes_per_token_fallback():
+    token_counter = TokenCounter()
+    # 4 bytes of UTF-8 per token, rounded up
+    assert fit(token_counter, "completion", make_route(), {"prompt": "a" * 10}) == ({"prompt": "a" * 10}, 3)
+    assert fit(token_counter, "completion", make_route(), {"prompt": "é" * 4})[1] == 2
+    # several prompts, and prompts given as token ids
+    assert fit(token_counter, "completion", make_route(), {"prompt": ["abcd", [1, 2, 3]]})[1] == 4
+    assert fit(token_counter, "completion", make_route(), {"prompt": [1, 2, 3]})[1] == 3
+    # chat: joined texts plus the chat template overhead of 2 messages
+    messages = [{"role": "system", "content": "abcd"}, {"role": "user", "content": "efgh"}]
+    assert fit(token_counter, "chat_completion", make_route(), {"messages": messages})[1] == 3 + 2 * 4 + 3
+
+
+def test_max_tokens_is_clamped_to_the_room_left():
+    token_counter = TokenCounter()
+    model_route = make_route(max_context=100)
+    req_body = {"prompt": "a" * 160, "max_tokens": 80}
+    send_body, prompt_tokens = fit(token_counter, "completion", model_route, req_body)
+    assert (send_body["max_tokens"], prompt_tokens) == (60, 40)
+    # the client's body is left as is
+    assert req_body["max_tokens"] == 80
+    # a fitting max_tokens, or max_completion_tokens, is kept
+    assert fit(token_counter, "completion", model_route, {"prompt": "a" * 160, "max_tokens": 60})[0]["max_tokens"] == 60
+    send_body, _ = fit(token_counter, "completion", model_route, {"prompt": "a" * 160, "max_completion_tokens": 90})
+    assert send_body == {"prompt": "a" * 160, "max_completion_tokens": 60}
+
+
+def test_requests_that_do_not_fit_are_rejected():
+    token_counter = TokenCounter()
+    # the prompt alone fills the context window
+    with pytest.raises(ContextWindowExceededError) as error:
+        fit(token_counter, "completion", make_route(max_context=100), {"prompt": "a" * 400})
+    assert (error.value.prompt_tokens, error.value.max_context) == (100, 100)
+
+    # without clamping, max_tokens must fit too
+    model_route = make_route(max_context=100, clamp_max_tokens=False)
+    with pytest.raises(ContextWindowExceededError, match="max_tokens"):
+        fit(token_counter, "completion", model_route, {"prompt": "a" * 160, "max_tokens": 80})
+    assert fit(token_counter, "completion", model_route, {"prompt": "a" * 160, "max_tokens": 60})[1] == 40
+
+
+def test_model_tokenizer_is_loaded_once(tmp_path):
+    vocab = {"[UNK]": 0, "hello": 1, "world": 2}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    (tmp_path / "llama").mkdir()
+    tokenizer.save(str(tmp_path / "llama" / "tokenizer.json"))
+
+    token_counter = TokenCounter(tokenizer_dir=str(tmp_path))
+    model_route = make_route(tokenizer="llama", max_context=10)
+
+    async def test():
+        return await asyncio.gather(*(token_counter.fit_context_window("completion", model_route,
+                                                                       {"prompt": "hello world hello", "max_tokens": 9})
+                                      for _ in range(5)))
+
+    assert asyncio.run(test()) == [({"prompt": "hello world hello", "max_tokens": 7}, 3)] * 5
+    assert len(token_counter._tokenizers) == 1
+
+    # a tokenizer that fails to load falls back to the estimate
+    broken_route = make_route(tokenizer="missing")
+    assert fit(token_counter, "completion", broken_route, {"prompt": "hello world hello"})[1] == 5
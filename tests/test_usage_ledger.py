@@ -0,0 +1,48 @@
+import asyncio
+import litellm
+from core.passthrough import PassthroughHandler
+from core.route_handler import RouteHandler
+from integrations.usage_ledger import UsageLedger
+from tests.test_passthrough import (FakeConnectionPools,
+                                    upstream)
+from utils.config_loader import ConfigSnapshot
+
+
+USER_CONFIGS = {"sk-test": {"id": "user-1", "project": "project-1", "org": "org-1"}}
+
+
+def model_config(upstream_model: str, **gateway_params) -> dict:
+    deployment = {"deployment_id": "llama/0", "model": upstream_model, "api_base": "http://upstream/v1"}
+    return {"routing_strategy": "round_robin", "deployments": [deployment], **gateway_params}
+
+
+def test_usage_is_recorded_under_the_gateway_model_name(tmp_path):
+    # one gateway model name, served through litellm or passthrough with different upstream names
+    litellm_snapshot = ConfigSnapshot({"llama": model_config("openai/upstream-llama")}, USER_CONFIGS, {}, 1)
+    passthrough_snapshot = ConfigSnapshot({"llama": model_config("hosted_vllm/upstream-llama-raw", passthrough=True)},
+                                          USER_CONFIGS, {}, 2)
+    ledger = UsageLedger(USER_CONFIGS, db_path=str(tmp_path / "usage.db"))
+
+    async def test():
+        route_handler = RouteHandler()
+        route_handler.passthrough_handler = PassthroughHandler(FakeConnectionPools(upstream))
+        messages = [{"role": "user", "content": "hello"}]
+        await route_handler.chat_completion({"model": "llama", "messages": messages, "mock_response": "hi"},
+                                            "sk-test", litellm_snapshot)
+        await route_handler.chat_completion({"model": "llama", "messages": messages}, "sk-test", passthrough_snapshot)
+        # reported by the routes like this
+        ledger.log_failure_event({"model": "llama", "user_token": "sk-test"}, 503, 0.0, 1.0)
+        # the litellm success callbacks run in the background
+        for _ in range(50):
+            if len(ledger._pending) == 3:
+                break
+            await asyncio.sleep(0.05)
+        return await ledger.get_usage(["model"])
+
+    try:
+        litellm.callbacks = [ledger]
+        usage = asyncio.run(test())
+    finally:
+        litellm.callbacks = []
+        ledger.close()
+    assert [(row["model"], row["requests"], row["failed_requests"]) for row in usage] == [("llama", 3, 1)]
@@ -1,18 +1,153 @@
-import yaml
-from functools import lru_cache
+import asyncio
+import os
+import time
+from types import MappingProxyType
+from typing import (Any, Callable, List, Optional)
 from utils.model_config import ModelConfig
 from utils.user_config import UserConfig
+from core.connection_pool import OPENAI_COMPATIBLE_PROVIDERS
+from core.load_balancer import ROUTING_STRATEGIES
+from core.route_table import RouteTable
+
+ROUTING_CONFIG_PATH = "config/routing_configs.yaml"
+USER_CONFIG_PATH = "config/user_configs.yaml"
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class ConfigSnapshot:
+    """
+    Immutable view of every config file. A request keeps the snapshot it
+    started with, so a reload never changes the configs under its feet.
+    """
+    __slots__ = ("routing_configs", "route_table", "user_configs", "tenant_configs", "version", "loaded_at")
+
+    def __init__(self, routing_configs: dict, user_configs: dict, tenant_configs: dict, version: int):
+        self.routing_configs = _freeze(routing_configs)
+        # routing configs compiled for the request path
+        self.route_table = RouteTable(self.routing_configs)
+        self.user_configs = _freeze(user_configs)
+        self.tenant_configs = _freeze(tenant_configs)
+        self.version = version
+        self.loaded_at = time.time()
+
 
 class ConfigLoader:
-    @lru_cache()
-    def load_configs(self):
-        """Load all necessary configurations from files."""
+    def __init__(self, routing_config_path: str = ROUTING_CONFIG_PATH, user_config_path: str = USER_CONFIG_PATH):
+        self.routing_config_path = routing_config_path
+        self.user_config_path = user_config_path
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._reload_listeners: List[Callable[[ConfigSnapshot], None]] = []
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self._config_mtimes: Optional[tuple] = None
+
+
+    def _build_snapshot(self, version: int) -> ConfigSnapshot:
+        """Parse and validate the config files. Runs off the event loop on reloads."""
+        config_mtimes = self._get_config_mtimes()
+
         mc = ModelConfig()
-        routing_configs = mc.load_config("config/routing_configs.yaml")
+        routing_configs = mc.load_config(self.routing_config_path)
 
         uc = UserConfig()
-        user_configs = uc.load_config("config/user_configs.yaml")
+        user_configs = uc.load_config(self.user_config_path)
+        tenant_configs = uc.load_tenant_configs(self.user_config_path)
+
+        self._validate(routing_configs, user_configs)
+        self._config_mtimes = config_mtimes
+        return ConfigSnapshot(routing_configs, user_configs, tenant_configs, version)
+
+
+    def _validate(self, routing_configs: dict, user_configs: dict) -> None:
+        for model_name, model_route_config in routing_configs.items():
+            if model_route_config.get("routing_strategy") not in ROUTING_STRATEGIES:
+                raise ValueError(f"Unknown routing_strategy of model {model_name}: {model_route_config.get('routing_strategy')}")
+            for deployment in model_route_config.get("deployments", []):
+                if not deployment.get("model"):
+                    raise ValueError(f"litellm_params.model is required for model {model_name}")
+                if model_route_config.get("passthrough") and (
+                        deployment["model"].split('/')[0] not in OPENAI_COMPATIBLE_PROVIDERS or not deployment.get("api_base")):
+                    raise ValueError(f"passthrough of model {model_name} requires openai compatible deployments with an api_base")
+
+        for user_profile in user_configs.values():
+            if not isinstance(user_profile, dict) or "id" not in user_profile:
+                raise ValueError("Every user_profile requires an id")
+
+
+    def _get_config_mtimes(self) -> tuple:
+        return tuple(
+            os.path.getmtime(path) if os.path.exists(path) else None
+            for path in (self.routing_config_path, self.user_config_path)
+        )
+
+
+    def get_snapshot(self) -> ConfigSnapshot:
+        if self._snapshot is None:
+            self._snapshot = self._build_snapshot(version=1)
+        return self._snapshot
+
+
+    def load_configs(self):
+        """Return the routing and user configs of the current snapshot."""
+        snapshot = self.get_snapshot()
+        return snapshot.routing_configs, snapshot.user_configs
+
+
+    def load_tenant_configs(self):
+        """Load the rate limits and scheduling weights of users, projects and orgs."""
+        return self.get_snapshot().tenant_configs
+
+
+    def add_reload_listener(self, listener: Callable[[ConfigSnapshot], None]) -> None:
+        """Register a callback that receives every newly swapped in snapshot."""
+        self._reload_listeners.append(listener)
+
+
+    async def reload(self) -> ConfigSnapshot:
+        """
+        Parse and validate the config files in a worker thread and atomically
+        swap in the new snapshot. The current snapshot is kept if they are invalid.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            version = self.get_snapshot().version + 1
+            snapshot = await asyncio.to_thread(self._build_snapshot, version)
+            self._snapshot = snapshot
+
+            for listener in self._reload_listeners:
+                try:
+                    listener(snapshot)
+                except Exception as e:
+                    print(f"Error in config reload listener: {e}")
+
+            print(f"Configs reloaded, version {snapshot.version}")
+            return snapshot
+
+
+    async def watch(self, interval: float) -> None:
+        """Reload the configs whenever one of the config files changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                config_mtimes = await asyncio.to_thread(self._get_config_mtimes)
+                if config_mtimes != self._config_mtimes:
+                    # do not retry a broken file on every tick, only on its next change
+                    self._config_mtimes = config_mtimes
+                    await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # keep serving with the current snapshot
+                print(f"Config reload failed: {e}")
 
-        return routing_configs, user_configs
 
 config_loader = ConfigLoader()
@@ -2,6 +2,31 @@ from typing import (Optional, Any, Dict)
 import yaml
 import os
 
+# Per-model options of a model_list entry that configure the gateway itself
+GATEWAY_PARAMS = (
+    "cache_params",
+    "coalesce",
+    "routing_strategy",
+    "passthrough",
+    "hedging",
+    "embedding_batching",
+    "max_context",
+    "tokenizer",
+    "clamp_max_tokens",
+    "retry_policy",
+    "fallbacks",
+)
+
+
+def get_model_name(kwargs: dict) -> Optional[str]:
+    """
+    Gateway model name of a callback event. Routed calls carry it in their
+    metadata (litellm reports the upstream model as `model`), the failures
+    reported by the routes as `model`.
+    """
+    metadata = (kwargs.get("litellm_params") or {}).get("metadata") or {}
+    return metadata.get("model_name") or kwargs.get("model")
+
 class ModelConfig:
     def __init__(self) -> None:
         self.config: Dict[str, Any] = {}
@@ -75,10 +100,32 @@ class ModelConfig:
         config: dict = self.get_config(config_file_path=config_file_path)
 
         routing_configs = {}
+        router_settings = config.get("router_settings") or {}
         model_list = config.get("model_list", None)
         if model_list:
             for model in model_list:
-                routing_configs[model['model_name']] = model['litellm_params']
+                # entries sharing a model_name form a pool of deployments
+                llm_route_config = routing_configs.setdefault(model['model_name'], {
+                    "deployments": [],
+                    "routing_strategy": router_settings.get("routing_strategy", "round_robin"),
+                    "retry_policy": router_settings.get("retry_policy") or {},
+                })
+                deployment = dict(model['litellm_params'])
+                # connection pool settings of the deployment override the ones of router_settings
+                pool_defaults = router_settings.get("connection_pool")
+                if pool_defaults:
+                    deployment['connection_pool'] = {**pool_defaults, **(deployment.get('connection_pool') or {})}
+                deployment['deployment_id'] = f"{model['model_name']}/{len(llm_route_config['deployments'])}"
+                llm_route_config['deployments'].append(deployment)
+
+                # gateway side options of the model (not forwarded to litellm)
+                for gateway_param in GATEWAY_PARAMS:
+                    if gateway_param in model:
+                        llm_route_config[gateway_param] = model[gateway_param]
+                # retry settings of the model override the ones of router_settings
+                if model.get("retry_policy"):
+                    llm_route_config["retry_policy"] = {**(router_settings.get("retry_policy") or {}),
+                                                        **model["retry_policy"]}
         routing_configs = self._check_for_os_environ_vars(routing_configs)
         
         return routing_configs
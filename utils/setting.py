@@ -6,5 +6,70 @@ load_dotenv()
 class Settings:
     MASTER_TOKEN: str = os.getenv("EZLLM_GATEWAY_MASTER_TOKEN", "sk-ezllm-master-token")
     PORT: int = int(os.getenv("PORT", 8080))
+    # uvicorn worker processes; with more than one the metrics are aggregated through PROMETHEUS_MULTIPROC_DIR
+    WORKERS: int = int(os.getenv("EZLLM_WORKERS", 1))
+    PROMETHEUS_MULTIPROC_DIR: str = os.getenv("PROMETHEUS_MULTIPROC_DIR", "data/prometheus")
+    RESPONSE_CACHE_MAX_SIZE: int = int(os.getenv("EZLLM_RESPONSE_CACHE_MAX_SIZE", 1024))
+    RESPONSE_CACHE_TTL: int = int(os.getenv("EZLLM_RESPONSE_CACHE_TTL", 300))
+    RESPONSE_CACHE_MAX_STREAM_CHUNKS: int = int(os.getenv("EZLLM_RESPONSE_CACHE_MAX_STREAM_CHUNKS", 4096))
+    BREAKER_FAILURE_RATE_THRESHOLD: float = float(os.getenv("EZLLM_BREAKER_FAILURE_RATE_THRESHOLD", 0.5))
+    BREAKER_CONSECUTIVE_FAILURES: int = int(os.getenv("EZLLM_BREAKER_CONSECUTIVE_FAILURES", 5))
+    BREAKER_BASE_EJECTION_TIME: float = float(os.getenv("EZLLM_BREAKER_BASE_EJECTION_TIME", 30))
+    BREAKER_MAX_EJECTION_TIME: float = float(os.getenv("EZLLM_BREAKER_MAX_EJECTION_TIME", 300))
+    BREAKER_HALF_OPEN_MAX_REQUESTS: int = int(os.getenv("EZLLM_BREAKER_HALF_OPEN_MAX_REQUESTS", 1))
+    SCHEDULER_MAX_QUEUE_SIZE: int = int(os.getenv("EZLLM_SCHEDULER_MAX_QUEUE_SIZE", 256))
+    SCHEDULER_QUEUE_TIMEOUT: float = float(os.getenv("EZLLM_SCHEDULER_QUEUE_TIMEOUT", 30))
+    # "project" or "org": tenants that share queued backend capacity fairly
+    SCHEDULER_FAIRNESS_LEVEL: str = os.getenv("EZLLM_SCHEDULER_FAIRNESS_LEVEL", "project")
+    # prompt tokens that weigh as much as the request itself when queued requests are scheduled
+    SCHEDULER_REQUEST_TOKENS: int = int(os.getenv("EZLLM_SCHEDULER_REQUEST_TOKENS", 1000))
+    # directory the `tokenizer` paths of routing_configs.yaml are relative to
+    TOKENIZER_DIR: str = os.getenv("EZLLM_TOKENIZER_DIR", "tokenizers")
+    # retries and fallbacks across all models: share of the requests, and floor per second for low traffic
+    RETRY_BUDGET_RATIO: float = float(os.getenv("EZLLM_RETRY_BUDGET_RATIO", 0.2))
+    RETRY_BUDGET_MIN_PER_SECOND: float = float(os.getenv("EZLLM_RETRY_BUDGET_MIN_PER_SECOND", 1))
+    # seconds before expiry at which Azure AD tokens in use are refreshed in the background
+    AZURE_TOKEN_REFRESH_MARGIN: float = float(os.getenv("EZLLM_AZURE_TOKEN_REFRESH_MARGIN", 300))
+    # seconds between checks of the config files for changes, 0 disables the watcher
+    CONFIG_WATCH_INTERVAL: float = float(os.getenv("EZLLM_CONFIG_WATCH_INTERVAL", 5))
+    # defaults of the upstream connection pools, see connection_pool in routing_configs.yaml
+    POOL_MAX_CONNECTIONS: int = int(os.getenv("EZLLM_POOL_MAX_CONNECTIONS", 100))
+    POOL_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("EZLLM_POOL_MAX_KEEPALIVE_CONNECTIONS", 20))
+    POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("EZLLM_POOL_KEEPALIVE_EXPIRY", 30))
+    POOL_HTTP2: bool = os.getenv("EZLLM_POOL_HTTP2", "false").lower() == "true"
+    POOL_CONNECT_TIMEOUT: float = float(os.getenv("EZLLM_POOL_CONNECT_TIMEOUT", 5))
+    POOL_READ_TIMEOUT: float = float(os.getenv("EZLLM_POOL_READ_TIMEOUT", 600))
+    # TLS verification of the backend LLM APIs is off unless enabled
+    POOL_VERIFY: bool = os.getenv("EZLLM_POOL_VERIFY", "false").lower() == "true"
+    # recent requests per model the hedging percentile is computed from, and the samples needed first
+    HEDGE_LATENCY_WINDOW: int = int(os.getenv("EZLLM_HEDGE_LATENCY_WINDOW", 256))
+    HEDGE_MIN_SAMPLES: int = int(os.getenv("EZLLM_HEDGE_MIN_SAMPLES", 20))
+    # directory of the uploaded files, results and state of the batch API
+    BATCH_STORAGE_DIR: str = os.getenv("EZLLM_BATCH_STORAGE_DIR", "data/batches")
+    # batch requests in flight per model, across all batches
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("EZLLM_BATCH_MAX_CONCURRENCY", 8))
+    BATCH_MAX_RETRIES: int = int(os.getenv("EZLLM_BATCH_MAX_RETRIES", 3))
+    BATCH_RETRY_BACKOFF: float = float(os.getenv("EZLLM_BATCH_RETRY_BACKOFF", 1))
+    # scheduling weight of batch requests relative to the interactive requests of the same tenant
+    BATCH_SCHEDULING_WEIGHT: float = float(os.getenv("EZLLM_BATCH_SCHEDULING_WEIGHT", 0.1))
+    # default inputs per upstream call and collection window of embedding micro-batching
+    EMBEDDING_BATCH_MAX_SIZE: int = int(os.getenv("EZLLM_EMBEDDING_BATCH_MAX_SIZE", 64))
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = float(os.getenv("EZLLM_EMBEDDING_BATCH_MAX_WAIT_MS", 5))
+    # seconds the per request metrics are queued before they are applied to the prometheus metrics
+    METRICS_FLUSH_INTERVAL: float = float(os.getenv("EZLLM_METRICS_FLUSH_INTERVAL", 0.5))
+    # SQLite file of the per request usage ledger, and the seconds between its batched writes
+    USAGE_LEDGER_PATH: str = os.getenv("EZLLM_USAGE_LEDGER_PATH", "data/usage.db")
+    USAGE_LEDGER_FLUSH_INTERVAL: float = float(os.getenv("EZLLM_USAGE_LEDGER_FLUSH_INTERVAL", 1))
+    # state shared by the workers (rate limits, breaker ejections): local | shm | redis
+    SHARED_STATE_BACKEND: str = os.getenv("EZLLM_SHARED_STATE_BACKEND", "local")
+    SHARED_STATE_URL: str = os.getenv("EZLLM_SHARED_STATE_URL", "redis://localhost:6379/0")
+    SHARED_STATE_SHM_PATH: str = os.getenv("EZLLM_SHARED_STATE_SHM_PATH", "/dev/shm/ezllm-gateway-state")
+    # seconds between two syncs of the local state with the shared backend
+    SHARED_STATE_SYNC_INTERVAL: float = float(os.getenv("EZLLM_SHARED_STATE_SYNC_INTERVAL", 0.2))
+    # per request phase timings sent to the clients in the Server-Timing response header
+    SERVER_TIMING: bool = os.getenv("EZLLM_SERVER_TIMING", "true").lower() == "true"
+    # OTLP/HTTP traces endpoint (e.g. http://localhost:4318/v1/traces) the request spans are exported to, empty disables it
+    TRACING_OTLP_ENDPOINT: str = os.getenv("EZLLM_TRACING_OTLP_ENDPOINT", "")
+    TRACING_FLUSH_INTERVAL: float = float(os.getenv("EZLLM_TRACING_FLUSH_INTERVAL", 1))
 
 settings = Settings()
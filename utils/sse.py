@@ -0,0 +1,121 @@
+from typing import (AbstractSet, AsyncIterator, Callable, Optional)
+import inspect
+from starlette.responses import StreamingResponse
+from starlette.types import (Receive, Scope, Send)
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+# final chunk of streams with `stream_options.include_usage`, it carries no completion
+USAGE_CHUNK_CHOICES = b'"choices":[]'
+
+# litellm only fields of chat completion chunks, not part of the OpenAI schema
+CHAT_CHUNK_EXCLUDE = frozenset({"stream_options", "citations"})
+
+# fields of an OpenAI text completion chunk (see utils.openai.Completion)
+COMPLETION_CHUNK_INCLUDE = frozenset({"id", "object", "created", "model", "choices", "usage", "system_fingerprint"})
+
+
+def encode_sse_chunk(chunk, include: Optional[AbstractSet[str]] = None,
+                     exclude: Optional[AbstractSet[str]] = None) -> bytes:
+    """
+    Serialize a litellm stream chunk into a framed `data:` SSE event. The
+    chunk is dumped straight to JSON bytes by pydantic-core, without
+    building an intermediate dict.
+    """
+    data = chunk.__pydantic_serializer__.to_json(chunk, include=include, exclude=exclude, warnings=False)
+    return b"data: " + data + b"\n\n"
+
+
+async def close_stream(stream) -> None:
+    """
+    Close a stream of chunks and the upstream connection it reads from. Async
+    generators are closed with aclose(), litellm stream wrappers through the
+    completion stream they wrap.
+    """
+    close = getattr(stream, "aclose", None)
+    if close is None:
+        completion_stream = getattr(stream, "completion_stream", None)
+        close = getattr(completion_stream, "aclose", None) or getattr(completion_stream, "close", None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+async def sse_stream(response: AsyncIterator, include: Optional[AbstractSet[str]] = None,
+                     exclude: Optional[AbstractSet[str]] = None) -> AsyncIterator[bytes]:
+    """Frame every chunk of a litellm stream as SSE and end it with [DONE]."""
+    try:
+        async for chunk in response:
+            yield encode_sse_chunk(chunk, include=include, exclude=exclude)
+        yield SSE_DONE
+    finally:
+        await close_stream(response)
+
+
+def count_completion_chunks(data: bytes) -> int:
+    """
+    Count the completion chunks framed in SSE bytes (complete events): every
+    `data:` event except the usage-only chunk and [DONE].
+    """
+    count = 0
+    for event in data.split(b"\n\n"):
+        # quotes inside the completion text are escaped, so the usage marker only matches the chunk itself
+        if event.startswith(b"data:") and event != SSE_DONE[:-2] and USAGE_CHUNK_CHOICES not in event:
+            count += 1
+    return count
+
+
+def chat_sse_stream(response: AsyncIterator) -> AsyncIterator[bytes]:
+    return sse_stream(response, exclude=CHAT_CHUNK_EXCLUDE)
+
+
+def completion_sse_stream(response: AsyncIterator) -> AsyncIterator[bytes]:
+    return sse_stream(response, include=COMPLETION_CHUNK_INCLUDE)
+
+
+class SSEStreamingResponse(StreamingResponse):
+    """
+    SSE response that closes its stream, and with it the upstream generation,
+    as soon as the client disconnects instead of when the stream is garbage
+    collected. `on_disconnect` receives the number of completion chunks sent
+    until then, `on_close` is called once the stream ended either way.
+    """
+    media_type = "text/event-stream"
+
+    def __init__(self, content, on_disconnect: Optional[Callable[[int], None]] = None,
+                 on_close: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_disconnect = on_disconnect
+        self.on_close = on_close
+        self.chunks_sent = 0
+        self.disconnected = False
+
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        await super().listen_for_disconnect(receive)
+        # only reached when the client went away before the stream ended
+        self.disconnected = True
+
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, (bytes, memoryview)):
+                chunk = chunk.encode(self.charset)
+            # one chunk may carry several events (passthrough)
+            self.chunks_sent += count_completion_chunks(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await close_stream(self.body_iterator)
+            if self.on_close is not None:
+                self.on_close()
+
+        if self.disconnected and self.on_disconnect is not None:
+            self.on_disconnect(self.chunks_sent)
@@ -46,3 +46,31 @@ class UserConfig:
             for user in user_list:
                 user_configs[user['user_token']] = user['user_profile']
         return user_configs
+
+
+    def load_tenant_configs(self, config_file_path: str) -> dict:
+        """
+        Collect the per-tenant settings (rpm / tpm limits and scheduling weight)
+        of users (from their user_profile), projects (from project_list) and
+        orgs (from org_list).
+
+        Returns:
+            dict: {"user": {id: settings}, "project": {project: settings}, "org": {org: settings}}
+        """
+        config: dict = self.get_config(config_file_path=config_file_path)
+
+        tenant_configs = {"user": {}, "project": {}, "org": {}}
+        for user in config.get("user_list", None) or []:
+            user_profile = user['user_profile']
+            tenant_configs["user"][user_profile['id']] = {
+                "rpm": user_profile.get("rpm"),
+                "tpm": user_profile.get("tpm"),
+            }
+        for level in ("project", "org"):
+            for entry in config.get(f"{level}_list", None) or []:
+                tenant_configs[level][entry[level]] = {
+                    "rpm": entry.get("rpm"),
+                    "tpm": entry.get("tpm"),
+                    "weight": entry.get("weight", 1),
+                }
+        return tenant_configs